@@ -3,7 +3,7 @@
 Dependencies:
     - python 3.8
 
-The librosa requires libsndfile.
+The soundfile requires libsndfile.
     macOS) brew install libsndfile
     ubuntu) apt install libsndfile1
 
@@ -14,17 +14,18 @@ Before executing this script, you should compile protobuf files:
 Usage:
     $ python async_streaming_recognize.py --api_key <AIQ api key>
 """
-from typing import Generator
-import sys
+from typing import AsyncGenerator, Optional
 import asyncio
+import concurrent.futures
+import sys
 
 from absl import flags
-import librosa
-import numpy as np
 
 from google.speech.v1 import cloud_speech_pb2
 from google.speech.v1 import cloud_speech_pb2_grpc
+import audio_utils
 import grpc_utils
+import stream_utils
 import utils
 
 flags.DEFINE_string('api_url', 'aiq.skelterlabs.com:443', 'AIQ portal address.')
@@ -36,22 +37,66 @@ flags.DEFINE_boolean(
     'Stream request should return temporary results that '
     'may be refined at a later time.')
 flags.DEFINE_list('speech_context_phrases', None, 'Phrases for speech context')
+flags.DEFINE_integer('chunk_ms', 32, 'Duration of each audio chunk in ms.')
+flags.DEFINE_float(
+    'realtime_factor', 0.0, 'Send audio at this multiple of real time, '
+    'e.g. 1.0 for live-call speed. Zero sends audio as fast as possible.')
+flags.DEFINE_integer(
+    'max_burst_ms', 0, 'How far ahead of the real time schedule audio may be '
+    'sent when --realtime_factor is set.')
+flags.DEFINE_boolean('skip_silence', False,
+                     'Remove silence from the audio before sending it.')
+flags.DEFINE_float('silence_threshold_db', -40.0,
+                   'Frames quieter than this (dBFS) are treated as silence.')
+flags.DEFINE_integer('silence_padding_ms', 200,
+                     'Duration of silence kept around speech.')
+flags.DEFINE_enum(
+    'encoding', 'LINEAR16', audio_utils.ENCODINGS,
+    'Audio encoding to send. Compressed inputs already in the requested '
+    'encoding are sent as is.')
+flags.DEFINE_integer(
+    'max_resumes', 3, 'Maximum number of times a stream failing with a '
+    'transient error is resumed. Only LINEAR16 audio can be resumed.')
+flags.register_validator('chunk_ms',
+                         lambda value: value > 0,
+                         message='--chunk_ms must be positive.')
+flags.register_validator('realtime_factor',
+                         lambda value: value >= 0,
+                         message='--realtime_factor must not be negative.')
+flags.register_validator('max_burst_ms',
+                         lambda value: value >= 0,
+                         message='--max_burst_ms must not be negative.')
 FLAGS = flags.FLAGS
 
 SR = 16000
 
 
-def generate_requests(
+async def generate_requests(
     audio_path: str,
     config: cloud_speech_pb2.StreamingRecognitionConfig,
-    chunk_size: int = 1024
-) -> Generator[cloud_speech_pb2.StreamingRecognizeRequest, None, None]:
-    """Generate chunks of 16kHz audio encoded as LINEAR16.
+    chunk_ms: int = 32,
+    realtime_factor: float = 0.0,
+    max_burst_ms: int = 0,
+    silence_remover: Optional[audio_utils.SilenceRemover] = None,
+    encoding: str = 'LINEAR16',
+    executor: Optional[concurrent.futures.ThreadPoolExecutor] = None,
+) -> AsyncGenerator[cloud_speech_pb2.StreamingRecognizeRequest, None]:
+    """Asynchronously generate chunks of 16kHz audio.
+
+    Decoding and resampling run on `executor` so that they never block the
+    event loop driving the other streams.
 
     Args:
         audio_path: Audio file path.
         config: StreamingRecognitionConfig object.
-        chunk_size: Size of each chunk in bytes.
+        chunk_ms: Duration of each chunk in milliseconds.
+        realtime_factor: Send audio at this multiple of real time. Zero or less
+            sends audio as fast as possible.
+        max_burst_ms: How far ahead of the real time schedule audio may be sent.
+        silence_remover: If given, silence is removed before sending.
+        encoding: Name of the `RecognitionConfig.AudioEncoding` to send.
+        executor: Thread pool executor running the decoder. Defaults to the
+            default executor of the running loop.
 
     Yields:
         StreamingRecognizeRequest objects.
@@ -60,15 +105,16 @@ def generate_requests(
     # The first request should hold config only.
     yield cloud_speech_pb2.StreamingRecognizeRequest(streaming_config=config)
 
-    content, sample_rate = librosa.load(audio_path, sr=SR)
-    del sample_rate
-    if content.dtype in (np.float32, np.float64):
-        content = (content * np.iinfo(np.int16).max).astype(np.int16)
-    content = content.tobytes()
-
-    for from_idx in range(0, len(content), chunk_size):
-        yield cloud_speech_pb2.StreamingRecognizeRequest(
-            audio_content=content[from_idx:from_idx + chunk_size])
+    async for chunk in audio_utils.stream_audio_content_async(
+            audio_path,
+            chunk_ms,
+            SR,
+            encoding=encoding,
+            realtime_factor=realtime_factor,
+            max_burst_ms=max_burst_ms,
+            silence_remover=silence_remover,
+            executor=executor):
+        yield cloud_speech_pb2.StreamingRecognizeRequest(audio_content=chunk)
 
 
 async def main():
@@ -86,7 +132,8 @@ async def main():
     config = cloud_speech_pb2.RecognitionConfig(
         enable_word_time_offsets=True,
         # pylint: disable=no-member
-        encoding=cloud_speech_pb2.RecognitionConfig.AudioEncoding.LINEAR16,
+        encoding=cloud_speech_pb2.RecognitionConfig.AudioEncoding.Value(
+            FLAGS.encoding),
         language_code='ko-KR',
         sample_rate_hertz=16000,
         speech_contexts=speech_contexts,
@@ -96,14 +143,42 @@ async def main():
         interim_results=FLAGS.interim_results,
     )
 
-    request_generator = generate_requests(FLAGS.audio_path, streaming_config)
-    response_generator = stub.StreamingRecognize(request_generator)
+    silence_remover = None
+    if FLAGS.skip_silence:
+        silence_remover = audio_utils.SilenceRemover(
+            SR, FLAGS.silence_threshold_db, FLAGS.silence_padding_ms)
+    request_generator = generate_requests(
+        FLAGS.audio_path,
+        streaming_config,
+        chunk_ms=FLAGS.chunk_ms,
+        realtime_factor=FLAGS.realtime_factor,
+        max_burst_ms=FLAGS.max_burst_ms,
+        silence_remover=silence_remover,
+        encoding=FLAGS.encoding)
+    # The stream is resumed from the last final result after transient
+    # failures.
+    response_generator = stream_utils.streaming_recognize_async(
+        stub,
+        request_generator,
+        max_resumes=FLAGS.max_resumes if FLAGS.encoding == 'LINEAR16' else 0,
+        bytes_per_second=SR * audio_utils.SAMPLE_WIDTH)
 
     async for response in response_generator:
         for result in response.results:
             print(f'Finished: {result.is_final}')
+            if silence_remover is not None:
+                # Map the timestamps back to the time of the original audio.
+                utils.map_result_times(result,
+                                       silence_remover.offset_map.to_original)
             utils.print_recognition_result(result)
 
+    if silence_remover is not None:
+        print(
+            f'Skipped {silence_remover.removed_seconds:.2f}s of '
+            f'{silence_remover.total_seconds:.2f}s as silence '
+            f'({silence_remover.removed_bytes} bytes)',
+            file=sys.stderr)
+
 
 if __name__ == '__main__':
     FLAGS(sys.argv)
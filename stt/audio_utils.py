@@ -0,0 +1,1083 @@
+"""Audio utilities for AIQ.STT APIs."""
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import concurrent.futures
+import importlib
+import io
+import os
+import struct
+import threading
+import time
+from typing import (AsyncIterable, AsyncIterator, Iterable, Iterator, List,
+                    Optional, Tuple, Union)
+
+
+class _LazyModule:
+    """Module which is imported on first attribute access.
+
+    numpy, soundfile and soxr take longer to import than a short Recognize
+    call, while 16kHz mono PCM16 WAV files sent as LINEAR16 need none of them.
+    The first access may come from several executor threads at once, so the
+    import is done once under a lock, by `importlib.import_module`, which
+    raises ImportError if the module is missing.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._module or self._load(), attr)
+
+
+np = _LazyModule('numpy')
+soundfile = _LazyModule('soundfile')
+soxr = _LazyModule('soxr')
+
+SR = 16000
+# LINEAR16 uses 2 bytes per sample.
+SAMPLE_WIDTH = 2
+# Number of frames decoded at once. 4096 frames are less than 100ms of audio
+# for the usual sample rates, so the first chunk is ready almost immediately.
+BLOCK_SIZE = 4096
+# Number of decoded blocks buffered ahead of the consumer in async streams.
+MAX_QUEUE_SIZE = 8
+# Frame duration used for energy based silence detection.
+FRAME_MS = 10
+# Size of the reads when a file is sent as is.
+READ_SIZE = 65536
+
+# libsndfile (format, subtype) of the compressed `RecognitionConfig`
+# encodings that can be produced on the client.
+COMPRESSED_ENCODINGS = {
+    'FLAC': ('FLAC', 'PCM_16'),
+    'OGG_OPUS': ('OGG', 'OPUS'),
+}
+ENCODINGS = ['LINEAR16'] + list(COMPRESSED_ENCODINGS)
+
+
+def to_int16(samples: np.ndarray) -> np.ndarray:
+    """Convert float samples in [-1, 1] to 16-bit PCM samples."""
+    if samples.dtype in (np.float32, np.float64):
+        samples = (samples * np.iinfo(np.int16).max).astype(np.int16)
+    return samples
+
+
+def chunk_size_from_ms(chunk_ms: int, sample_rate: int = SR) -> int:
+    """Return the size in bytes of `chunk_ms` milliseconds of LINEAR16 audio.
+
+    Raises:
+        ValueError: The chunk is shorter than a sample.
+    """
+    chunk_size = sample_rate * chunk_ms // 1000 * SAMPLE_WIDTH
+    if chunk_size <= 0:
+        raise ValueError(f'Chunk of {chunk_ms}ms is shorter than a sample')
+    return chunk_size
+
+
+def _find_pcm16_wav_data(audio_path: str,
+                         sample_rate: int,
+                         num_channels: int = 1) -> Optional[Tuple[int, int]]:
+    """Sniff a WAV file that is already 16-bit PCM at `sample_rate`.
+
+    Args:
+        audio_path: Audio file path.
+        sample_rate: Required sample rate.
+        num_channels: Required number of interleaved channels.
+
+    Returns:
+        (offset, size) in bytes of the data chunk, or None if the file is not
+        such a WAV file.
+    """
+    try:
+        with open(audio_path, 'rb') as audio_file:
+            header = audio_file.read(12)
+            if header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+                return None
+            is_pcm16 = False
+            while True:
+                chunk_header = audio_file.read(8)
+                if len(chunk_header) < 8:
+                    return None
+                chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+                if chunk_id == b'fmt ':
+                    fmt = audio_file.read(chunk_size + chunk_size % 2)
+                    audio_format, channels, rate, _, _, bits = struct.unpack(
+                        '<HHIIHH', fmt[:16])
+                    if audio_format == 0xFFFE and len(fmt) >= 26:
+                        # WAVE_FORMAT_EXTENSIBLE keeps the format in SubFormat.
+                        audio_format = struct.unpack('<H', fmt[24:26])[0]
+                    is_pcm16 = (audio_format == 1 and
+                                channels == num_channels and
+                                rate == sample_rate and bits == 16)
+                elif chunk_id == b'data':
+                    if not is_pcm16:
+                        return None
+                    offset = audio_file.tell()
+                    size = min(chunk_size,
+                               os.path.getsize(audio_path) - offset)
+                    return offset, size - size % (SAMPLE_WIDTH *
+                                                  num_channels)
+                else:
+                    audio_file.seek(chunk_size + chunk_size % 2, io.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+
+
+def read_pcm16_wav(audio_path: str,
+                   sample_rate: int = SR) -> Optional[np.ndarray]:
+    """Memory-map the samples of a mono 16-bit PCM WAV file at `sample_rate`.
+
+    Such files need neither decoding nor resampling, so their samples are
+    used in place without being read into memory up front.
+
+    Args:
+        audio_path: Audio file path.
+        sample_rate: Required sample rate.
+
+    Returns:
+        Read-only int16 array backed by the file, or None if the file needs
+        to be decoded.
+    """
+    data = _find_pcm16_wav_data(audio_path, sample_rate)
+    if data is None:
+        return None
+    offset, size = data
+    if not size:
+        return np.zeros(0, dtype=np.int16)
+    return np.memmap(audio_path,
+                     dtype='<i2',
+                     mode='r',
+                     offset=offset,
+                     shape=(size // SAMPLE_WIDTH,))
+
+
+def _load_blocks(audio_path: str, sample_rate: int) -> Iterator[np.ndarray]:
+    """Decode the whole file with librosa and yield it as a single block.
+
+    Used for formats that libsndfile cannot read block by block.
+    """
+    import librosa  # pylint: disable=import-outside-toplevel
+    content, _ = librosa.load(audio_path, sr=sample_rate)
+    yield content
+
+
+def stream_audio(audio_path: str,
+                 sample_rate: int = SR,
+                 block_size: int = BLOCK_SIZE) -> Iterator[np.ndarray]:
+    """Decode, downmix and resample audio block by block.
+
+    Unlike `librosa.load`, only one block of the file is held in memory at a
+    time, so the first block is available right away regardless of the file
+    length.
+
+    Args:
+        audio_path: Audio file path.
+        sample_rate: Target sample rate.
+        block_size: Number of frames to decode at once.
+
+    Yields:
+        Mono 16-bit PCM samples at `sample_rate`.
+    """
+    samples = read_pcm16_wav(audio_path, sample_rate)
+    if samples is not None:
+        for from_idx in range(0, len(samples), block_size):
+            yield samples[from_idx:from_idx + block_size]
+        return
+
+    try:
+        audio_file = soundfile.SoundFile(audio_path)
+    except RuntimeError:
+        for block in _load_blocks(audio_path, sample_rate):
+            yield to_int16(block)
+        return
+
+    with audio_file:
+        resampler = None
+        if audio_file.samplerate != sample_rate:
+            resampler = soxr.ResampleStream(audio_file.samplerate, sample_rate,
+                                            1)
+
+        for block in audio_file.blocks(blocksize=block_size,
+                                       dtype='float32',
+                                       always_2d=True):
+            # Downmix to mono the same way librosa does.
+            block = block.mean(axis=1, dtype=np.float32)
+            if resampler is not None:
+                block = resampler.resample_chunk(block)
+            if block.size:
+                yield to_int16(block)
+
+        if resampler is not None:
+            block = resampler.resample_chunk(np.zeros(0, dtype=np.float32),
+                                             last=True)
+            if block.size:
+                yield to_int16(block)
+
+
+def load_audio(audio_path: str, sample_rate: int = SR) -> np.ndarray:
+    """Decode the whole file into mono 16-bit PCM samples at `sample_rate`."""
+    samples = read_pcm16_wav(audio_path, sample_rate)
+    if samples is not None:
+        return samples
+    blocks = list(stream_audio(audio_path, sample_rate))
+    if not blocks:
+        return np.zeros(0, dtype=np.int16)
+    return np.concatenate(blocks)
+
+
+def load_channels(audio_path: str, sample_rate: int = SR) -> List[np.ndarray]:
+    """Decode each channel of the file into 16-bit PCM samples at `sample_rate`.
+
+    Interleaved 16-bit PCM WAV files at `sample_rate` are memory-mapped, and
+    other files are decoded and resampled once into a frames by channels
+    array. The channels are strided views of that array, so no channel is
+    copied before its chunks are sent.
+
+    Args:
+        audio_path: Audio file path.
+        sample_rate: Target sample rate.
+
+    Returns:
+        List of int16 samples of each channel.
+    """
+    try:
+        num_channels = soundfile.info(audio_path).channels
+    except RuntimeError:
+        import librosa  # pylint: disable=import-outside-toplevel
+        content, _ = librosa.load(audio_path, sr=sample_rate, mono=False)
+        samples = to_int16(np.atleast_2d(content).T)
+        return [samples[:, channel] for channel in range(samples.shape[1])]
+
+    data = _find_pcm16_wav_data(audio_path, sample_rate, num_channels)
+    if data is not None:
+        offset, size = data
+        if not size:
+            return [np.zeros(0, dtype=np.int16)] * num_channels
+        samples = np.memmap(audio_path,
+                            dtype='<i2',
+                            mode='r',
+                            offset=offset,
+                            shape=(size // SAMPLE_WIDTH // num_channels,
+                                   num_channels))
+    else:
+        content, file_rate = soundfile.read(audio_path,
+                                            dtype='float32',
+                                            always_2d=True)
+        if file_rate != sample_rate:
+            content = soxr.resample(content, file_rate, sample_rate)
+        samples = to_int16(content)
+    return [samples[:, channel] for channel in range(num_channels)]
+
+
+def frame_energy_db(samples: np.ndarray, frame_size: int) -> np.ndarray:
+    """Return the RMS energy of each frame in dBFS.
+
+    Args:
+        samples: 16-bit PCM samples. A trailing partial frame is ignored.
+        frame_size: Number of samples per frame.
+
+    Returns:
+        Array of the energy of each frame.
+    """
+    num_frames = len(samples) // frame_size
+    frames = samples[:num_frames * frame_size].reshape(num_frames, frame_size)
+    frames = frames.astype(np.float32) / np.iinfo(np.int16).max
+    rms = np.sqrt(np.mean(np.square(frames), axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def split_on_silence(samples: np.ndarray,
+                     sample_rate: int = SR,
+                     max_segment_seconds: float = 55.0,
+                     min_silence_ms: int = 300) -> List[Tuple[int, int]]:
+    """Split audio into segments no longer than `max_segment_seconds`.
+
+    Each split point is placed in the middle of the quietest `min_silence_ms`
+    long region of the second half of the segment, so that words are not cut
+    as long as there is any pause.
+
+    Args:
+        samples: 16-bit PCM samples.
+        sample_rate: Sample rate of the samples.
+        max_segment_seconds: Maximum duration of each segment.
+        min_silence_ms: Duration of the pause to look for.
+
+    Returns:
+        List of (start, end) sample indices of the segments.
+    """
+    frame_size = sample_rate * FRAME_MS // 1000
+    max_frames = int(max_segment_seconds * 1000) // FRAME_MS
+    window = max(1, min_silence_ms // FRAME_MS)
+    energy = frame_energy_db(samples, frame_size)
+    # Mean energy of the `window` frames centered at each frame.
+    smoothed = np.convolve(energy, np.ones(window) / window, mode='same')
+
+    segments = []
+    start_frame = 0
+    while len(energy) - start_frame > max_frames:
+        search_from = start_frame + max_frames // 2
+        search_to = start_frame + max_frames
+        split_frame = search_from + int(
+            np.argmin(smoothed[search_from:search_to]))
+        segments.append((start_frame * frame_size, split_frame * frame_size))
+        start_frame = split_frame
+    segments.append((start_frame * frame_size, len(samples)))
+    return segments
+
+
+class OffsetMap:
+    """Map time in audio with silence removed back to the original audio.
+
+    Regions are added by the thread removing silence while results are mapped
+    on the thread reading the responses, so both are guarded by a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Start time of each kept region in the compacted and original audio.
+        self._compact_starts = [0.0]
+        self._original_starts = [0.0]
+
+    def add(self, compact_start: float, original_start: float):
+        """Record that `compact_start` corresponds to `original_start`."""
+        with self._lock:
+            self._compact_starts.append(compact_start)
+            self._original_starts.append(original_start)
+
+    def to_original(self, compact_time: float) -> float:
+        """Convert time in the compacted audio to time in the original."""
+        with self._lock:
+            idx = bisect.bisect_right(self._compact_starts, compact_time) - 1
+            return (self._original_starts[idx] + compact_time -
+                    self._compact_starts[idx])
+
+
+class SilenceRemover:
+    """Remove silence from 16-bit PCM audio block by block.
+
+    Frames quieter than `threshold_db` are dropped unless they are within
+    `padding_ms` of a louder frame, so each pause is compressed to at most
+    twice the padding. Deciding a frame requires `padding_ms` of lookahead,
+    hence the output lags behind the input by that much until `flush`.
+    """
+
+    def __init__(self,
+                 sample_rate: int = SR,
+                 threshold_db: float = -40.0,
+                 padding_ms: int = 200):
+        """Initialize the silence remover.
+
+        Args:
+            sample_rate: Sample rate of the audio.
+            threshold_db: Frames below this energy in dBFS are silence.
+            padding_ms: Duration of silence kept around speech.
+        """
+        self._sample_rate = sample_rate
+        self._threshold_db = threshold_db
+        self._frame_size = sample_rate * FRAME_MS // 1000
+        self._padding = padding_ms // FRAME_MS
+        self._kernel = np.ones(2 * self._padding + 1)
+        # Partial frame carried over to the next block.
+        self._pending = np.zeros(0, dtype=np.int16)
+        # Frames waiting for lookahead, and speech flags of the last decided
+        # frames used as the left context of the next decision.
+        self._undecided = np.zeros((0, self._frame_size), dtype=np.int16)
+        self._undecided_flags = np.zeros(0, dtype=bool)
+        self._history = np.zeros(self._padding, dtype=bool)
+        self._num_decided = 0
+        self._num_kept = 0
+        self._last_kept = False
+        self.offset_map = OffsetMap()
+
+    @property
+    def total_seconds(self) -> float:
+        """Duration of the audio decided so far."""
+        return self._num_decided * self._frame_size / self._sample_rate
+
+    @property
+    def removed_seconds(self) -> float:
+        """Duration of the silence removed so far."""
+        num_removed = self._num_decided - self._num_kept
+        return num_removed * self._frame_size / self._sample_rate
+
+    @property
+    def removed_bytes(self) -> int:
+        """Size of the LINEAR16 audio removed so far."""
+        num_removed = self._num_decided - self._num_kept
+        return num_removed * self._frame_size * SAMPLE_WIDTH
+
+    def _decide(self, frames: np.ndarray, flags: np.ndarray,
+                lookahead: np.ndarray) -> np.ndarray:
+        """Return the kept samples among the frames to be decided."""
+        if not len(flags):
+            return np.zeros(0, dtype=np.int16)
+        context = np.concatenate([self._history, flags, lookahead])
+        keep = np.convolve(context, self._kernel,
+                           mode='same')[self._padding:self._padding +
+                                        len(flags)] > 0
+        self._history = context[len(flags):len(flags) + self._padding]
+
+        # Record where each kept region starts in both time lines.
+        starts = np.flatnonzero(keep & ~np.concatenate([[self._last_kept],
+                                                        keep[:-1]]))
+        for idx in starts:
+            self.offset_map.add(
+                (self._num_kept + np.count_nonzero(keep[:idx])) *
+                self._frame_size / self._sample_rate,
+                (self._num_decided + idx) * self._frame_size /
+                self._sample_rate)
+        self._last_kept = bool(keep[-1])
+        self._num_decided += len(keep)
+        self._num_kept += int(np.count_nonzero(keep))
+        return frames[keep].reshape(-1)
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """Feed a block of samples and return the samples decided to keep."""
+        samples = np.concatenate([self._pending, samples])
+        num_frames = len(samples) // self._frame_size
+        self._pending = samples[num_frames * self._frame_size:]
+        new_frames = samples[:num_frames * self._frame_size].reshape(
+            num_frames, self._frame_size)
+        new_flags = frame_energy_db(new_frames.reshape(-1),
+                                    self._frame_size) > self._threshold_db
+
+        frames = np.concatenate([self._undecided, new_frames])
+        flags = np.concatenate([self._undecided_flags, new_flags])
+        num_ready = len(flags) - self._padding
+        if num_ready <= 0:
+            self._undecided, self._undecided_flags = frames, flags
+            return np.zeros(0, dtype=np.int16)
+
+        self._undecided = frames[num_ready:]
+        self._undecided_flags = flags[num_ready:]
+        return self._decide(frames[:num_ready], flags[:num_ready],
+                            flags[num_ready:])
+
+    def flush(self) -> np.ndarray:
+        """Decide the remaining frames and return the samples to keep."""
+        kept = self._decide(self._undecided, self._undecided_flags,
+                            np.zeros(self._padding, dtype=bool))
+        if self._last_kept:
+            kept = np.concatenate([kept, self._pending])
+        self._undecided = self._undecided[:0]
+        self._undecided_flags = self._undecided_flags[:0]
+        self._pending = self._pending[:0]
+        return kept
+
+    def remove(self, samples: np.ndarray) -> np.ndarray:
+        """Remove silence from the whole audio at once."""
+        return np.concatenate([self.process(samples), self.flush()])
+
+
+def remove_silence(blocks: Iterable[np.ndarray],
+                   silence_remover: SilenceRemover) -> Iterator[np.ndarray]:
+    """Yield blocks with silence removed by `silence_remover`."""
+    for block in blocks:
+        block = silence_remover.process(block)
+        if block.size:
+            yield block
+    block = silence_remover.flush()
+    if block.size:
+        yield block
+
+
+def _pop_chunks(buffer: bytearray, chunk_size: int) -> List[bytes]:
+    """Pop all complete chunks of `chunk_size` bytes from the buffer."""
+    num_bytes = len(buffer) - len(buffer) % chunk_size
+    chunks = [
+        bytes(buffer[from_idx:from_idx + chunk_size])
+        for from_idx in range(0, num_bytes, chunk_size)
+    ]
+    del buffer[:num_bytes]
+    return chunks
+
+
+def _rechunk(blocks: Iterable[bytes], chunk_size: int) -> Iterator[bytes]:
+    """Split a stream of byte blocks into chunks of `chunk_size` bytes."""
+    buffer = bytearray()
+    for block in blocks:
+        buffer += block
+        yield from _pop_chunks(buffer, chunk_size)
+    if buffer:
+        yield bytes(buffer)
+
+
+async def _rechunk_async(blocks: AsyncIterable[bytes],
+                         chunk_size: int) -> AsyncIterator[bytes]:
+    """Split an async stream of byte blocks into chunks of `chunk_size`."""
+    buffer = bytearray()
+    async for block in blocks:
+        buffer += block
+        for chunk in _pop_chunks(buffer, chunk_size):
+            yield chunk
+    if buffer:
+        yield bytes(buffer)
+
+
+async def iterate_in_executor(
+    iterator: Iterator,
+    executor: Optional[concurrent.futures.ThreadPoolExecutor] = None,
+    max_queue_size: int = MAX_QUEUE_SIZE,
+) -> AsyncIterator:
+    """Asynchronously yield the items of a blocking iterator.
+
+    Each item is produced on `executor` and handed over through a bounded
+    queue. The event loop never runs the iterator itself, and a thread is only
+    occupied while an item is being produced, so many streams can share one
+    loop and one executor.
+
+    Args:
+        iterator: Blocking iterator, e.g. a decoder yielding audio blocks.
+        executor: Thread pool executor running the iterator. Defaults to the
+            default executor of the running loop.
+        max_queue_size: Maximum number of items produced ahead.
+
+    Yields:
+        Items of the iterator, which is closed once they are consumed or the
+        consumer stops.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=max_queue_size)
+    end = object()
+    # Serializes the steps of the iterator with closing it, as a step of a
+    # cancelled producer may still be running on the executor.
+    lock = threading.Lock()
+
+    def step():
+        with lock:
+            return next(iterator, end)
+
+    def close():
+        with lock:
+            iterator.close()
+
+    async def produce():
+        try:
+            while True:
+                item = await loop.run_in_executor(executor, step)
+                if item is end:
+                    break
+                await queue.put(item)
+        except Exception as e:  # pylint: disable=broad-except
+            await queue.put(e)
+            return
+        await queue.put(end)
+
+    producer = loop.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is end:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
+        # Release the resources of a consumer stopping early, e.g. the file
+        # of a decoder, instead of leaving them to the garbage collector.
+        if hasattr(iterator, 'close'):
+            await asyncio.shield(loop.run_in_executor(executor, close))
+
+
+def _pcm_blocks(audio_path: str, sample_rate: int,
+                silence_remover: Optional[SilenceRemover]) -> Iterator[bytes]:
+    """Yield bytes of decoded LINEAR16 blocks."""
+    data = _find_pcm16_wav_data(audio_path, sample_rate)
+    if data is not None and silence_remover is None:
+        yield from _file_blocks(audio_path, *data)
+        return
+
+    blocks = stream_audio(audio_path, sample_rate)
+    if silence_remover is not None:
+        blocks = remove_silence(blocks, silence_remover)
+    for block in blocks:
+        yield block.tobytes()
+
+
+def stream_chunks(
+    audio_path: str,
+    chunk_size: int,
+    sample_rate: int = SR,
+    silence_remover: Optional[SilenceRemover] = None,
+) -> Iterator[bytes]:
+    """Yield 16-bit PCM audio in chunks of `chunk_size` bytes.
+
+    Args:
+        audio_path: Audio file path.
+        chunk_size: Size of each chunk in bytes. The last chunk may be shorter.
+        sample_rate: Target sample rate.
+        silence_remover: If given, silence is removed before chunking.
+
+    Yields:
+        Bytes of LINEAR16 audio.
+    """
+    return _rechunk(_pcm_blocks(audio_path, sample_rate, silence_remover),
+                    chunk_size)
+
+
+def stream_chunks_async(
+    audio_path: str,
+    chunk_size: int,
+    sample_rate: int = SR,
+    executor: Optional[concurrent.futures.ThreadPoolExecutor] = None,
+    max_queue_size: int = MAX_QUEUE_SIZE,
+    silence_remover: Optional[SilenceRemover] = None,
+) -> AsyncIterator[bytes]:
+    """Asynchronously yield 16-bit PCM audio in chunks of `chunk_size` bytes.
+
+    Blocks are decoded and resampled on `executor` via `iterate_in_executor`.
+
+    Args:
+        audio_path: Audio file path.
+        chunk_size: Size of each chunk in bytes. The last chunk may be shorter.
+        sample_rate: Target sample rate.
+        executor: Thread pool executor running the decoder. Defaults to the
+            default executor of the running loop.
+        max_queue_size: Maximum number of decoded blocks buffered ahead.
+        silence_remover: If given, silence is removed on the executor before
+            chunking.
+
+    Returns:
+        Async iterator of bytes of LINEAR16 audio.
+    """
+    blocks = _pcm_blocks(audio_path, sample_rate, silence_remover)
+    return _rechunk_async(
+        iterate_in_executor(blocks, executor, max_queue_size), chunk_size)
+
+
+class Pacer:
+    """Schedule audio chunks to be sent at a multiple of real time.
+
+    Chunks are sent on an absolute schedule derived from the amount of audio
+    already sent, so sleep jitter does not accumulate. The sender may run ahead
+    of the schedule by at most `max_burst_ms`, which bounds the amount of audio
+    outstanding on top of gRPC flow control.
+    """
+
+    def __init__(self,
+                 realtime_factor: float = 1.0,
+                 max_burst_ms: int = 0,
+                 sample_rate: int = SR,
+                 bytes_per_second: Optional[float] = None):
+        """Initialize the pacer.
+
+        Args:
+            realtime_factor: Sending speed relative to real time. For example,
+                1.0 sends audio as fast as it is spoken and 2.0 twice as fast.
+                Zero or less disables pacing.
+            max_burst_ms: How far ahead of the schedule the sender may run.
+            sample_rate: Sample rate of the LINEAR16 audio.
+            bytes_per_second: Average bitrate of the audio in bytes, if it is
+                not LINEAR16 at `sample_rate`.
+        """
+        self._realtime_factor = realtime_factor
+        self._max_burst = max_burst_ms / 1000
+        self._bytes_per_second = (bytes_per_second or
+                                  sample_rate * SAMPLE_WIDTH)
+        self._start_time = None
+        self._sent_seconds = 0.0
+
+    def delay(self, num_bytes: int) -> float:
+        """Return how many seconds to wait before sending `num_bytes` bytes."""
+        if self._realtime_factor <= 0:
+            return 0.0
+        now = time.monotonic()
+        if self._start_time is None:
+            self._start_time = now
+        elapsed = self._sent_seconds / self._realtime_factor
+        due_time = self._start_time + elapsed - self._max_burst
+        self._sent_seconds += num_bytes / self._bytes_per_second
+        return max(0.0, due_time - now)
+
+
+def pace(chunks: Iterable[bytes], pacer: Pacer) -> Iterator[bytes]:
+    """Yield chunks no faster than the pacer allows."""
+    for chunk in chunks:
+        delay = pacer.delay(len(chunk))
+        if delay:
+            time.sleep(delay)
+        yield chunk
+
+
+async def pace_async(chunks: AsyncIterable[bytes],
+                     pacer: Pacer) -> AsyncIterator[bytes]:
+    """Asynchronously yield chunks no faster than the pacer allows."""
+    async for chunk in chunks:
+        delay = pacer.delay(len(chunk))
+        if delay:
+            await asyncio.sleep(delay)
+        yield chunk
+
+
+class _EncodedSink:
+    """Writable file object collecting what an encoder writes.
+
+    libsndfile seeks back to patch the header when the file is closed. Bytes
+    that were already taken are left as they are, since a stream can not be
+    rewritten. Streaming decoders do not depend on those header fields.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offset = 0  # Offset of the first byte in the buffer.
+        self._position = 0
+
+    def read(self, size=-1):
+        del size  # Unused
+        return b''
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._offset + len(self._buffer)
+        self._position = offset
+        return self._position
+
+    def write(self, data):
+        data = bytes(data)
+        size = len(data)
+        start = self._position - self._offset
+        if start < 0:
+            # Skip the part that was already taken.
+            data = data[-start:]
+            start = 0
+        self._buffer[start:start + len(data)] = data
+        self._position += size
+        return size
+
+    def take(self) -> bytes:
+        """Return and forget the bytes written since the last call."""
+        data = bytes(self._buffer)
+        self._offset += len(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+class StreamEncoder:
+    """Encode 16-bit mono PCM audio into FLAC or OGG_OPUS chunk by chunk."""
+
+    def __init__(self, encoding: str, sample_rate: int = SR):
+        """Initialize the encoder.
+
+        Args:
+            encoding: Name of the `RecognitionConfig.AudioEncoding`.
+            sample_rate: Sample rate of the audio.
+        """
+        audio_format, subtype = COMPRESSED_ENCODINGS[encoding]
+        self._sink = _EncodedSink()
+        self._file = soundfile.SoundFile(self._sink,
+                                         mode='w',
+                                         samplerate=sample_rate,
+                                         channels=1,
+                                         format=audio_format,
+                                         subtype=subtype)
+
+    def encode(self, samples: Union[bytes, np.ndarray]) -> bytes:
+        """Feed PCM samples and return the encoded bytes available so far."""
+        if isinstance(samples, (bytes, bytearray)):
+            samples = np.frombuffer(samples, dtype=np.int16)
+        self._file.write(samples)
+        return self._sink.take()
+
+    def flush(self) -> bytes:
+        """Finish the stream and return the remaining encoded bytes."""
+        self._file.close()
+        return self._sink.take()
+
+
+def encode_audio(samples: Union[bytes, np.ndarray],
+                 encoding: str,
+                 sample_rate: int = SR) -> bytes:
+    """Encode the whole 16-bit PCM audio with the given encoding."""
+    if isinstance(samples, bytes):
+        if encoding == 'LINEAR16':
+            return samples
+        samples = np.frombuffer(samples, dtype='<i2')
+    if encoding == 'LINEAR16':
+        return samples.tobytes()
+    audio_format, subtype = COMPRESSED_ENCODINGS[encoding]
+    output = io.BytesIO()
+    soundfile.write(output,
+                    samples,
+                    sample_rate,
+                    subtype=subtype,
+                    format=audio_format)
+    return output.getvalue()
+
+
+def encode_chunks(chunks: Iterable[bytes], encoding: str,
+                  sample_rate: int = SR) -> Iterator[bytes]:
+    """Encode a stream of LINEAR16 chunks, skipping empty encoder outputs."""
+    encoder = StreamEncoder(encoding, sample_rate)
+    for chunk in chunks:
+        data = encoder.encode(chunk)
+        if data:
+            yield data
+    data = encoder.flush()
+    if data:
+        yield data
+
+
+async def encode_chunks_async(chunks: AsyncIterable[bytes],
+                              encoding: str,
+                              sample_rate: int = SR) -> AsyncIterator[bytes]:
+    """Encode an async stream of LINEAR16 chunks.
+
+    Chunks are small, so they are encoded on the event loop; the heavy
+    decoding and resampling still runs on the executor.
+    """
+    encoder = StreamEncoder(encoding, sample_rate)
+    async for chunk in chunks:
+        data = encoder.encode(chunk)
+        if data:
+            yield data
+    data = encoder.flush()
+    if data:
+        yield data
+
+
+def read_audio_content(
+    audio_path: str,
+    sample_rate: int = SR,
+    encoding: str = 'LINEAR16',
+    silence_remover: Optional[SilenceRemover] = None,
+) -> bytes:
+    """Read the whole audio content to be sent to Recognize.
+
+    Mono 16-bit PCM WAV files at `sample_rate` are memory-mapped and compressed
+    files already in `encoding` are sent as is. Only other files are decoded
+    and resampled.
+
+    Args:
+        audio_path: Audio file path.
+        sample_rate: Target sample rate.
+        encoding: Name of the `RecognitionConfig.AudioEncoding` to send.
+        silence_remover: If given, silence is removed from the audio.
+
+    Returns:
+        Bytes of audio content.
+    """
+    if silence_remover is None and encoding == 'LINEAR16':
+        data = _find_pcm16_wav_data(audio_path, sample_rate)
+        if data is not None:
+            offset, size = data
+            with open(audio_path, 'rb') as audio_file:
+                audio_file.seek(offset)
+                return audio_file.read(size)
+
+    if silence_remover is None and can_pass_through(audio_path, encoding,
+                                                    sample_rate):
+        with open(audio_path, 'rb') as audio_file:
+            return audio_file.read()
+
+    samples = load_audio(audio_path, sample_rate)
+    if silence_remover is not None:
+        samples = silence_remover.remove(samples)
+    return encode_audio(samples, encoding, sample_rate)
+
+
+def can_pass_through(audio_path: str, encoding: str,
+                     sample_rate: int = SR) -> bool:
+    """Return whether the file can be sent as is with the given encoding.
+
+    A file qualifies when it is already mono audio at `sample_rate` in the
+    requested compressed encoding, so decoding and re-encoding is pointless.
+    """
+    if encoding not in COMPRESSED_ENCODINGS:
+        return False
+    try:
+        info = soundfile.info(audio_path)
+    except RuntimeError:
+        return False
+    return ((info.format, info.subtype) == COMPRESSED_ENCODINGS[encoding] and
+            info.channels == 1 and info.samplerate == sample_rate)
+
+
+def _file_blocks(audio_path: str,
+                 offset: int = 0,
+                 size: Optional[int] = None) -> Iterator[bytes]:
+    """Yield the raw bytes of a file, or of a region of it, in blocks."""
+    with open(audio_path, 'rb') as audio_file:
+        audio_file.seek(offset)
+        while size is None or size > 0:
+            block = audio_file.read(READ_SIZE if size is None else min(
+                READ_SIZE, size))
+            if not block:
+                break
+            if size is not None:
+                size -= len(block)
+            yield block
+
+
+def _file_bytes_per_second(audio_path: str) -> float:
+    """Return the average bitrate of an audio file in bytes."""
+    info = soundfile.info(audio_path)
+    return os.path.getsize(audio_path) / max(info.duration, 1e-3)
+
+
+def stream_audio_content(
+    audio_path: str,
+    chunk_ms: int = 32,
+    sample_rate: int = SR,
+    encoding: str = 'LINEAR16',
+    realtime_factor: float = 0.0,
+    max_burst_ms: int = 0,
+    silence_remover: Optional[SilenceRemover] = None,
+) -> Iterator[bytes]:
+    """Yield audio content to be streamed to StreamingRecognize.
+
+    LINEAR16 chunks of `chunk_ms` are decoded, optionally stripped of silence,
+    paced, and then compressed if a compressed `encoding` is requested. Files
+    already in the requested compressed encoding are sent as is.
+
+    Args:
+        audio_path: Audio file path.
+        chunk_ms: Duration of each chunk in milliseconds.
+        sample_rate: Target sample rate.
+        encoding: Name of the `RecognitionConfig.AudioEncoding` to send.
+        realtime_factor: Send audio at this multiple of real time. Zero or less
+            sends audio as fast as possible.
+        max_burst_ms: How far ahead of the real time schedule audio may be sent.
+        silence_remover: If given, silence is removed before sending.
+
+    Yields:
+        Bytes of audio content.
+    """
+    chunk_size = chunk_size_from_ms(chunk_ms, sample_rate)
+    if silence_remover is None and can_pass_through(audio_path, encoding,
+                                                    sample_rate):
+        bytes_per_second = _file_bytes_per_second(audio_path)
+        chunks = _rechunk(_file_blocks(audio_path),
+                          int(bytes_per_second * chunk_ms / 1000) or 1)
+        pacer = Pacer(realtime_factor, max_burst_ms, sample_rate,
+                      bytes_per_second)
+        yield from pace(chunks, pacer)
+        return
+
+    chunks = stream_chunks(audio_path, chunk_size, sample_rate,
+                           silence_remover)
+    chunks = pace(chunks, Pacer(realtime_factor, max_burst_ms, sample_rate))
+    if encoding in COMPRESSED_ENCODINGS:
+        chunks = encode_chunks(chunks, encoding, sample_rate)
+    yield from chunks
+
+
+def _sample_blocks(samples: np.ndarray,
+                   silence_remover: Optional[SilenceRemover],
+                   block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    """Yield bytes of LINEAR16 samples block by block."""
+    blocks = (samples[from_idx:from_idx + block_size]
+              for from_idx in range(0, len(samples), block_size))
+    if silence_remover is not None:
+        blocks = remove_silence(blocks, silence_remover)
+    for block in blocks:
+        # Only a block of a strided channel view is copied at a time.
+        yield block.tobytes()
+
+
+def stream_samples_content(
+    samples: np.ndarray,
+    chunk_ms: int = 32,
+    sample_rate: int = SR,
+    encoding: str = 'LINEAR16',
+    realtime_factor: float = 0.0,
+    max_burst_ms: int = 0,
+    silence_remover: Optional[SilenceRemover] = None,
+) -> Iterator[bytes]:
+    """Yield audio content of decoded samples to be streamed.
+
+    Same as `stream_audio_content` for samples already in memory, e.g. a
+    channel of `load_channels`.
+
+    Args:
+        samples: 16-bit PCM samples at `sample_rate`.
+        chunk_ms: Duration of each chunk in milliseconds.
+        sample_rate: Sample rate of the samples.
+        encoding: Name of the `RecognitionConfig.AudioEncoding` to send.
+        realtime_factor: Send audio at this multiple of real time. Zero or less
+            sends audio as fast as possible.
+        max_burst_ms: How far ahead of the real time schedule audio may be sent.
+        silence_remover: If given, silence is removed before sending.
+
+    Yields:
+        Bytes of audio content.
+    """
+    chunks = _rechunk(_sample_blocks(samples, silence_remover),
+                      chunk_size_from_ms(chunk_ms, sample_rate))
+    chunks = pace(chunks, Pacer(realtime_factor, max_burst_ms, sample_rate))
+    if encoding in COMPRESSED_ENCODINGS:
+        chunks = encode_chunks(chunks, encoding, sample_rate)
+    yield from chunks
+
+
+async def stream_audio_content_async(
+    audio_path: str,
+    chunk_ms: int = 32,
+    sample_rate: int = SR,
+    encoding: str = 'LINEAR16',
+    realtime_factor: float = 0.0,
+    max_burst_ms: int = 0,
+    silence_remover: Optional[SilenceRemover] = None,
+    executor: Optional[concurrent.futures.ThreadPoolExecutor] = None,
+) -> AsyncIterator[bytes]:
+    """Asynchronously yield audio content to be streamed to StreamingRecognize.
+
+    Same as `stream_audio_content`, but file reads and decoding run on
+    `executor`.
+
+    Args:
+        audio_path: Audio file path.
+        chunk_ms: Duration of each chunk in milliseconds.
+        sample_rate: Target sample rate.
+        encoding: Name of the `RecognitionConfig.AudioEncoding` to send.
+        realtime_factor: Send audio at this multiple of real time. Zero or less
+            sends audio as fast as possible.
+        max_burst_ms: How far ahead of the real time schedule audio may be sent.
+        silence_remover: If given, silence is removed before sending.
+        executor: Thread pool executor running the decoder. Defaults to the
+            default executor of the running loop.
+
+    Yields:
+        Bytes of audio content.
+    """
+    loop = asyncio.get_running_loop()
+    chunk_size = chunk_size_from_ms(chunk_ms, sample_rate)
+    pass_through = silence_remover is None and await loop.run_in_executor(
+        executor, can_pass_through, audio_path, encoding, sample_rate)
+    if pass_through:
+        bytes_per_second = await loop.run_in_executor(
+            executor, _file_bytes_per_second, audio_path)
+        chunks = _rechunk_async(
+            iterate_in_executor(_file_blocks(audio_path), executor),
+            int(bytes_per_second * chunk_ms / 1000) or 1)
+        pacer = Pacer(realtime_factor, max_burst_ms, sample_rate,
+                      bytes_per_second)
+    else:
+        chunks = stream_chunks_async(audio_path,
+                                     chunk_size,
+                                     sample_rate,
+                                     executor=executor,
+                                     silence_remover=silence_remover)
+        pacer = Pacer(realtime_factor, max_burst_ms, sample_rate)
+
+    chunks = pace_async(chunks, pacer)
+    if encoding in COMPRESSED_ENCODINGS and not pass_through:
+        chunks = encode_chunks_async(chunks, encoding, sample_rate)
+    async for chunk in chunks:
+        yield chunk
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Dependencies:
+    - python 3.8
+
+The soundfile requires libsndfile.
+    macOS) brew install libsndfile
+    ubuntu) apt install libsndfile1
+
+Before executing this script, you should compile protobuf files:
+    $ cd proto
+    $ make
+
+Usage:
+    $ python batch_recognize.py --api_key <AIQ api key> \
+        --input <directory, glob pattern or manifest file> \
+        --output_path <results.jsonl> \
+        --concurrency 32
+
+    `--input` accepts a directory (every `--pattern` file under it), a glob
+    pattern such as './calls/*.wav', or a manifest file listing one audio path
+    per line. All files share a pool of `--num_channels` channels and at most
+    `--concurrency` Recognize calls are in flight at any time. Each result is
+    written as one JSON line as soon as its call finishes, and a throughput
+    summary is printed to stderr at the end.
+
+NOTE:
+    - Input audio duration is less than or equal to 60 seconds.
+"""
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+from typing import List
+
+from absl import flags
+import grpc
+
+from google.speech.v1 import cloud_speech_pb2
+from google.speech.v1 import cloud_speech_pb2_grpc
+import audio_utils
+import cache_utils
+import grpc_utils
+import metrics_utils
+
+flags.DEFINE_string('api_url', 'aiq.skelterlabs.com:443', 'AIQ portal address.')
+flags.DEFINE_string('api_key', None, 'AIQ project api key.')
+flags.DEFINE_boolean('insecure', None, 'Use plaintext and insecure connection.')
+flags.DEFINE_string(
+    'input', None, 'Directory, glob pattern or manifest file (one audio path '
+    'per line) of the audio files to recognize.')
+flags.DEFINE_string('pattern', '*.wav',
+                    'File pattern used when --input is a directory.')
+flags.DEFINE_string('output_path', '-',
+                    'Output JSONL path. Defaults to "-" (stdout).')
+flags.DEFINE_integer('concurrency', 16,
+                     'Maximum number of in-flight Recognize calls.')
+flags.DEFINE_integer(
+    'num_channels', 1, 'Number of pooled aio channels, each on its own '
+    'connection, to spread the calls over.')
+flags.DEFINE_integer(
+    'hedging_delay_ms', 0, 'Send another request if no response arrived '
+    'within this delay. Zero disables hedging.')
+flags.DEFINE_integer(
+    'metrics_port', None, 'Serve client metrics to Prometheus at '
+    'http://localhost:<port>/metrics while running.')
+flags.DEFINE_string('metrics_path', None,
+                    'Append a JSON snapshot of client metrics to this file.')
+flags.DEFINE_enum(
+    'cache', None, cache_utils.BACKENDS,
+    'Memoize results keyed by the audio and the config in this backend.')
+flags.DEFINE_string(
+    'cache_path', None, 'Directory of the disk cache, or database file of the '
+    'sqlite cache.')
+flags.DEFINE_integer('cache_mb', 1024, 'Maximum size of the cache in MiB.')
+flags.DEFINE_float(
+    'cache_ttl_hours', 0, 'Hours after which cached results expire. Zero '
+    'keeps them until they are evicted.')
+flags.register_multi_flags_validator(
+    ['cache', 'cache_path'],
+    lambda values: values['cache'] in (None, 'memory') or values['cache_path'],
+    message='--cache_path is required by the disk and sqlite caches.')
+FLAGS = flags.FLAGS
+
+SR = 16000
+MANIFEST_EXTENSIONS = ('.txt', '.lst', '.list')
+
+
+def list_audio_paths(input_path: str, pattern: str = '*.wav') -> List[str]:
+    """List audio files from a directory, a glob pattern or a manifest file.
+
+    Args:
+        input_path: Directory, glob pattern or manifest file path.
+        pattern: File pattern used when `input_path` is a directory.
+
+    Returns:
+        List of audio file paths.
+    """
+    if os.path.isdir(input_path):
+        return sorted(
+            glob.glob(os.path.join(input_path, '**', pattern), recursive=True))
+    if input_path.endswith(MANIFEST_EXTENSIONS) and os.path.isfile(input_path):
+        with open(input_path, 'r', encoding='utf-8') as manifest_file:
+            return [line.strip() for line in manifest_file if line.strip()]
+    return sorted(glob.glob(input_path, recursive=True))
+
+
+def make_audio(audio_path):
+    """Create recognition audio of 16kHz audio encoded as LINEAR16.
+
+    Args:
+        audio_path: Audio file path.
+
+    Returns:
+        RecognitionAudio object.
+    """
+    content = audio_utils.read_audio_content(audio_path, SR)
+    return cloud_speech_pb2.RecognitionAudio(content=content)
+
+
+async def recognize_file(get_channel, audio_path, config, semaphore,
+                         cache=None):
+    """Recognize one audio file once a slot of the in-flight window is free.
+
+    Audio decoding runs on the default executor so that it does not block the
+    event loop while other calls are in flight.
+
+    Args:
+        get_channel: Callable returning the aio channel to use.
+        audio_path: Audio file path.
+        config: RecognitionConfig object.
+        semaphore: Semaphore bounding the number of in-flight calls.
+        cache: If given, `cache_utils.ResultCache` of the results.
+
+    Returns:
+        Dict of the recognition record to be written as a JSON line.
+    """
+    record = {'audio_path': audio_path}
+    async with semaphore:
+        try:
+            loop = asyncio.get_running_loop()
+            audio = await loop.run_in_executor(None, make_audio, audio_path)
+            record['audio_seconds'] = len(audio.content) / 2 / SR
+
+            start_time = time.perf_counter()
+            request = cloud_speech_pb2.RecognizeRequest(config=config,
+                                                        audio=audio)
+            stub = cloud_speech_pb2_grpc.SpeechStub(get_channel())
+
+            async def recognize(request):
+                if FLAGS.hedging_delay_ms > 0:
+                    return await grpc_utils.hedged_call_async(
+                        stub.Recognize, request, FLAGS.hedging_delay_ms / 1000)
+                return await stub.Recognize(request)
+
+            if cache is not None:
+                response = await cache.recognize_async(recognize, request)
+            else:
+                response = await recognize(request)
+            record['latency'] = time.perf_counter() - start_time
+        except grpc.RpcError as e:
+            record['error'] = f'{e.code().name}: {e.details()}'
+            return record
+        except Exception as e:  # pylint: disable=broad-except
+            record['error'] = f'{type(e).__name__}: {e}'
+            return record
+
+    record['results'] = [{
+        'transcript': result.alternatives[0].transcript,
+        'confidence': result.alternatives[0].confidence,
+    } for result in response.results if result.alternatives]
+    return record
+
+
+async def main():
+    audio_paths = list_audio_paths(FLAGS.input, FLAGS.pattern)
+
+    metrics = metrics_utils.Metrics()
+    interceptors = metrics_utils.metrics_interceptors(metrics, is_aio=True)
+    metrics_server = exporter = None
+    if FLAGS.metrics_port:
+        metrics_server = metrics_utils.serve_prometheus(metrics,
+                                                        FLAGS.metrics_port)
+    if FLAGS.metrics_path:
+        exporter = metrics_utils.JsonLinesExporter(metrics, FLAGS.metrics_path)
+
+    def get_channel():
+        return grpc_utils.get_aio_channel(FLAGS.api_url,
+                                          api_key=FLAGS.api_key,
+                                          insecure=FLAGS.insecure,
+                                          interceptors=interceptors,
+                                          num_channels=FLAGS.num_channels)
+
+    # pylint: disable=no-member
+    config = cloud_speech_pb2.RecognitionConfig(
+        encoding=cloud_speech_pb2.RecognitionConfig.AudioEncoding.LINEAR16,
+        sample_rate_hertz=SR,
+        language_code='ko-KR')
+    # pylint: enable=no-member
+
+    cache = None
+    if FLAGS.cache:
+        cache = cache_utils.ResultCache(
+            cache_utils.open_backend(FLAGS.cache, FLAGS.cache_path,
+                                     FLAGS.cache_mb * 2**20),
+            ttl=FLAGS.cache_ttl_hours * 3600 or None)
+
+    semaphore = asyncio.Semaphore(FLAGS.concurrency)
+    tasks = [
+        recognize_file(get_channel, audio_path, config, semaphore, cache)
+        for audio_path in audio_paths
+    ]
+
+    num_failed = 0
+    audio_seconds = 0.0
+    latencies = []
+    start_time = time.perf_counter()
+    output_file = (sys.stdout if FLAGS.output_path == '-' else open(
+        FLAGS.output_path, 'w', encoding='utf-8'))
+    try:
+        for future in asyncio.as_completed(tasks):
+            record = await future
+            if 'error' in record:
+                num_failed += 1
+            else:
+                audio_seconds += record['audio_seconds']
+                latencies.append(record['latency'])
+            output_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            output_file.flush()
+    finally:
+        if output_file is not sys.stdout:
+            output_file.close()
+        await grpc_utils.close_aio_channels()
+        if exporter is not None:
+            exporter.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+    elapsed = time.perf_counter() - start_time
+
+    latencies.sort()
+    print(f'Files: {len(audio_paths)} (failed: {num_failed})', file=sys.stderr)
+    print(f'Elapsed: {elapsed:.2f}s', file=sys.stderr)
+    if latencies:
+        print(
+            f'Throughput: {len(latencies) / elapsed:.2f} files/s, '
+            f'{audio_seconds / elapsed:.2f} audio seconds/s',
+            file=sys.stderr)
+        print(
+            f'Latency: mean {sum(latencies) / len(latencies):.3f}s, '
+            f'p50 {latencies[len(latencies) // 2]:.3f}s, '
+            f'max {latencies[-1]:.3f}s',
+            file=sys.stderr)
+    if cache is not None:
+        print(f'Cache: {cache.stats()}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    flags.mark_flags_as_required(['input'])
+    FLAGS(sys.argv)
+    asyncio.run(main())
@@ -0,0 +1,325 @@
+"""Memoization of AIQ.STT recognition results.
+
+Results are keyed by a hash of the serialized config and the PCM audio sent,
+before any compression, so that audio submitted again, e.g. by a retried or
+reprocessed job, is answered from the cache instead of the API. Entries are
+stored in one of the backends of `cache_backends`, evicted by size, and expire
+after a time to live.
+"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import struct
+import threading
+import time
+from typing import (Awaitable, Callable, Dict, Iterable, Iterator, List,
+                    Optional)
+
+from google.speech.v1 import cloud_speech_pb2
+import cache_backends
+
+BACKENDS = ('memory', 'disk', 'sqlite')
+
+_CREATED_TIME = struct.Struct('<d')
+_FRAME_SIZE = struct.Struct('<I')
+
+
+def open_backend(backend: str, path: Optional[str], max_bytes: int):
+    """Open a backend of `cache_backends`.
+
+    Args:
+        backend: One of BACKENDS.
+        path: Directory of the disk backend, or database file of the sqlite
+            backend. Unused by the memory backend.
+        max_bytes: Maximum total size of the entries.
+
+    Returns:
+        Backend object.
+
+    Raises:
+        ValueError: The backend is unknown, or its path is not given.
+    """
+    if backend != 'memory' and not path:
+        raise ValueError(f'The {backend} cache needs a path')
+    if backend == 'memory':
+        return cache_backends.MemoryBackend(max_bytes)
+    if backend == 'disk':
+        return cache_backends.DiskBackend(path, max_bytes, suffix='.stt')
+    if backend == 'sqlite':
+        return cache_backends.SqliteBackend(path, max_bytes)
+    raise ValueError(f'Unknown cache backend: {backend}')
+
+
+def recognize_key(request: cloud_speech_pb2.RecognizeRequest,
+                  pcm: Optional[bytes] = None) -> str:
+    """Return the cache key of a Recognize request.
+
+    Args:
+        request: RecognizeRequest object.
+        pcm: LINEAR16 audio the content of the request was encoded from.
+            Compressed encoders, e.g. of OGG_OPUS, do not produce the same
+            bytes twice, so such content should be keyed by its PCM audio.
+            Defaults to the audio of the request.
+
+    Returns:
+        Hex digest.
+    """
+    digest = hashlib.sha256(b'Recognize\0')
+    digest.update(request.config.SerializeToString(deterministic=True))
+    digest.update(b'\0')
+    if pcm is not None:
+        digest.update(pcm)
+    else:
+        digest.update(request.audio.SerializeToString(deterministic=True))
+    return digest.hexdigest()
+
+
+class _StreamingDigest:
+    """Hash of the config and the audio of StreamingRecognize requests."""
+
+    def __init__(self):
+        self._digest = hashlib.sha256(b'StreamingRecognize\0')
+
+    def update(self, request):
+        if request.HasField('streaming_config'):
+            self._digest.update(
+                request.streaming_config.SerializeToString(deterministic=True))
+            self._digest.update(b'\0')
+        else:
+            self._digest.update(request.audio_content)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+
+def streaming_key(
+        requests: Iterable[cloud_speech_pb2.StreamingRecognizeRequest]) -> str:
+    """Return the cache key of all StreamingRecognize requests of a stream.
+
+    The key does not depend on how the audio is split into chunks. Audio to
+    be compressed should be keyed by requests of its LINEAR16 audio, as in
+    `recognize_key`.
+    """
+    digest = _StreamingDigest()
+    for request in requests:
+        digest.update(request)
+    return digest.hexdigest()
+
+
+def _copy_response(response):
+    # Each caller gets its own response, which it may modify.
+    copy = cloud_speech_pb2.RecognizeResponse()
+    copy.CopyFrom(response)
+    return copy
+
+
+class ResultCache:
+    """Recognition responses stored in a backend for `ttl` seconds.
+
+    Args:
+        backend: Backend of `cache_backends`, e.g. from `open_backend`.
+        ttl: Seconds after which an entry expires. None keeps entries until
+            they are evicted.
+    """
+
+    def __init__(self, backend, ttl: Optional[float] = None):
+        self.backend = backend
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._counts = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'stored': 0,
+            'coalesced': 0,
+        }
+        # Futures of the uncached Recognize calls in flight by key.
+        self._pending = {}
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def stats(self) -> Dict:
+        """Return the counts of lookups and the size of the backend."""
+        with self._lock:
+            stats = dict(self._counts)
+        stats.update(entries=len(self.backend),
+                     bytes=self.backend.size,
+                     evictions=self.backend.evictions)
+        return stats
+
+    def get(self, key: str) -> Optional[List[bytes]]:
+        """Return the serialized responses stored under `key`, if any."""
+        entry = self.backend.get(key)
+        if entry is None:
+            self._count('misses')
+            return None
+        (created_time,) = _CREATED_TIME.unpack_from(entry)
+        if self._ttl is not None and created_time + self._ttl < time.time():
+            self.backend.delete(key)
+            self._count('expired')
+            self._count('misses')
+            return None
+        self._count('hits')
+        responses = []
+        offset = _CREATED_TIME.size
+        while offset < len(entry):
+            (size,) = _FRAME_SIZE.unpack_from(entry, offset)
+            offset += _FRAME_SIZE.size
+            responses.append(entry[offset:offset + size])
+            offset += size
+        return responses
+
+    def put(self, key: str, responses: List[bytes]):
+        """Store the serialized responses of a call under `key`."""
+        self.backend.put(
+            key,
+            _CREATED_TIME.pack(time.time()) +
+            b''.join(_FRAME_SIZE.pack(len(response)) + response
+                     for response in responses))
+        self._count('stored')
+
+    def _join(self, key):
+        # Return the future of the call in flight for `key`, and whether the
+        # caller is the first one, which makes the call and resolves it.
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                self._counts['coalesced'] += 1
+                return pending, False
+            pending = concurrent.futures.Future()
+            self._pending[key] = pending
+            return pending, True
+
+    def _resolve(self, key, pending, response=None, error=None):
+        with self._lock:
+            del self._pending[key]
+        if error is not None:
+            pending.set_exception(error)
+        else:
+            pending.set_result(response)
+
+    def recognize(
+        self,
+        recognize: Callable[[cloud_speech_pb2.RecognizeRequest],
+                            cloud_speech_pb2.RecognizeResponse],
+        request: cloud_speech_pb2.RecognizeRequest,
+        pcm: Optional[bytes] = None,
+    ) -> cloud_speech_pb2.RecognizeResponse:
+        """Return the cached response of `request`, or call `recognize`.
+
+        Concurrent requests of the same key wait for the response of the first
+        one instead of calling `recognize` too.
+
+        Args:
+            recognize: Function making the call, e.g. `stub.Recognize`.
+            request: RecognizeRequest object.
+            pcm: LINEAR16 audio the content was encoded from, if it was
+                compressed. See `recognize_key`.
+
+        Returns:
+            RecognizeResponse object.
+        """
+        key = recognize_key(request, pcm)
+        pending, first = self._join(key)
+        if not first:
+            return _copy_response(pending.result())
+        try:
+            responses = self.get(key)
+            if responses is not None:
+                response = cloud_speech_pb2.RecognizeResponse.FromString(
+                    responses[0])
+            else:
+                response = recognize(request)
+                self.put(key, [response.SerializeToString()])
+        except BaseException as e:
+            self._resolve(key, pending, error=e)
+            raise
+        self._resolve(key, pending, response)
+        return response
+
+    async def recognize_async(
+        self,
+        recognize: Callable[[cloud_speech_pb2.RecognizeRequest],
+                            Awaitable[cloud_speech_pb2.RecognizeResponse]],
+        request: cloud_speech_pb2.RecognizeRequest,
+        pcm: Optional[bytes] = None,
+    ) -> cloud_speech_pb2.RecognizeResponse:
+        """Same as `recognize` for aio calls.
+
+        The backend is accessed on the default executor, off the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        key = recognize_key(request, pcm)
+        pending, first = self._join(key)
+        if not first:
+            return _copy_response(await asyncio.wrap_future(pending))
+        try:
+            responses = await loop.run_in_executor(None, self.get, key)
+            if responses is not None:
+                response = cloud_speech_pb2.RecognizeResponse.FromString(
+                    responses[0])
+            else:
+                response = await recognize(request)
+                await loop.run_in_executor(None, self.put, key,
+                                           [response.SerializeToString()])
+        except BaseException as e:
+            self._resolve(key, pending, error=e)
+            raise
+        self._resolve(key, pending, response)
+        return response
+
+    def lookup_streaming(
+        self, key: str
+    ) -> Optional[List[cloud_speech_pb2.StreamingRecognizeResponse]]:
+        """Return the cached responses of a stream with `streaming_key`."""
+        responses = self.get(key)
+        if responses is None:
+            return None
+        return [
+            cloud_speech_pb2.StreamingRecognizeResponse.FromString(response)
+            for response in responses
+        ]
+
+    def streaming_recognize(
+        self,
+        streaming_recognize: Callable[
+            [Iterator[cloud_speech_pb2.StreamingRecognizeRequest]],
+            Iterator[cloud_speech_pb2.StreamingRecognizeResponse]],
+        requests: Iterable[cloud_speech_pb2.StreamingRecognizeRequest],
+        key: Optional[str] = None,
+    ) -> Iterator[cloud_speech_pb2.StreamingRecognizeResponse]:
+        """Call `streaming_recognize` and cache the responses of the stream.
+
+        The responses are stored once the stream has been read to its end, to
+        be found with `lookup_streaming` later.
+
+        Args:
+            streaming_recognize: Function making the call, e.g.
+                `stub.StreamingRecognize`.
+            requests: StreamingRecognizeRequest objects.
+            key: Key to store the responses under, e.g. the `streaming_key` of
+                the LINEAR16 audio of compressed requests. Defaults to the
+                `streaming_key` of the requests, hashed as they are sent.
+
+        Yields:
+            StreamingRecognizeResponse objects.
+        """
+        digest = _StreamingDigest()
+
+        def hashed_requests():
+            for request in requests:
+                digest.update(request)
+                yield request
+
+        if key is None:
+            requests_sent = hashed_requests()
+        else:
+            requests_sent = requests
+        serialized = []
+        for response in streaming_recognize(requests_sent):
+            serialized.append(response.SerializeToString())
+            yield response
+        self.put(key or digest.hexdigest(), serialized)
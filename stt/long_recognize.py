@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Dependencies:
+    - python 3.8
+
+The soundfile requires libsndfile.
+    macOS) brew install libsndfile
+    ubuntu) apt install libsndfile1
+
+Before executing this script, you should compile protobuf files:
+    $ cd proto
+    $ make
+
+Usage:
+    $ python long_recognize.py --api_key <AIQ api key> \
+        --audio_path <meeting.wav> --concurrency 8
+
+    The audio is split at pauses into segments shorter than the 60 seconds
+    Recognize limit. The segments are recognized concurrently and the results
+    are stitched back into one transcript, with word time offsets relative to
+    the start of the original file.
+"""
+import asyncio
+import sys
+import time
+
+from absl import flags
+import grpc
+
+from google.speech.v1 import cloud_speech_pb2
+from google.speech.v1 import cloud_speech_pb2_grpc
+import audio_utils
+import grpc_utils
+import utils
+
+flags.DEFINE_string('api_url', 'aiq.skelterlabs.com:443', 'AIQ portal address.')
+flags.DEFINE_string('api_key', None, 'AIQ project api key.')
+flags.DEFINE_boolean('insecure', None, 'Use plaintext and insecure connection.')
+flags.DEFINE_string('audio_path', './resources/hello.wav', 'Input wav path.')
+flags.DEFINE_integer('concurrency', 8,
+                     'Maximum number of in-flight Recognize calls.')
+flags.DEFINE_float('max_segment_seconds', 55.0,
+                   'Maximum duration of each segment.')
+flags.DEFINE_integer('min_silence_ms', 300,
+                     'Duration of the pause to split segments at.')
+FLAGS = flags.FLAGS
+
+SR = 16000
+
+
+async def recognize_segment(stub, content, config, semaphore):
+    """Recognize one segment once a slot of the in-flight window is free.
+
+    Args:
+        stub: SpeechStub over an aio channel.
+        content: Bytes of LINEAR16 audio of the segment.
+        config: RecognitionConfig object.
+        semaphore: Semaphore bounding the number of in-flight calls.
+
+    Returns:
+        RecognizeResponse object.
+    """
+    async with semaphore:
+        request = cloud_speech_pb2.RecognizeRequest(
+            config=config,
+            audio=cloud_speech_pb2.RecognitionAudio(content=content))
+        return await stub.Recognize(request)
+
+
+async def main():
+    start_time = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    samples = await loop.run_in_executor(None, audio_utils.load_audio,
+                                         FLAGS.audio_path, SR)
+    segments = audio_utils.split_on_silence(samples, SR,
+                                            FLAGS.max_segment_seconds,
+                                            FLAGS.min_silence_ms)
+
+    channel = grpc_utils.create_aio_channel(
+        FLAGS.api_url, api_key=FLAGS.api_key, insecure=FLAGS.insecure)
+    stub = cloud_speech_pb2_grpc.SpeechStub(channel)
+
+    # pylint: disable=no-member
+    config = cloud_speech_pb2.RecognitionConfig(
+        encoding=cloud_speech_pb2.RecognitionConfig.AudioEncoding.LINEAR16,
+        sample_rate_hertz=SR,
+        language_code='ko-KR',
+        enable_word_time_offsets=True)
+    # pylint: enable=no-member
+
+    semaphore = asyncio.Semaphore(FLAGS.concurrency)
+    try:
+        responses = await asyncio.gather(*[
+            recognize_segment(stub, samples[start:end].tobytes(), config,
+                              semaphore) for start, end in segments
+        ])
+    except grpc.RpcError as e:
+        print(f'Recognition failed: {e.code().name}: {e.details()}',
+              file=sys.stderr)
+        return
+    finally:
+        await channel.close()
+
+    for (start, _), response in zip(segments, responses):
+        for result in response.results:
+            utils.print_recognition_result(
+                utils.offset_result(result, start / SR))
+
+    elapsed = time.perf_counter() - start_time
+    duration = len(samples) / SR
+    print(
+        f'Recognized {duration:.2f}s of audio in {len(segments)} segments '
+        f'within {elapsed:.2f}s ({duration / elapsed:.1f}x real time)',
+        file=sys.stderr)
+
+
+if __name__ == '__main__':
+    FLAGS(sys.argv)
+    asyncio.run(main())
@@ -0,0 +1 @@
+../utils/metrics_utils.py
\ No newline at end of file
@@ -3,7 +3,7 @@
 Dependencies:
     - python 3.8
 
-The librosa requires libsndfile.
+The soundfile requires libsndfile.
     macOS) brew install libsndfile
     ubuntu) apt install libsndfile1
 
@@ -18,36 +18,108 @@ NOTE:
     - Input audio duration is less than or equal to 60 seconds.
 """
 
+import concurrent.futures
+import sys
+
 from absl import app
 from absl import flags
-import librosa
-import numpy as np
 
 from google.speech.v1 import cloud_speech_pb2
 from google.speech.v1 import cloud_speech_pb2_grpc
+import audio_utils
+import cache_utils
 import grpc_utils
+import sink_utils
+import utils
 
 flags.DEFINE_string('api_url', 'aiq.skelterlabs.com:443', 'AIQ portal address.')
 flags.DEFINE_string('api_key', None, 'AIQ project api key.')
 flags.DEFINE_boolean('insecure', None, 'Use plaintext and insecure connection.')
 flags.DEFINE_string('audio_path', './resources/hello.wav', 'Input wav path.')
+flags.DEFINE_boolean('skip_silence', False,
+                     'Remove silence from the audio before sending it.')
+flags.DEFINE_float('silence_threshold_db', -40.0,
+                   'Frames quieter than this (dBFS) are treated as silence.')
+flags.DEFINE_integer('silence_padding_ms', 200,
+                     'Duration of silence kept around speech.')
+flags.DEFINE_enum(
+    'encoding', 'LINEAR16', audio_utils.ENCODINGS,
+    'Audio encoding to send. Compressed inputs already in the requested '
+    'encoding are sent as is.')
+flags.DEFINE_integer(
+    'hedging_delay_ms', 0, 'Send another request if no response arrived '
+    'within this delay. Zero disables hedging.')
+flags.DEFINE_boolean(
+    'multichannel', False, 'Recognize each channel of the audio with its own '
+    'request concurrently, and merge their results into one timeline tagged '
+    'by channel.')
+flags.DEFINE_enum(
+    'output_format', None, sink_utils.FORMATS,
+    'Write the results in this format through a buffered sink instead of '
+    'printing them.')
+flags.DEFINE_string('output_path', '-',
+                    'Output path of --output_format. Defaults to stdout.')
+flags.DEFINE_enum(
+    'cache', None, cache_utils.BACKENDS,
+    'Memoize results keyed by the audio and the config in this backend.')
+flags.DEFINE_string(
+    'cache_path', None, 'Directory of the disk cache, or database file of the '
+    'sqlite cache.')
+flags.DEFINE_integer('cache_mb', 1024, 'Maximum size of the cache in MiB.')
+flags.DEFINE_float(
+    'cache_ttl_hours', 0, 'Hours after which cached results expire. Zero '
+    'keeps them until they are evicted.')
+flags.register_multi_flags_validator(
+    ['cache', 'cache_path'],
+    lambda values: values['cache'] in (None, 'memory') or values['cache_path'],
+    message='--cache_path is required by the disk and sqlite caches.')
 FLAGS = flags.FLAGS
 
 
-def make_audio(audio_path):
-    """Create recognition audio of 16kHz audio encoded as LINEAR16.
+def make_audio(audio_path, silence_remover=None, encoding='LINEAR16'):
+    """Create recognition audio of 16kHz audio.
 
     Args:
         audio_path: Audio file path.
+        silence_remover: If given, silence is removed from the audio.
+        encoding: Name of the `RecognitionConfig.AudioEncoding` to send.
 
     Returns:
-        RecognitionAudio object.
+        RecognitionAudio object, and the LINEAR16 audio it was compressed
+        from, or None if the audio is LINEAR16 or the file is sent as is.
     """
-    content, sample_rate = librosa.load(audio_path, sr=16000)
-    del sample_rate
-    if content.dtype in (np.float32, np.float64):
-        content = (content * np.iinfo(np.int16).max).astype(np.int16)
-    return cloud_speech_pb2.RecognitionAudio(content=content.tobytes())
+    if encoding == 'LINEAR16' or (silence_remover is None and
+                                  audio_utils.can_pass_through(
+                                      audio_path, encoding, 16000)):
+        content = audio_utils.read_audio_content(audio_path, 16000, encoding,
+                                                 silence_remover)
+        return cloud_speech_pb2.RecognitionAudio(content=content), None
+    # Compressed encoders do not produce the same bytes twice, so results are
+    # cached by the audio before compression.
+    pcm = audio_utils.read_audio_content(audio_path, 16000, 'LINEAR16',
+                                         silence_remover)
+    content = audio_utils.encode_audio(pcm, encoding)
+    return cloud_speech_pb2.RecognitionAudio(content=content), pcm
+
+
+def make_channel_audio(samples, silence_remover=None, encoding='LINEAR16'):
+    """Create recognition audio of a channel of 16kHz audio.
+
+    Args:
+        samples: 16-bit PCM samples of the channel, e.g. of
+            `audio_utils.load_channels`.
+        silence_remover: If given, silence is removed from the audio.
+        encoding: Name of the `RecognitionConfig.AudioEncoding` to send.
+
+    Returns:
+        RecognitionAudio object, and the LINEAR16 audio it was compressed
+        from, or None if the audio is LINEAR16.
+    """
+    if silence_remover is not None:
+        samples = silence_remover.remove(samples)
+    content = audio_utils.encode_audio(samples, encoding)
+    pcm = None if encoding == 'LINEAR16' else samples.tobytes()
+    return cloud_speech_pb2.RecognitionAudio(content=content), pcm
 
 
 def main(args):
@@ -57,23 +129,95 @@ def main(args):
         FLAGS.api_url, api_key=FLAGS.api_key, insecure=FLAGS.insecure)
     stub = cloud_speech_pb2_grpc.SpeechStub(channel)
 
-    audio = make_audio(FLAGS.audio_path)
+    def make_silence_remover():
+        if not FLAGS.skip_silence:
+            return None
+        return audio_utils.SilenceRemover(16000, FLAGS.silence_threshold_db,
+                                          FLAGS.silence_padding_ms)
 
     # pylint: disable=no-member
     config = cloud_speech_pb2.RecognitionConfig(
-        encoding=cloud_speech_pb2.RecognitionConfig.AudioEncoding.LINEAR16,
+        encoding=cloud_speech_pb2.RecognitionConfig.AudioEncoding.Value(
+            FLAGS.encoding),
         sample_rate_hertz=16000,
-        language_code='ko-KR')
+        language_code='ko-KR',
+        # Word time offsets order the merged timeline of the channels, and
+        # time the results written to a sink.
+        enable_word_time_offsets=FLAGS.multichannel or
+        FLAGS.output_format is not None)
     # pylint: enable=no-member
-    request = cloud_speech_pb2.RecognizeRequest(config=config, audio=audio)
-    response = stub.Recognize(request)
-
-    for result in response.results:
-        # The alternatives are ordered from most likely to least.
-        for i, alternative in enumerate(result.alternatives):
-            print(f'Alternatives[{i}]')
-            print(f'  Confidence[{i}]: {alternative.confidence}')
-            print(f'  Transcript[{i}]: {alternative.transcript}')
+
+    def call(request):
+        if FLAGS.hedging_delay_ms > 0:
+            return grpc_utils.hedged_call(stub.Recognize, request,
+                                          FLAGS.hedging_delay_ms / 1000)
+        return stub.Recognize(request)
+
+    cache = None
+    if FLAGS.cache:
+        cache = cache_utils.ResultCache(
+            cache_utils.open_backend(FLAGS.cache, FLAGS.cache_path,
+                                     FLAGS.cache_mb * 2**20),
+            ttl=FLAGS.cache_ttl_hours * 3600 or None)
+
+    def recognize(audio, pcm=None):
+        request = cloud_speech_pb2.RecognizeRequest(config=config, audio=audio)
+        if cache is not None:
+            return cache.recognize(call, request, pcm)
+        return call(request)
+
+    if FLAGS.multichannel:
+        channels = audio_utils.load_channels(FLAGS.audio_path)
+        silence_removers = [make_silence_remover() for _ in channels]
+
+        def recognize_channel(samples, silence_remover):
+            response = recognize(
+                *make_channel_audio(samples, silence_remover, FLAGS.encoding))
+            if silence_remover is not None:
+                for result in response.results:
+                    utils.map_result_times(
+                        result, silence_remover.offset_map.to_original)
+            return response.results
+
+        # The channels are encoded and recognized concurrently, and their
+        # results are merged into one timeline.
+        with concurrent.futures.ThreadPoolExecutor(len(channels)) as executor:
+            channel_results = list(
+                executor.map(recognize_channel, channels, silence_removers))
+        results = utils.merge_channel_results(channel_results)
+    else:
+        silence_remover = make_silence_remover()
+        silence_removers = [silence_remover]
+        response = recognize(
+            *make_audio(FLAGS.audio_path, silence_remover, FLAGS.encoding))
+        results = [(None, result) for result in response.results]
+
+    if FLAGS.output_format:
+        with sink_utils.open_sink(FLAGS.output_format,
+                                  FLAGS.output_path) as sink:
+            for channel, result in results:
+                sink.write(result, channel)
+    elif FLAGS.multichannel:
+        for channel, result in results:
+            utils.print_recognition_result(result, channel=channel)
+    else:
+        for _, result in results:
+            # The alternatives are ordered from most likely to least.
+            for i, alternative in enumerate(result.alternatives):
+                print(f'Alternatives[{i}]')
+                print(f'  Confidence[{i}]: {alternative.confidence}')
+                print(f'  Transcript[{i}]: {alternative.transcript}')
+
+    for channel, silence_remover in enumerate(silence_removers):
+        if silence_remover is not None:
+            tag = f'Channel {channel}: ' if FLAGS.multichannel else ''
+            print(
+                f'{tag}Skipped {silence_remover.removed_seconds:.2f}s of '
+                f'{silence_remover.total_seconds:.2f}s as silence '
+                f'({silence_remover.removed_bytes} bytes)',
+                file=sys.stderr)
+    if cache is not None:
+        print(f'Cache: {cache.stats()}', file=sys.stderr)
 
 
 if __name__ == '__main__':
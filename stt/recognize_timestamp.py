@@ -3,7 +3,7 @@
 Dependencies:
     - python 3.8
 
-The librosa requires libsndfile.
+The soundfile requires libsndfile.
     macOS) brew install libsndfile
     ubuntu) apt install libsndfile1
 
@@ -18,14 +18,14 @@ NOTE:
     - Input audio duration is less than or equal to 60 seconds.
 """
 import datetime
+import sys
 
 from absl import app
 from absl import flags
-import librosa
-import numpy as np
 
 from google.speech.v1 import cloud_speech_pb2
 from google.speech.v1 import cloud_speech_pb2_grpc
+import audio_utils
 import grpc_utils
 import utils
 
@@ -33,23 +33,33 @@ flags.DEFINE_string('api_url', 'aiq.skelterlabs.com:443', 'AIQ portal address.')
 flags.DEFINE_string('api_key', None, 'AIQ project api key.')
 flags.DEFINE_boolean('insecure', None, 'Use plaintext and insecure connection.')
 flags.DEFINE_string('audio_path', './resources/hello.wav', 'Input wav path.')
+flags.DEFINE_boolean('skip_silence', False,
+                     'Remove silence from the audio before sending it.')
+flags.DEFINE_float('silence_threshold_db', -40.0,
+                   'Frames quieter than this (dBFS) are treated as silence.')
+flags.DEFINE_integer('silence_padding_ms', 200,
+                     'Duration of silence kept around speech.')
+flags.DEFINE_enum(
+    'encoding', 'LINEAR16', audio_utils.ENCODINGS,
+    'Audio encoding to send. Compressed inputs already in the requested '
+    'encoding are sent as is.')
 FLAGS = flags.FLAGS
 
 
-def make_audio(audio_path):
-    """Create recognition audio of 16kHz audio encoded as LINEAR16.
+def make_audio(audio_path, silence_remover=None, encoding='LINEAR16'):
+    """Create recognition audio of 16kHz audio.
 
     Args:
         audio_path: Audio file path.
+        silence_remover: If given, silence is removed from the audio.
+        encoding: Name of the `RecognitionConfig.AudioEncoding` to send.
 
     Returns:
         RecognitionAudio object.
     """
-    content, sample_rate = librosa.load(audio_path, sr=16000)
-    del sample_rate
-    if content.dtype in (np.float32, np.float64):
-        content = (content * np.iinfo(np.int16).max).astype(np.int16)
-    return cloud_speech_pb2.RecognitionAudio(content=content.tobytes())
+    content = audio_utils.read_audio_content(audio_path, 16000, encoding,
+                                             silence_remover)
+    return cloud_speech_pb2.RecognitionAudio(content=content)
 
 
 def time_to_second(time_info):
@@ -66,11 +76,16 @@ def main(args):
         FLAGS.api_url, api_key=FLAGS.api_key, insecure=FLAGS.insecure)
     stub = cloud_speech_pb2_grpc.SpeechStub(channel)
 
-    audio = make_audio(FLAGS.audio_path)
+    silence_remover = None
+    if FLAGS.skip_silence:
+        silence_remover = audio_utils.SilenceRemover(
+            16000, FLAGS.silence_threshold_db, FLAGS.silence_padding_ms)
+    audio = make_audio(FLAGS.audio_path, silence_remover, FLAGS.encoding)
 
     # pylint: disable=no-member
     config = cloud_speech_pb2.RecognitionConfig(
-        encoding=cloud_speech_pb2.RecognitionConfig.AudioEncoding.LINEAR16,
+        encoding=cloud_speech_pb2.RecognitionConfig.AudioEncoding.Value(
+            FLAGS.encoding),
         sample_rate_hertz=16000,
         language_code='ko-KR',
         # Below option is required for timestamp
@@ -80,9 +95,20 @@ def main(args):
     response = stub.Recognize(request)
 
     for result in response.results:
+        if silence_remover is not None:
+            # Map the timestamps back to the time of the original audio.
+            utils.map_result_times(result,
+                                   silence_remover.offset_map.to_original)
         # The alternatives are ordered from most likely to least.
         utils.print_recognition_result(result)
 
+    if silence_remover is not None:
+        print(
+            f'Skipped {silence_remover.removed_seconds:.2f}s of '
+            f'{silence_remover.total_seconds:.2f}s as silence '
+            f'({silence_remover.removed_bytes} bytes)',
+            file=sys.stderr)
+
 
 if __name__ == '__main__':
     app.run(main)
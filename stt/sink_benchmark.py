@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+r"""
+Measure the throughput of the result sinks against per-line printing.
+
+Final results with word time offsets, like those of a long transcript, are
+written to a file by each sink of `sink_utils`, by
+`utils.print_recognition_result`, and by the printer it replaced, which
+printed and flushed every line separately.
+
+Usage:
+    $ python sink_benchmark.py --results 10000 --words 10
+"""
+
+import os
+import tempfile
+import time
+
+from absl import app
+from absl import flags
+
+from google.speech.v1 import cloud_speech_pb2
+import sink_utils
+import utils
+
+flags.DEFINE_integer('results', 10000, 'Number of results per run.')
+flags.DEFINE_integer('words', 10, 'Number of words per result.')
+flags.DEFINE_integer('runs', 3, 'Number of runs per case.')
+flags.DEFINE_string('output_dir', None,
+                    'Directory of the output files. Defaults to a temporary '
+                    'directory.')
+FLAGS = flags.FLAGS
+
+
+def make_results(num_results, num_words):
+    """Return final results of consecutive one second words."""
+    results = []
+    for index in range(num_results):
+        alternative = cloud_speech_pb2.SpeechRecognitionAlternative(
+            transcript=' '.join(['안녕하세요'] * num_words), confidence=0.9)
+        for word_index in range(num_words):
+            word = alternative.words.add(word='안녕하세요')
+            start_time = index * num_words + word_index
+            word.start_time.FromNanoseconds(start_time * 10**9)
+            word.end_time.FromNanoseconds((start_time + 1) * 10**9)
+        results.append(
+            cloud_speech_pb2.StreamingRecognitionResult(
+                alternatives=[alternative], is_final=True))
+    return results
+
+
+def _print_per_line(result, file):
+    # The printer before the sinks, printing and flushing every line.
+    alternative = result.alternatives[0]
+    start_time = utils.time_to_second(alternative.words[0].start_time)
+    end_time = utils.time_to_second(alternative.words[-1].end_time)
+    print(f'[{start_time:.2f} ~ {end_time:.2f}] {alternative.transcript}',
+          file=file,
+          flush=True)
+    for word in alternative.words:
+        start_time = utils.time_to_second(word.start_time)
+        end_time = utils.time_to_second(word.end_time)
+        print(f'- [{start_time:.2f} ~ {end_time:.2f}] {word.word}',
+              file=file,
+              flush=True)
+
+
+def measure(write_all, output_path):
+    """Return the best time of `write_all(output_path)` in seconds."""
+    best = float('inf')
+    for _ in range(FLAGS.runs):
+        start_time = time.perf_counter()
+        write_all(output_path)
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+
+def main(args):
+    del args  # Unused
+
+    results = make_results(FLAGS.results, FLAGS.words)
+
+    def printer(print_result):
+
+        def write_all(output_path):
+            with open(output_path, 'w', encoding='utf-8') as output_file:
+                for result in results:
+                    print_result(result, file=output_file)
+
+        return write_all
+
+    def sink(output_format):
+
+        def write_all(output_path):
+            with sink_utils.open_sink(output_format, output_path) as sink:
+                for result in results:
+                    sink.write(result)
+
+        return write_all
+
+    cases = {
+        'per-line print': printer(_print_per_line),
+        'print_recognition_result': printer(utils.print_recognition_result),
+    }
+    for output_format in sink_utils.FORMATS:
+        cases[f'{output_format} sink'] = sink(output_format)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_dir = FLAGS.output_dir or temp_dir
+        print(f'{FLAGS.results} results of {FLAGS.words} words')
+        for name, write_all in cases.items():
+            output_path = os.path.join(output_dir,
+                                       name.replace(' ', '_') + '.out')
+            elapsed = measure(write_all, output_path)
+            print(f'{name:>26}: {elapsed * 1000:8.1f}ms '
+                  f'{FLAGS.results / elapsed:10.0f} results/s '
+                  f'{os.path.getsize(output_path) / 2**20:6.2f}MiB')
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -0,0 +1,195 @@
+"""Buffered writers of recognition results.
+
+A sink formats recognition results as plain text, JSON lines, SRT or WebVTT
+subtitles, and collects them in memory. They are written to the output in one
+call once `buffer_size` characters have accumulated, and on `flush` and
+`close`, instead of a write and a flush per line.
+"""
+
+import json
+import sys
+from typing import Optional, TextIO
+
+import utils
+
+FORMATS = ('text', 'jsonl', 'srt', 'vtt')
+# Number of characters buffered before they are written.
+BUFFER_SIZE = 65536
+
+
+class ResultSink:
+    """Base class of the sinks, buffering the formatted results.
+
+    Args:
+        output: Text output.
+        buffer_size: Number of characters buffered before they are written.
+        close_output: Whether `close` closes `output`.
+    """
+
+    def __init__(self,
+                 output: TextIO,
+                 buffer_size: int = BUFFER_SIZE,
+                 close_output: bool = False):
+        self._output = output
+        self._buffer_size = buffer_size
+        self._close_output = close_output
+        self._buffer = []
+        self._buffered = 0
+
+    def format(self, result, channel: Optional[int]) -> str:
+        """Return the text of a result, or an empty string to skip it."""
+        raise NotImplementedError
+
+    def _take(self):
+        text = ''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        return text
+
+    def _append(self, text):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self._buffer_size:
+            self._output.write(self._take())
+
+    def write(self, result, channel: Optional[int] = None):
+        """Buffer a recognition result.
+
+        Args:
+            result: Recognition result.
+            channel: If given, index of the audio channel the result is
+                tagged with.
+        """
+        text = self.format(result, channel)
+        if text:
+            self._append(text)
+
+    def flush(self):
+        """Write the buffered results and flush the output."""
+        if self._buffer:
+            self._output.write(self._take())
+            self._output.flush()
+
+    def close(self):
+        """Flush the sink, and close its output if it was opened by it."""
+        self.flush()
+        if self._close_output:
+            self._output.close()
+        else:
+            self._output.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TextSink(ResultSink):
+    """Plain text lines of `utils.print_recognition_result`."""
+
+    def format(self, result, channel):
+        return utils.format_recognition_result(result, channel)
+
+
+class JsonLinesSink(ResultSink):
+    """A JSON object of `utils.result_to_dict` per line."""
+
+    def format(self, result, channel):
+        record = utils.result_to_dict(result)
+        if channel is not None:
+            record['channel'] = channel
+        return json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def _timestamp(seconds, separator):
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return (f'{hours:02d}:{minutes:02d}:{seconds:02d}'
+            f'{separator}{milliseconds:03d}')
+
+
+class _SubtitleSink(ResultSink):
+    """Cues of the final results spanning their words.
+
+    Results need word time offsets. Interim results and results without
+    words are skipped.
+    """
+
+    _SEPARATOR = '.'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._num_cues = 0
+
+    def _cue_text(self, transcript, channel):
+        del channel  # Unused
+        return transcript
+
+    def format(self, result, channel):
+        if not getattr(result, 'is_final', True):
+            return ''
+        start_time = utils.result_start_seconds(result)
+        if start_time is None:
+            return ''
+        self._num_cues += 1
+        end_time = utils.result_end_seconds(result)
+        return (f'{self._num_cues}\n'
+                f'{_timestamp(start_time, self._SEPARATOR)} --> '
+                f'{_timestamp(end_time, self._SEPARATOR)}\n'
+                f'{self._cue_text(result.alternatives[0].transcript, channel)}'
+                '\n\n')
+
+
+class SrtSink(_SubtitleSink):
+    """SubRip subtitles. The channel prefixes the text of a cue."""
+
+    _SEPARATOR = ','
+
+    def _cue_text(self, transcript, channel):
+        if channel is None:
+            return transcript
+        return f'[channel {channel}] {transcript}'
+
+
+class VttSink(_SubtitleSink):
+    """WebVTT subtitles. The channel is the voice of a cue."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._append('WEBVTT\n\n')
+
+    def _cue_text(self, transcript, channel):
+        if channel is None:
+            return transcript
+        return f'<v Channel {channel}>{transcript}'
+
+
+_SINKS = {
+    'text': TextSink,
+    'jsonl': JsonLinesSink,
+    'srt': SrtSink,
+    'vtt': VttSink,
+}
+
+
+def open_sink(output_format: str,
+              output_path: str = '-',
+              buffer_size: int = BUFFER_SIZE) -> ResultSink:
+    """Open a sink writing results to a file or stdout.
+
+    Args:
+        output_format: One of FORMATS.
+        output_path: Output path, or '-' for stdout.
+        buffer_size: Number of characters buffered before they are written.
+
+    Returns:
+        ResultSink object, to be closed once all results are written.
+    """
+    if output_path == '-':
+        return _SINKS[output_format](sys.stdout, buffer_size)
+    return _SINKS[output_format](open(output_path, 'w', encoding='utf-8'),
+                                 buffer_size,
+                                 close_output=True)
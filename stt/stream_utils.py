@@ -0,0 +1,334 @@
+"""Resumable and concurrent StreamingRecognize calls for AIQ.STT APIs."""
+
+import asyncio
+import collections
+import heapq
+import itertools
+import queue
+import threading
+from typing import (AsyncIterable, AsyncIterator, Iterable, Iterator, List,
+                    Optional, Sequence, Tuple)
+
+from absl import logging
+import grpc
+
+from google.speech.v1 import cloud_speech_pb2
+import utils
+
+# Status codes after which a stream is resumed. Streams reset by a proxy, or
+# failing while an aio call is writing a request, end with INTERNAL.
+RESUMABLE_STATUS_CODES = (grpc.StatusCode.UNAVAILABLE,
+                          grpc.StatusCode.ABORTED,
+                          grpc.StatusCode.INTERNAL)
+# Seconds of audio not covered by final results that are kept for resuming a
+# stream. Streams buffering more, e.g. of long silence or of final results
+# without word time offsets, are not resumed.
+MAX_BUFFER_SECONDS = 60.0
+
+
+class ReplayBuffer:
+    """Audio sent on a stream that is not covered by final results yet.
+
+    Chunks are pulled from the source only once, and every attempt of the
+    stream replays the buffered audio from the end of the last final result
+    before it continues with new chunks. Only LINEAR16 audio can be cut at an
+    arbitrary time.
+
+    Once more than `max_bytes` are buffered, the buffer is dropped and the
+    audio is passed through without being kept, so that memory stays bounded,
+    and the stream can no longer be resumed.
+    """
+
+    def __init__(self,
+                 source,
+                 bytes_per_second: int,
+                 sample_width: int = 2,
+                 max_bytes: Optional[int] = None):
+        self._source = source
+        self._bytes_per_second = bytes_per_second
+        self._sample_width = sample_width
+        self._max_bytes = max_bytes
+        # Whether the buffer was dropped for exceeding `max_bytes`.
+        self.overflowed = False
+        self._chunks = collections.deque()
+        # Index and byte offset of the first buffered chunk.
+        self._first_index = 0
+        self._first_offset = 0
+        self._end_offset = 0
+        # Byte offset of the end of the last final result.
+        self._committed = 0
+        # Guards the buffer, which results are committed to from another
+        # thread than the one sending the requests.
+        self._lock = threading.Lock()
+        # Serializes pulls from the source by the attempts.
+        self._source_lock = threading.Lock()
+        self._async_source_lock = None
+
+    @property
+    def committed_seconds(self) -> float:
+        """Time of the end of the last final result."""
+        return self._committed / self._bytes_per_second
+
+    def commit(self, seconds: float):
+        """Drop the audio before `seconds`, which final results cover."""
+        offset = int(seconds * self._bytes_per_second)
+        offset -= offset % self._sample_width
+        with self._lock:
+            self._committed = min(max(offset, self._committed),
+                                  self._end_offset)
+            while (self._chunks and self._first_offset + len(self._chunks[0])
+                   <= self._committed):
+                self._first_offset += len(self._chunks.popleft())
+                self._first_index += 1
+
+    def _start(self):
+        with self._lock:
+            return self._first_index, self._committed - self._first_offset
+
+    def _get(self, index):
+        with self._lock:
+            position = index - self._first_index
+            if position < len(self._chunks):
+                return self._chunks[position]
+        return None
+
+    def _append(self, chunk):
+        with self._lock:
+            if self.overflowed:
+                return
+            self._chunks.append(chunk)
+            self._end_offset += len(chunk)
+            if (self._max_bytes is not None and
+                    self._end_offset - self._committed > self._max_bytes):
+                logging.warning(
+                    'More than %.0fs of audio are not covered by final '
+                    'results, the stream will not be resumed',
+                    self._max_bytes / self._bytes_per_second)
+                self.overflowed = True
+                self._chunks.clear()
+
+    def replay(self) -> Iterator[bytes]:
+        """Generate the audio of a new attempt of the stream."""
+        index, skip = self._start()
+        while True:
+            chunk = self._get(index)
+            if chunk is None:
+                with self._source_lock:
+                    # The previous attempt may have pulled it in the meantime.
+                    chunk = self._get(index)
+                    if chunk is None:
+                        chunk = next(self._source, None)
+                        if chunk is None:
+                            return
+                        self._append(chunk)
+            index += 1
+            if skip:
+                chunk, skip = chunk[skip:], 0
+            yield chunk
+
+    async def replay_async(self) -> AsyncIterator[bytes]:
+        """Generate the audio of a new attempt of the stream asynchronously."""
+        if self._async_source_lock is None:
+            self._async_source_lock = asyncio.Lock()
+        index, skip = self._start()
+        while True:
+            chunk = self._get(index)
+            if chunk is None:
+                async with self._async_source_lock:
+                    chunk = self._get(index)
+                    if chunk is None:
+                        try:
+                            chunk = await self._source.__anext__()
+                        except StopAsyncIteration:
+                            return
+                        self._append(chunk)
+            index += 1
+            if skip:
+                chunk, skip = chunk[skip:], 0
+            yield chunk
+
+
+def _settle(response, buffer, offset):
+    """Shift results of a resumed stream and commit their final audio."""
+    for result in response.results:
+        if offset:
+            utils.offset_result(result, offset)
+        if result.is_final and result.alternatives:
+            words = result.alternatives[0].words
+            if words:
+                buffer.commit(utils.time_to_second(words[-1].end_time))
+
+
+def _requests(config_request, chunks):
+    yield config_request
+    for chunk in chunks:
+        yield cloud_speech_pb2.StreamingRecognizeRequest(audio_content=chunk)
+
+
+async def _requests_async(config_request, chunks):
+    yield config_request
+    async for chunk in chunks:
+        yield cloud_speech_pb2.StreamingRecognizeRequest(audio_content=chunk)
+
+
+def _should_resume(error, attempt, max_resumes, buffer):
+    if (error.code() not in RESUMABLE_STATUS_CODES or attempt >= max_resumes or
+            buffer.overflowed):
+        return False
+    logging.warning('StreamingRecognize failed with %s, resuming from %.2fs',
+                    error.code().name, buffer.committed_seconds)
+    return True
+
+
+def streaming_recognize(
+    stub,
+    requests: Iterable[cloud_speech_pb2.StreamingRecognizeRequest],
+    max_resumes: int = 3,
+    bytes_per_second: int = 32000,
+    max_buffer_seconds: float = MAX_BUFFER_SECONDS,
+    **kwargs,
+) -> Iterator[cloud_speech_pb2.StreamingRecognizeResponse]:
+    """Call StreamingRecognize, resuming the stream after transient failures.
+
+    When the stream fails with one of RESUMABLE_STATUS_CODES, a new stream is
+    started with the same config and the audio after the last final result is
+    sent again. Results of a resumed stream are shifted to be relative to the
+    start of the audio. The end of final results is taken from their word
+    time offsets, which should be enabled. The audio must be LINEAR16, unless
+    `max_resumes` is zero, in which case the requests are sent as they are
+    without being buffered.
+
+    Args:
+        stub: SpeechStub.
+        requests: StreamingRecognizeRequest objects, the first holding the
+            config only.
+        max_resumes: Maximum number of times the stream is resumed.
+        bytes_per_second: Bytes per second of the audio.
+        max_buffer_seconds: Seconds of audio after the last final result kept
+            for resuming the stream. The stream is not resumed once more is
+            buffered.
+        **kwargs: Other arguments of the call, e.g. metadata.
+
+    Yields:
+        StreamingRecognizeResponse objects.
+    """
+    if max_resumes <= 0:
+        yield from stub.StreamingRecognize(requests, **kwargs)
+        return
+
+    requests = iter(requests)
+    config_request = next(requests)
+    buffer = ReplayBuffer((request.audio_content for request in requests),
+                          bytes_per_second,
+                          max_bytes=int(max_buffer_seconds * bytes_per_second))
+    for attempt in itertools.count():
+        offset = buffer.committed_seconds
+        responses = stub.StreamingRecognize(
+            _requests(config_request, buffer.replay()), **kwargs)
+        try:
+            for response in responses:
+                _settle(response, buffer, offset)
+                yield response
+            return
+        except grpc.RpcError as e:
+            if not _should_resume(e, attempt, max_resumes, buffer):
+                raise
+
+
+async def streaming_recognize_async(
+    stub,
+    requests: AsyncIterable[cloud_speech_pb2.StreamingRecognizeRequest],
+    max_resumes: int = 3,
+    bytes_per_second: int = 32000,
+    max_buffer_seconds: float = MAX_BUFFER_SECONDS,
+    **kwargs,
+) -> AsyncIterator[cloud_speech_pb2.StreamingRecognizeResponse]:
+    """Call StreamingRecognize of an aio stub, resuming it after failures.
+
+    Takes the same arguments as `streaming_recognize`.
+    """
+    if max_resumes <= 0:
+        async for response in stub.StreamingRecognize(requests, **kwargs):
+            yield response
+        return
+
+    requests = requests.__aiter__()
+    config_request = await requests.__anext__()
+
+    async def audio():
+        async for request in requests:
+            yield request.audio_content
+
+    buffer = ReplayBuffer(audio(),
+                          bytes_per_second,
+                          max_bytes=int(max_buffer_seconds * bytes_per_second))
+    for attempt in itertools.count():
+        offset = buffer.committed_seconds
+        call = stub.StreamingRecognize(
+            _requests_async(config_request, buffer.replay_async()), **kwargs)
+        try:
+            async for response in call:
+                _settle(response, buffer, offset)
+                yield response
+            return
+        except grpc.RpcError as e:
+            if not _should_resume(e, attempt, max_resumes, buffer):
+                raise
+
+
+def merge_streams(streams: Sequence[Iterable]) -> Iterator[Tuple[int, object]]:
+    """Consume the final results of each channel concurrently, in time order.
+
+    Every stream runs on a thread of its own. A result is yielded once each
+    other running stream has produced a result ending after its start, or has
+    ended, so the merged timeline is ordered by the first word of the results
+    while they are still coming in.
+
+    Args:
+        streams: Iterables of the final results of each channel, each in time
+            order, e.g. of a `streaming_recognize` call per channel.
+
+    Yields:
+        (channel index, result) pairs.
+    """
+    events = queue.Queue()
+    end = object()
+
+    def consume(channel, stream):
+        try:
+            for result in stream:
+                events.put((channel, result))
+        except Exception as e:  # pylint: disable=broad-except
+            events.put((channel, e))
+            return
+        events.put((channel, end))
+
+    for channel, stream in enumerate(streams):
+        threading.Thread(target=consume, args=(channel, stream),
+                         daemon=True).start()
+
+    # Time up to which each channel has produced its results.
+    watermarks: List[float] = [0.0] * len(streams)
+    running = set(range(len(streams)))
+    pending = []
+    sequence = itertools.count()
+    while running:
+        channel, item = events.get()
+        if item is end:
+            running.discard(channel)
+        elif isinstance(item, Exception):
+            raise item
+        else:
+            start_time = utils.result_start_seconds(item)
+            if start_time is None:
+                start_time = watermarks[channel]
+            end_time = utils.result_end_seconds(item)
+            watermarks[channel] = max(watermarks[channel], start_time,
+                                      end_time or 0.0)
+            heapq.heappush(pending,
+                           (start_time, channel, next(sequence), item))
+        horizon = min((watermarks[other] for other in running),
+                      default=float('inf'))
+        while pending and pending[0][0] <= horizon:
+            _, channel, _, result = heapq.heappop(pending)
+            yield channel, result
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Dependencies:
+    - python 3.8
+
+Before executing this script, you should compile protobuf files:
+    $ cd proto
+    $ make
+
+Usage:
+    $ python streaming_gateway.py --api_key <AIQ api key> \
+        --port 9000 --unix_socket /tmp/aiq_stt.sock --num_channels 4
+
+    Each connection to the gateway is one StreamingRecognize session. A
+    producer first sends a single JSON header line with the session options,
+    then raw 16-bit mono PCM audio, and half-closes the connection when the
+    audio ends. Recognition results are written back on the same connection
+    as JSON lines while the audio is being streamed.
+
+    $ (echo '{"interim_results": true}'; \
+        sox input.wav -t raw -r 16000 -b 16 -c 1 -e signed -) | \
+        nc -N localhost 9000
+
+    Supported header keys are `language_code` (string), `sample_rate_hertz`
+    (integer), `interim_results` (boolean) and `speech_context_phrases` (list
+    of strings). A connection with an invalid header is answered with an
+    `{"error": ...}` line and closed, without taking a session slot.
+"""
+import asyncio
+import json
+import sys
+from typing import AsyncGenerator
+
+from absl import flags
+from absl import logging
+import grpc
+
+from google.speech.v1 import cloud_speech_pb2
+from google.speech.v1 import cloud_speech_pb2_grpc
+import audio_utils
+import grpc_utils
+import metrics_utils
+import utils
+
+flags.DEFINE_string('api_url', 'aiq.skelterlabs.com:443', 'AIQ portal address.')
+flags.DEFINE_string('api_key', None, 'AIQ project api key.')
+flags.DEFINE_boolean('insecure', None, 'Use plaintext and insecure connection.')
+flags.DEFINE_string('host', 'localhost', 'Host address to listen on.')
+flags.DEFINE_integer('port', 9000, 'TCP port to listen on. 0 disables TCP.')
+flags.DEFINE_string('unix_socket', None, 'Unix socket path to listen on.')
+flags.DEFINE_integer(
+    'num_channels', 4, 'Number of pooled aio channels, each on its own '
+    'connection, shared by the sessions.')
+flags.DEFINE_integer('max_sessions', 1000,
+                     'Maximum number of concurrent sessions.')
+flags.DEFINE_integer('chunk_ms', 32, 'Duration of each audio chunk in ms.')
+flags.DEFINE_integer(
+    'metrics_port', None, 'Serve client metrics to Prometheus at '
+    'http://localhost:<port>/metrics.')
+flags.register_validator('chunk_ms',
+                         lambda value: value > 0,
+                         message='--chunk_ms must be positive.')
+FLAGS = flags.FLAGS
+
+SR = 16000
+
+
+# Types of the supported header keys.
+HEADER_TYPES = {
+    'language_code': str,
+    'sample_rate_hertz': int,
+    'interim_results': bool,
+    'speech_context_phrases': list,
+}
+
+
+def parse_header(line: bytes) -> dict:
+    """Parse and validate the session header sent by a producer.
+
+    Args:
+        line: JSON header line. An empty line selects the defaults.
+
+    Returns:
+        Session options.
+
+    Raises:
+        ValueError: The header is not a JSON object of the supported keys and
+            types.
+    """
+    header = json.loads(line) if line.strip() else {}
+    if not isinstance(header, dict):
+        raise ValueError('Header should be a JSON object')
+    for key, value in header.items():
+        if key not in HEADER_TYPES:
+            raise ValueError(f'Unsupported header key: {key}')
+        value_type = HEADER_TYPES[key]
+        # bool is an int, which is not a valid sample rate.
+        if not isinstance(value, value_type) or (value_type is int and
+                                                 isinstance(value, bool)):
+            raise ValueError(f'{key} should be of type {value_type.__name__}')
+    if header.get('sample_rate_hertz', SR) <= 0:
+        raise ValueError('sample_rate_hertz should be positive')
+    if not all(
+            isinstance(phrase, str)
+            for phrase in header.get('speech_context_phrases', [])):
+        raise ValueError('speech_context_phrases should be strings')
+    return header
+
+
+def make_streaming_config(
+        header: dict) -> cloud_speech_pb2.StreamingRecognitionConfig:
+    """Create StreamingRecognitionConfig from the session header.
+
+    Args:
+        header: Session options of `parse_header`.
+
+    Returns:
+        StreamingRecognitionConfig object.
+    """
+    phrases = header.get('speech_context_phrases')
+    speech_contexts = ([cloud_speech_pb2.SpeechContext(phrases=phrases)]
+                       if phrases else None)
+    config = cloud_speech_pb2.RecognitionConfig(
+        enable_word_time_offsets=True,
+        # pylint: disable=no-member
+        encoding=cloud_speech_pb2.RecognitionConfig.AudioEncoding.LINEAR16,
+        language_code=header.get('language_code', 'ko-KR'),
+        sample_rate_hertz=header.get('sample_rate_hertz', SR),
+        speech_contexts=speech_contexts,
+    )
+    return cloud_speech_pb2.StreamingRecognitionConfig(
+        config=config,
+        interim_results=header.get('interim_results', False),
+    )
+
+
+async def generate_requests(
+    reader: asyncio.StreamReader,
+    config: cloud_speech_pb2.StreamingRecognitionConfig,
+    chunk_size: int,
+) -> AsyncGenerator[cloud_speech_pb2.StreamingRecognizeRequest, None]:
+    """Generate requests from the PCM audio sent by a producer.
+
+    The connection is only read when gRPC asks for the next request, so a
+    producer sending faster than the upstream accepts is throttled by TCP flow
+    control instead of being buffered in memory.
+
+    Args:
+        reader: Stream reader of the producer connection.
+        config: StreamingRecognitionConfig object.
+        chunk_size: Maximum size of each chunk in bytes.
+
+    Yields:
+        StreamingRecognizeRequest objects.
+    """
+    # The first request should hold config only.
+    yield cloud_speech_pb2.StreamingRecognizeRequest(streaming_config=config)
+
+    while True:
+        chunk = await reader.read(chunk_size)
+        if not chunk:
+            break
+        yield cloud_speech_pb2.StreamingRecognizeRequest(audio_content=chunk)
+
+
+class Gateway:
+    """Run one StreamingRecognize session per producer connection."""
+
+    def __init__(self, get_channel, max_sessions: int, chunk_ms: int):
+        self._get_channel = get_channel
+        self._semaphore = asyncio.Semaphore(max_sessions)
+        self._chunk_ms = chunk_ms
+        self._num_sessions = 0
+
+    async def handle_session(self, reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter):
+        """Relay audio of a producer upstream and fan its results back."""
+        peer = writer.get_extra_info('peername') or 'unix'
+        try:
+            # The header is read before a session slot is taken, so that idle
+            # connections do not hold one.
+            try:
+                config = make_streaming_config(
+                    parse_header(await reader.readline()))
+                chunk_size = audio_utils.chunk_size_from_ms(
+                    self._chunk_ms, config.config.sample_rate_hertz)
+            except ValueError as e:
+                logging.warning('Session rejected: %s: %s', peer, e)
+                writer.write(_error_line(f'INVALID_ARGUMENT: {e}'))
+                await writer.drain()
+                return
+            async with self._semaphore:
+                await self._run_session(peer, config, chunk_size, reader,
+                                        writer)
+        except ConnectionError as e:
+            logging.warning('Session failed: %s: %s', peer, e)
+        finally:
+            await _close(writer)
+
+    async def _run_session(self, peer, config, chunk_size, reader, writer):
+        call = None
+        self._num_sessions += 1
+        logging.info('Session started: %s (active: %d)', peer,
+                     self._num_sessions)
+        try:
+            stub = cloud_speech_pb2_grpc.SpeechStub(self._get_channel())
+            call = stub.StreamingRecognize(
+                generate_requests(reader, config, chunk_size))
+            async for response in call:
+                for result in response.results:
+                    writer.write(
+                        json.dumps(utils.result_to_dict(result),
+                                   ensure_ascii=False).encode() + b'\n')
+                await writer.drain()
+        except grpc.RpcError as e:
+            writer.write(_error_line(f'{e.code().name}: {e.details()}'))
+        finally:
+            if call is not None:
+                call.cancel()
+            await _close(writer)
+            self._num_sessions -= 1
+            logging.info('Session finished: %s (active: %d)', peer,
+                         self._num_sessions)
+
+
+async def _close(writer):
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except ConnectionError:
+        pass
+
+
+def _error_line(error: str) -> bytes:
+    return json.dumps({'error': error}).encode() + b'\n'
+
+
+async def main():
+    metrics = metrics_utils.Metrics()
+    interceptors = metrics_utils.metrics_interceptors(metrics, is_aio=True)
+    if FLAGS.metrics_port:
+        metrics_utils.serve_prometheus(metrics, FLAGS.metrics_port)
+
+    def get_channel():
+        # Sessions are spread over the healthy channels of the pool.
+        return grpc_utils.get_aio_channel(FLAGS.api_url,
+                                          api_key=FLAGS.api_key,
+                                          insecure=FLAGS.insecure,
+                                          interceptors=interceptors,
+                                          num_channels=FLAGS.num_channels)
+
+    gateway = Gateway(get_channel, FLAGS.max_sessions, FLAGS.chunk_ms)
+
+    servers = []
+    if FLAGS.port:
+        servers.append(await asyncio.start_server(gateway.handle_session,
+                                                  FLAGS.host, FLAGS.port))
+    if FLAGS.unix_socket:
+        servers.append(await asyncio.start_unix_server(gateway.handle_session,
+                                                       FLAGS.unix_socket))
+    for server in servers:
+        for sock in server.sockets:
+            logging.info('Listening on %s', sock.getsockname())
+
+    try:
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+    finally:
+        await grpc_utils.close_aio_channels()
+
+
+if __name__ == '__main__':
+    FLAGS(sys.argv)
+    logging.set_verbosity(logging.INFO)
+    asyncio.run(main())
@@ -3,7 +3,7 @@
 Dependencies:
     - python 3.8
 
-The librosa requires libsndfile.
+The soundfile requires libsndfile.
     macOS) brew install libsndfile
     ubuntu) apt install libsndfile1
 
@@ -14,16 +14,19 @@ Before executing this script, you should compile protobuf files:
 Usage:
     $ python streaming_recognize.py --api_key <AIQ api key>
 """
-from typing import Generator
+import sys
+from typing import Generator, Iterable, Optional
 
 from absl import app
 from absl import flags
-import librosa
-import numpy as np
 
 from google.speech.v1 import cloud_speech_pb2
 from google.speech.v1 import cloud_speech_pb2_grpc
+import audio_utils
+import cache_utils
 import grpc_utils
+import sink_utils
+import stream_utils
 import utils
 
 flags.DEFINE_string('api_url', 'aiq.skelterlabs.com:443', 'AIQ portal address.')
@@ -38,20 +41,82 @@ flags.DEFINE_list('speech_context_phrases', None, 'Phrases for speech context')
 flags.DEFINE_string('speech_context_id', None, 'Speech context ID to apply')
 flags.DEFINE_string('substitution_rule_id', None, 'Substitution rule ID to '
                     'apply')
+flags.DEFINE_integer('chunk_ms', 32, 'Duration of each audio chunk in ms.')
+flags.DEFINE_float(
+    'realtime_factor', 0.0, 'Send audio at this multiple of real time, '
+    'e.g. 1.0 for live-call speed. Zero sends audio as fast as possible.')
+flags.DEFINE_integer(
+    'max_burst_ms', 0, 'How far ahead of the real time schedule audio may be '
+    'sent when --realtime_factor is set.')
+flags.DEFINE_boolean('skip_silence', False,
+                     'Remove silence from the audio before sending it.')
+flags.DEFINE_float('silence_threshold_db', -40.0,
+                   'Frames quieter than this (dBFS) are treated as silence.')
+flags.DEFINE_integer('silence_padding_ms', 200,
+                     'Duration of silence kept around speech.')
+flags.DEFINE_enum(
+    'encoding', 'LINEAR16', audio_utils.ENCODINGS,
+    'Audio encoding to send. Compressed inputs already in the requested '
+    'encoding are sent as is.')
+flags.DEFINE_integer(
+    'max_resumes', 3, 'Maximum number of times a stream failing with a '
+    'transient error is resumed. Only LINEAR16 audio can be resumed.')
+flags.DEFINE_boolean(
+    'multichannel', False, 'Recognize each channel of the audio on its own '
+    'stream concurrently, and merge their final results into one timeline '
+    'tagged by channel.')
+flags.DEFINE_enum(
+    'output_format', None, sink_utils.FORMATS,
+    'Write the results in this format through a buffered sink instead of '
+    'printing each line. srt and vtt only hold final results.')
+flags.DEFINE_string('output_path', '-',
+                    'Output path of --output_format. Defaults to stdout.')
+flags.DEFINE_enum(
+    'cache', None, cache_utils.BACKENDS,
+    'Memoize results keyed by the audio and the config in this backend.')
+flags.DEFINE_string(
+    'cache_path', None, 'Directory of the disk cache, or database file of the '
+    'sqlite cache.')
+flags.DEFINE_integer('cache_mb', 1024, 'Maximum size of the cache in MiB.')
+flags.DEFINE_float(
+    'cache_ttl_hours', 0, 'Hours after which cached results expire. Zero '
+    'keeps them until they are evicted.')
+flags.register_multi_flags_validator(
+    ['cache', 'cache_path'],
+    lambda values: values['cache'] in (None, 'memory') or values['cache_path'],
+    message='--cache_path is required by the disk and sqlite caches.')
+flags.register_validator('chunk_ms',
+                         lambda value: value > 0,
+                         message='--chunk_ms must be positive.')
+flags.register_validator('realtime_factor',
+                         lambda value: value >= 0,
+                         message='--realtime_factor must not be negative.')
+flags.register_validator('max_burst_ms',
+                         lambda value: value >= 0,
+                         message='--max_burst_ms must not be negative.')
 FLAGS = flags.FLAGS
 
 
 def generate_requests(
     audio_path: str,
     config: cloud_speech_pb2.StreamingRecognitionConfig,
-    chunk_size: int = 1024
+    chunk_ms: int = 32,
+    realtime_factor: float = 0.0,
+    max_burst_ms: int = 0,
+    silence_remover: Optional[audio_utils.SilenceRemover] = None,
+    encoding: str = 'LINEAR16',
 ) -> Generator[cloud_speech_pb2.StreamingRecognizeRequest, None, None]:
-    """Generate chunks of 16kHz audio encoded as LINEAR16.
+    """Generate chunks of 16kHz audio.
 
     Args:
         audio_path: Audio file path.
         config: StreamingRecognitionConfig object.
-        chunk_size: Size of each chunk in bytes.
+        chunk_ms: Duration of each chunk in milliseconds.
+        realtime_factor: Send audio at this multiple of real time. Zero or less
+            sends audio as fast as possible.
+        max_burst_ms: How far ahead of the real time schedule audio may be sent.
+        silence_remover: If given, silence is removed before sending.
+        encoding: Name of the `RecognitionConfig.AudioEncoding` to send.
 
     Yields:
         StreamingRecognizeRequest objects.
@@ -60,15 +125,66 @@ def generate_requests(
     # The first request should hold config only.
     yield cloud_speech_pb2.StreamingRecognizeRequest(streaming_config=config)
 
-    content, sample_rate = librosa.load(audio_path, sr=16000)
-    del sample_rate
-    if content.dtype in (np.float32, np.float64):
-        content = (content * np.iinfo(np.int16).max).astype(np.int16)
-    content = content.tobytes()
+    # Audio is decoded block by block so that the first chunk is sent without
+    # waiting for the whole file to be decoded.
+    for chunk in audio_utils.stream_audio_content(
+            audio_path,
+            chunk_ms,
+            16000,
+            encoding=encoding,
+            realtime_factor=realtime_factor,
+            max_burst_ms=max_burst_ms,
+            silence_remover=silence_remover):
+        yield cloud_speech_pb2.StreamingRecognizeRequest(audio_content=chunk)
+
 
-    for from_idx in range(0, len(content), chunk_size):
-        yield cloud_speech_pb2.StreamingRecognizeRequest(
-            audio_content=content[from_idx:from_idx + chunk_size])
+def generate_channel_requests(
+    samples,
+    config: cloud_speech_pb2.StreamingRecognitionConfig,
+    chunk_ms: int = 32,
+    realtime_factor: float = 0.0,
+    max_burst_ms: int = 0,
+    silence_remover: Optional[audio_utils.SilenceRemover] = None,
+    encoding: str = 'LINEAR16',
+) -> Generator[cloud_speech_pb2.StreamingRecognizeRequest, None, None]:
+    """Generate chunks of a channel of 16kHz audio.
+
+    Takes the same arguments as `generate_requests`, but the decoded samples
+    of a channel, e.g. of `audio_utils.load_channels`, instead of a file.
+    """
+    yield cloud_speech_pb2.StreamingRecognizeRequest(streaming_config=config)
+    for chunk in audio_utils.stream_samples_content(
+            samples,
+            chunk_ms,
+            16000,
+            encoding=encoding,
+            realtime_factor=realtime_factor,
+            max_burst_ms=max_burst_ms,
+            silence_remover=silence_remover):
+        yield cloud_speech_pb2.StreamingRecognizeRequest(audio_content=chunk)
+
+
+def final_results(
+    responses: Iterable[cloud_speech_pb2.StreamingRecognizeResponse],
+    silence_remover: Optional[audio_utils.SilenceRemover] = None,
+) -> Generator[cloud_speech_pb2.StreamingRecognitionResult, None, None]:
+    """Yield the final results of a stream in the time of the original audio.
+
+    Args:
+        responses: StreamingRecognizeResponse objects.
+        silence_remover: Silence remover of the audio of the stream, if any.
+
+    Yields:
+        Final StreamingRecognitionResult objects.
+    """
+    for response in responses:
+        for result in response.results:
+            if not result.is_final:
+                continue
+            if silence_remover is not None:
+                utils.map_result_times(result,
+                                       silence_remover.offset_map.to_original)
+            yield result
 
 
 def main(args):
@@ -86,7 +202,8 @@ def main(args):
         speech_contexts = None
     config = cloud_speech_pb2.RecognitionConfig(
         enable_word_time_offsets=True,
-        encoding=cloud_speech_pb2.RecognitionConfig.AudioEncoding.LINEAR16,
+        encoding=cloud_speech_pb2.RecognitionConfig.AudioEncoding.Value(
+            FLAGS.encoding),
         language_code='ko-KR',
         sample_rate_hertz=16000,
         speech_contexts=speech_contexts,
@@ -98,18 +215,133 @@ def main(args):
         interim_results=FLAGS.interim_results,
     )
 
-    request_generator = generate_requests(FLAGS.audio_path, streaming_config)
+    def make_silence_remover():
+        if not FLAGS.skip_silence:
+            return None
+        return audio_utils.SilenceRemover(16000, FLAGS.silence_threshold_db,
+                                          FLAGS.silence_padding_ms)
 
-    # StreamingRecognize() returns a generator of responses.
-    response_generator = stub.StreamingRecognize(request_generator)
+    def streaming_recognize(request_generator):
+        # StreamingRecognize() returns a generator of responses. The stream is
+        # resumed from the last final result after transient failures.
+        return stream_utils.streaming_recognize(
+            stub,
+            request_generator,
+            max_resumes=FLAGS.max_resumes
+            if FLAGS.encoding == 'LINEAR16' else 0,
+            bytes_per_second=16000 * audio_utils.SAMPLE_WIDTH)
 
-    for response in response_generator:
-        # Once the transcription has settled, the first result will contain the
-        # is_final result. The other results will be for subsequent portions of
-        # the audio.
-        for result in response.results:
-            print(f'Finished: {result.is_final}')
-            utils.print_recognition_result(result)
+    cache = None
+    if FLAGS.cache:
+        cache = cache_utils.ResultCache(
+            cache_utils.open_backend(FLAGS.cache, FLAGS.cache_path,
+                                     FLAGS.cache_mb * 2**20),
+            ttl=FLAGS.cache_ttl_hours * 3600 or None)
+
+    def recognize_stream(make_requests):
+        """Return the responses of a stream and its silence remover.
+
+        `make_requests(silence_remover, realtime_factor, encoding)` generates
+        the requests of the stream.
+        """
+        silence_remover = make_silence_remover()
+        requests = make_requests(silence_remover, FLAGS.realtime_factor,
+                                 FLAGS.encoding)
+        if cache is None:
+            return streaming_recognize(requests), silence_remover
+        # The audio is read once as LINEAR16, without pacing, to look up its
+        # results, which are replayed without sending the audio on a hit.
+        # Compressed encoders do not produce the same bytes twice, so the key
+        # is built from the PCM audio before encoding.
+        key_silence_remover = make_silence_remover()
+        key = cache_utils.streaming_key(
+            make_requests(key_silence_remover, 0.0, 'LINEAR16'))
+        responses = cache.lookup_streaming(key)
+        if responses is not None:
+            return iter(responses), key_silence_remover
+        return cache.streaming_recognize(streaming_recognize, requests,
+                                         key=key), silence_remover
+
+    def request_options(silence_remover, realtime_factor, encoding):
+        return dict(chunk_ms=FLAGS.chunk_ms,
+                    realtime_factor=realtime_factor,
+                    max_burst_ms=FLAGS.max_burst_ms,
+                    silence_remover=silence_remover,
+                    encoding=encoding)
+
+    sink = None
+    if FLAGS.output_format:
+        sink = sink_utils.open_sink(FLAGS.output_format, FLAGS.output_path)
+
+    def write_result(result, channel=None):
+        if sink is None:
+            utils.print_recognition_result(result, channel=channel)
+        else:
+            sink.write(result, channel)
+
+    def flush():
+        # Results written to stdout are shown as they come in, one write per
+        # response, while a file is written in large blocks.
+        if sink is not None and FLAGS.output_path == '-':
+            sink.flush()
+
+    try:
+        if FLAGS.multichannel:
+            streams = []
+            silence_removers = []
+            for samples in audio_utils.load_channels(FLAGS.audio_path):
+                response_generator, silence_remover = recognize_stream(
+                    lambda silence_remover, realtime_factor, encoding,
+                    samples=samples: generate_channel_requests(
+                        samples, streaming_config,
+                        **request_options(silence_remover, realtime_factor,
+                                          encoding)))
+                streams.append(
+                    final_results(response_generator, silence_remover))
+                silence_removers.append(silence_remover)
+
+            # The channels are recognized concurrently and their final
+            # results are merged into one timeline.
+            for channel, result in stream_utils.merge_streams(streams):
+                write_result(result, channel)
+                flush()
+        else:
+            response_generator, silence_remover = recognize_stream(
+                lambda silence_remover, realtime_factor, encoding:
+                generate_requests(
+                    FLAGS.audio_path, streaming_config,
+                    **request_options(silence_remover, realtime_factor,
+                                      encoding)))
+            silence_removers = [silence_remover]
+
+            for response in response_generator:
+                # Once the transcription has settled, the first result will
+                # contain the is_final result. The other results will be for
+                # subsequent portions of the audio.
+                for result in response.results:
+                    if sink is None:
+                        print(f'Finished: {result.is_final}')
+                    if silence_remover is not None:
+                        # Map the timestamps back to the time of the original
+                        # audio.
+                        utils.map_result_times(
+                            result, silence_remover.offset_map.to_original)
+                    write_result(result)
+                flush()
+    finally:
+        if sink is not None:
+            sink.close()
+
+    for channel, silence_remover in enumerate(silence_removers):
+        if silence_remover is not None:
+            tag = f'Channel {channel}: ' if FLAGS.multichannel else ''
+            print(
+                f'{tag}Skipped {silence_remover.removed_seconds:.2f}s of '
+                f'{silence_remover.total_seconds:.2f}s as silence '
+                f'({silence_remover.removed_bytes} bytes)',
+                file=sys.stderr)
+    if cache is not None:
+        print(f'Cache: {cache.stats()}', file=sys.stderr)
 
 
 if __name__ == '__main__':
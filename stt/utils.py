@@ -1,7 +1,9 @@
 """Utilities for AIQ.STT APIs."""
 
 import datetime
+import heapq
 import sys
+from typing import List, Optional, Sequence, Tuple
 
 
 def time_to_second(time_info):
@@ -11,30 +13,132 @@ def time_to_second(time_info):
     return time_info.seconds + time_info.nanos / 1e9
 
 
-def print_recognition_result(result, file=sys.stdout):
-    """Print google/saojung recognition result."""
+def map_result_times(result, time_fn):
+    """Replace word time offsets of the result with `time_fn(seconds)`."""
+    for alternative in result.alternatives:
+        for word in alternative.words:
+            for time_info in (word.start_time, word.end_time):
+                time_info.FromNanoseconds(
+                    int(time_fn(time_to_second(time_info)) * 1e9))
+    return result
+
+
+def offset_result(result, offset):
+    """Shift word time offsets of the result by `offset` seconds in place."""
+    return map_result_times(result, lambda seconds: seconds + offset)
+
+
+def result_start_seconds(result) -> Optional[float]:
+    """Return the start time of the first word of the result, if any."""
+    if not result.alternatives or not result.alternatives[0].words:
+        return None
+    return time_to_second(result.alternatives[0].words[0].start_time)
+
+
+def result_end_seconds(result) -> Optional[float]:
+    """Return the end time of the last word of the result, if any."""
+    if not result.alternatives or not result.alternatives[0].words:
+        return None
+    return time_to_second(result.alternatives[0].words[-1].end_time)
+
+
+def merge_channel_results(
+        channel_results: Sequence[Sequence]) -> List[Tuple[int, object]]:
+    """Merge the results of each channel into one timeline.
+
+    Results are ordered by the start time of their first word. A result
+    without words keeps its place after the previous result of its channel.
+
+    Args:
+        channel_results: Results of each channel in time order.
+
+    Returns:
+        List of (channel index, result) pairs.
+    """
+
+    def timed(channel, results):
+        start_time = 0.0
+        for result in results:
+            result_start = result_start_seconds(result)
+            if result_start is not None:
+                start_time = result_start
+            yield start_time, channel, result
+
+    merged = heapq.merge(*(timed(channel, results)
+                           for channel, results in enumerate(channel_results)),
+                         key=lambda timed_result: timed_result[:2])
+    return [(channel, result) for _, channel, result in merged]
+
+
+def result_to_dict(result):
+    """Convert google/saojung recognition result to a JSON serializable dict."""
+    record = {}
+    if hasattr(result, 'is_final'):
+        record['is_final'] = result.is_final
+    if not result.alternatives:
+        return record
+
+    alternative = result.alternatives[0]
+    record['transcript'] = alternative.transcript
+    record['confidence'] = alternative.confidence
+    if alternative.words:
+        record['words'] = [{
+            'word': word.word,
+            'start_time': time_to_second(word.start_time),
+            'end_time': time_to_second(word.end_time),
+        } for word in alternative.words]
+    return record
+
+
+def format_recognition_result(result, channel=None):
+    """Format google/saojung recognition result as printed lines.
+
+    The transcript is followed by a line per word when word time offsets are
+    enabled.
+
+    Args:
+        result: Recognition result.
+        channel: If given, index of the audio channel the result is tagged
+            with.
+
+    Returns:
+        Lines ending with a newline, or an empty string if the result has no
+        alternatives.
+    """
     if not result.alternatives:
-        return
+        return ''
 
+    tag = f'[channel {channel}] ' if channel is not None else ''
     alternative = result.alternatives[0]
     if not alternative.words:
-        print(alternative.transcript, file=file, flush=True)
+        return f'{tag}{alternative.transcript}\n'
+
+    start_time = time_to_second(alternative.words[0].start_time)
+    if hasattr(result, 'result_end_time'):
+        end_time = time_to_second(result.result_end_time)
     else:
-        start_time = time_to_second(alternative.words[0].start_time)
-        if hasattr(result, 'result_end_time'):
-            end_time = time_to_second(result.result_end_time)
-        else:
-            end_time = time_to_second(alternative.words[-1].end_time)
-        print(
-            f'[{start_time:.2f} ~ {end_time:.2f}] '
-            f'{alternative.transcript}',
-            file=file,
-            flush=True)
+        end_time = time_to_second(alternative.words[-1].end_time)
+    lines = [
+        f'{tag}[{start_time:.2f} ~ {end_time:.2f}] {alternative.transcript}\n'
+    ]
+    for word in alternative.words:
+        lines.append(f'- [{time_to_second(word.start_time):.2f} ~ '
+                     f'{time_to_second(word.end_time):.2f}] {word.word}\n')
+    return ''.join(lines)
 
-        for word in alternative.words:
-            start_time = time_to_second(word.start_time)
-            end_time = time_to_second(word.end_time)
-            print(
-                f'- [{start_time:.2f} ~ {end_time:.2f}] {word.word}',
-                file=file,
-                flush=True)
+
+def print_recognition_result(result, file=sys.stdout, channel=None):
+    """Print google/saojung recognition result.
+
+    The lines of the result are written at once, with a single flush.
+
+    Args:
+        result: Recognition result.
+        file: Text output.
+        channel: If given, index of the audio channel the result is tagged
+            with.
+    """
+    text = format_recognition_result(result, channel)
+    if text:
+        file.write(text)
+        file.flush()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Dependencies:
+    - python 3.8
+
+Before executing this script, you should compile protobuf files:
+    $ cd proto
+    $ make
+
+Usage:
+    $ python batch_synthesize.py --api_key <AIQ api key> \
+        --manifest <prompts.csv or prompts.jsonl> \
+        --output_dir <prompts/> \
+        --concurrency 32
+
+    Each row of the manifest is synthesized to its own file. A CSV manifest
+    has a header line naming its columns, and a JSONL manifest holds one
+    object per line, with the keys:
+        - `text` or `ssml`: Input to synthesize. (required)
+        - `output_path`: Output audio path, relative to `--output_dir`.
+          (required)
+        - `voice`: Voice name. Defaults to `--voice`.
+        - `language_code`: Defaults to `--language_code`.
+        - `encoding`: AudioEncoding name. Defaults to `--audio_encoding`.
+        - `speaking_rate`, `pitch`, `volume_gain_db`: AudioConfig values.
+
+    $ cat prompts.csv
+    text,voice,encoding,output_path
+    안녕하세요. 무엇을 도와드릴까요?,KO_KR_WOMAN_2,LINEAR16,greeting.wav
+    잠시만 기다려 주세요.,KO_KR_WOMAN_2,MULAW,hold.wav
+
+    All rows share a pool of `--num_channels` aio channels and at most
+    `--concurrency` SynthesizeSpeech calls are in flight at any time. Files
+    are written on the default executor, off the event loop. A JSON line is
+    written per row as soon as it finishes, and a throughput summary is
+    printed to stderr at the end.
+"""
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+from typing import Dict, List
+
+from absl import flags
+import grpc
+
+from google.cloud.texttospeech.v1 import cloud_tts_pb2
+from google.cloud.texttospeech.v1 import cloud_tts_pb2_grpc
+import grpc_utils
+import metrics_utils
+import playback_utils
+
+AUDIO_ENCODINGS = list(cloud_tts_pb2.AudioEncoding.keys())
+
+flags.DEFINE_string('api_url', 'aiq.skelterlabs.com:443', 'AIQ portal address.')
+flags.DEFINE_string('api_key', None, 'AIQ project api key.')
+flags.DEFINE_boolean('insecure', None, 'Use plaintext and insecure connection.')
+flags.DEFINE_string('manifest', None,
+                    'CSV or JSONL manifest of the prompts to synthesize.')
+flags.DEFINE_string('output_dir', '.',
+                    'Directory of the relative output paths of the manifest.')
+flags.DEFINE_string('report_path', '-',
+                    'Output JSONL path of the rows. Defaults to "-" (stdout).')
+flags.DEFINE_string('voice', 'KO_KR_WOMAN_2', 'Default voice name.')
+flags.DEFINE_string('language_code', 'ko-KR', 'Default language code.')
+flags.DEFINE_enum('audio_encoding', 'LINEAR16', AUDIO_ENCODINGS,
+                  'Default audio encoding.')
+flags.DEFINE_boolean('skip_existing', False,
+                     'Skip the rows whose output file exists.')
+flags.DEFINE_integer('concurrency', 16,
+                     'Maximum number of in-flight SynthesizeSpeech calls.')
+flags.DEFINE_integer(
+    'num_channels', 1, 'Number of pooled aio channels, each on its own '
+    'connection, to spread the calls over.')
+flags.DEFINE_integer(
+    'hedging_delay_ms', 0, 'Send another request if no response arrived '
+    'within this delay. Zero disables hedging.')
+flags.DEFINE_integer(
+    'metrics_port', None, 'Serve client metrics to Prometheus at '
+    'http://localhost:<port>/metrics while running.')
+flags.DEFINE_string('metrics_path', None,
+                    'Append a JSON snapshot of client metrics to this file.')
+FLAGS = flags.FLAGS
+
+AUDIO_CONFIG_KEYS = ('speaking_rate', 'pitch', 'volume_gain_db')
+
+
+def read_manifest(manifest_path: str) -> List[Dict[str, str]]:
+    """Read the rows of a CSV or JSONL manifest.
+
+    Args:
+        manifest_path: Manifest file path. Files ending with '.jsonl' or
+            '.json' are read as JSON lines, others as CSV.
+
+    Returns:
+        List of rows.
+    """
+    with open(manifest_path, 'r', encoding='utf-8', newline='') as manifest:
+        if manifest_path.endswith(('.jsonl', '.json')):
+            return [json.loads(line) for line in manifest if line.strip()]
+        return list(csv.DictReader(manifest))
+
+
+def make_request(row: Dict[str, str]) -> cloud_tts_pb2.SynthesizeSpeechRequest:
+    """Create SynthesizeSpeechRequest of a manifest row.
+
+    Args:
+        row: Manifest row.
+
+    Returns:
+        SynthesizeSpeechRequest object.
+
+    Raises:
+        ValueError: The row has neither text nor SSML.
+    """
+    if row.get('ssml'):
+        synthesis_input = cloud_tts_pb2.SynthesisInput(ssml=row['ssml'])
+    elif row.get('text'):
+        synthesis_input = cloud_tts_pb2.SynthesisInput(text=row['text'])
+    else:
+        raise ValueError('Neither text nor ssml is given')
+    voice = cloud_tts_pb2.VoiceSelectionParams(
+        language_code=row.get('language_code') or FLAGS.language_code,
+        name=row.get('voice') or FLAGS.voice)
+    audio_config = cloud_tts_pb2.AudioConfig(
+        audio_encoding=row.get('encoding') or FLAGS.audio_encoding,
+        **{
+            key: float(row[key]) for key in AUDIO_CONFIG_KEYS if row.get(key)
+        })
+    return cloud_tts_pb2.SynthesizeSpeechRequest(input=synthesis_input,
+                                                 voice=voice,
+                                                 audio_config=audio_config)
+
+
+def write_audio(output_path: str, audio: bytes):
+    """Write audio atomically, creating the directory if needed."""
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    temp_path = output_path + '.tmp'
+    with open(temp_path, 'wb') as output_file:
+        output_file.write(audio)
+    os.replace(temp_path, output_path)
+
+
+def audio_seconds(audio: bytes) -> float:
+    """Return the duration of WAV audio, or zero for other containers."""
+    parsed = (playback_utils.parse_wav_header(audio)
+              if audio.startswith(b'RIFF') else None)
+    if parsed is None or parsed[0] is None:
+        return 0.0
+    wav_format, header_size = parsed
+    return (len(audio) - header_size) / (wav_format.sample_rate *
+                                         wav_format.bits_per_sample // 8)
+
+
+async def synthesize_row(get_channel, index, row, semaphore):
+    """Synthesize one manifest row once a slot of the window is free.
+
+    Args:
+        get_channel: Callable returning the aio channel to use.
+        index: Index of the row in the manifest.
+        row: Manifest row.
+        semaphore: Semaphore bounding the number of in-flight calls.
+
+    Returns:
+        Dict of the row record to be written as a JSON line.
+    """
+    record = {'row': index, 'output_path': row.get('output_path')}
+    try:
+        if not row.get('output_path'):
+            raise ValueError('output_path is not given')
+        output_path = os.path.join(FLAGS.output_dir, row['output_path'])
+        if FLAGS.skip_existing and os.path.exists(output_path):
+            record['skipped'] = True
+            return record
+        request = make_request(row)
+        async with semaphore:
+            start_time = time.perf_counter()
+            stub = cloud_tts_pb2_grpc.TextToSpeechStub(get_channel())
+            if FLAGS.hedging_delay_ms > 0:
+                response = await grpc_utils.hedged_call_async(
+                    stub.SynthesizeSpeech, request,
+                    FLAGS.hedging_delay_ms / 1000)
+            else:
+                response = await stub.SynthesizeSpeech(request)
+            record['latency'] = time.perf_counter() - start_time
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, write_audio, output_path,
+                                   response.audio_content)
+    except grpc.RpcError as e:
+        record['error'] = f'{e.code().name}: {e.details()}'
+        return record
+    except Exception as e:  # pylint: disable=broad-except
+        record['error'] = f'{type(e).__name__}: {e}'
+        return record
+
+    record['bytes'] = len(response.audio_content)
+    record['audio_seconds'] = audio_seconds(response.audio_content)
+    return record
+
+
+async def main():
+    rows = read_manifest(FLAGS.manifest)
+
+    metrics = metrics_utils.Metrics()
+    interceptors = metrics_utils.metrics_interceptors(metrics, is_aio=True)
+    metrics_server = exporter = None
+    if FLAGS.metrics_port:
+        metrics_server = metrics_utils.serve_prometheus(metrics,
+                                                        FLAGS.metrics_port)
+    if FLAGS.metrics_path:
+        exporter = metrics_utils.JsonLinesExporter(metrics, FLAGS.metrics_path)
+
+    def get_channel():
+        return grpc_utils.get_aio_channel(FLAGS.api_url,
+                                          api_key=FLAGS.api_key,
+                                          insecure=FLAGS.insecure,
+                                          interceptors=interceptors,
+                                          num_channels=FLAGS.num_channels)
+
+    semaphore = asyncio.Semaphore(FLAGS.concurrency)
+    tasks = [
+        synthesize_row(get_channel, index, row, semaphore)
+        for index, row in enumerate(rows)
+    ]
+
+    num_failed = 0
+    num_skipped = 0
+    total_bytes = 0
+    total_seconds = 0.0
+    latencies = []
+    start_time = time.perf_counter()
+    report_file = (sys.stdout if FLAGS.report_path == '-' else open(
+        FLAGS.report_path, 'w', encoding='utf-8'))
+    try:
+        for future in asyncio.as_completed(tasks):
+            record = await future
+            if 'error' in record:
+                num_failed += 1
+            elif record.get('skipped'):
+                num_skipped += 1
+            else:
+                total_bytes += record['bytes']
+                total_seconds += record['audio_seconds']
+                latencies.append(record['latency'])
+            report_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            report_file.flush()
+    finally:
+        if report_file is not sys.stdout:
+            report_file.close()
+        await grpc_utils.close_aio_channels()
+        if exporter is not None:
+            exporter.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+    elapsed = time.perf_counter() - start_time
+
+    latencies.sort()
+    print(
+        f'Rows: {len(rows)} (failed: {num_failed}, skipped: {num_skipped})',
+        file=sys.stderr)
+    print(f'Elapsed: {elapsed:.2f}s', file=sys.stderr)
+    if latencies:
+        print(
+            f'Throughput: {len(latencies) / elapsed:.2f} rows/s, '
+            f'{total_bytes / elapsed / 2**20:.2f} MiB/s, '
+            f'{total_seconds / elapsed:.2f} audio seconds/s',
+            file=sys.stderr)
+        print(
+            f'Latency: mean {sum(latencies) / len(latencies):.3f}s, '
+            f'p50 {latencies[len(latencies) // 2]:.3f}s, '
+            f'max {latencies[-1]:.3f}s',
+            file=sys.stderr)
+
+
+if __name__ == '__main__':
+    flags.mark_flags_as_required(['manifest'])
+    FLAGS(sys.argv)
+    asyncio.run(main())
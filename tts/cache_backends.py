@@ -0,0 +1 @@
+../utils/cache_backends.py
\ No newline at end of file
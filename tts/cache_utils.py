@@ -0,0 +1,224 @@
+"""Content-addressed cache of synthesized speech.
+
+Responses are keyed by a hash of the method and the request, which holds the
+input text or SSML, the voice and the audio config. Entries are kept in a
+memory LRU of bounded size, and optionally in a directory of bounded size
+shared by processes, evicting the least recently used files. The responses of
+streaming calls are replayed chunk by chunk.
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+import struct
+import threading
+from typing import Callable, Dict, Iterator, List, Optional
+
+from google.cloud.texttospeech.v1 import cloud_tts_pb2
+import cache_backends
+
+_FRAME_SIZE = struct.Struct('<I')
+
+
+def request_key(method: str,
+                request: cloud_tts_pb2.SynthesizeSpeechRequest) -> str:
+    """Return the cache key of `request` to `method`."""
+    digest = hashlib.sha256(method.encode())
+    digest.update(b'\0')
+    digest.update(request.SerializeToString(deterministic=True))
+    return digest.hexdigest()
+
+
+def _pack(responses):
+    return b''.join(
+        _FRAME_SIZE.pack(len(response)) + response for response in responses)
+
+
+def _unpack(entry):
+    responses = []
+    offset = 0
+    while offset < len(entry):
+        (size,) = _FRAME_SIZE.unpack_from(entry, offset)
+        offset += _FRAME_SIZE.size
+        responses.append(entry[offset:offset + size])
+        offset += size
+    return responses
+
+
+class TtsCache:
+    """Cache of SynthesizeSpeech and StreamingSynthesizeSpeech responses.
+
+    Lookups go to the memory tier first and then to the disk tier, whose hits
+    are promoted to memory. Hits, misses and the bytes served and stored are
+    counted by method, and also recorded to `metrics` if it is given.
+    """
+
+    def __init__(self,
+                 memory_bytes: int = 64 * 2**20,
+                 directory: Optional[str] = None,
+                 disk_bytes: int = 2**30,
+                 metrics=None):
+        """Create a cache.
+
+        Args:
+            memory_bytes: Maximum size of the memory tier.
+            directory: Directory of the disk tier. None disables it.
+            disk_bytes: Maximum size of the disk tier.
+            metrics: `metrics_utils.Metrics` to record to.
+        """
+        self.memory = cache_backends.MemoryBackend(memory_bytes)
+        self.disk = (cache_backends.DiskBackend(
+            directory, disk_bytes, suffix='.tts') if directory else None)
+        self._metrics = metrics
+        self._lock = threading.Lock()
+        self._counts = collections.Counter()
+        # Futures of the uncached unary calls in flight by key.
+        self._pending = {}
+
+    def _count(self, method, name, value=1):
+        with self._lock:
+            self._counts[(method, name)] += value
+        if self._metrics is not None:
+            if name.endswith('bytes'):
+                self._metrics.add('aiq_client_cache_bytes_total',
+                                  (('method', method),
+                                   ('direction', name[:-len('_bytes')])),
+                                  value)
+            else:
+                # memory_hit, disk_hit, coalesced or miss.
+                self._metrics.add('aiq_client_cache_requests_total',
+                                  (('method', method), ('result', name)),
+                                  value)
+
+    def get(self, method: str, key: str) -> Optional[List[bytes]]:
+        """Return the serialized responses cached under `key`, if any."""
+        entry = self.memory.get(key)
+        if entry is not None:
+            self._count(method, 'memory_hit')
+        elif self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                self._count(method, 'disk_hit')
+                self.memory.put(key, entry)
+        if entry is None:
+            self._count(method, 'miss')
+            return None
+        self._count(method, 'served_bytes', len(entry))
+        return _unpack(entry)
+
+    def put(self, method: str, key: str, responses: List[bytes]):
+        """Cache the serialized responses of a call under `key`."""
+        entry = _pack(responses)
+        self._count(method, 'stored_bytes', len(entry))
+        self.memory.put(key, entry)
+        if self.disk is not None:
+            self.disk.put(key, entry)
+
+    def stats(self) -> Dict:
+        """Return the counts by method and the sizes of the tiers."""
+        with self._lock:
+            counts = collections.defaultdict(dict)
+            for (method, name), value in self._counts.items():
+                counts[method][name] = value
+        stats = {
+            'methods': dict(counts),
+            'memory_entries': len(self.memory),
+            'memory_bytes': self.memory.size,
+            'memory_evictions': self.memory.evictions,
+        }
+        if self.disk is not None:
+            stats.update(disk_entries=len(self.disk),
+                         disk_bytes=self.disk.size,
+                         disk_evictions=self.disk.evictions)
+        return stats
+
+    def cached_unary(
+        self,
+        synthesize: Callable[[cloud_tts_pb2.SynthesizeSpeechRequest],
+                             cloud_tts_pb2.SynthesizeSpeechResponse],
+        method: str = 'SynthesizeSpeech',
+    ) -> Callable[[cloud_tts_pb2.SynthesizeSpeechRequest],
+                  cloud_tts_pb2.SynthesizeSpeechResponse]:
+        """Wrap a function making SynthesizeSpeech calls with the cache.
+
+        Concurrent calls with the same request wait for the first one instead
+        of calling the API again.
+
+        Args:
+            synthesize: Function making the call, e.g. `stub.SynthesizeSpeech`.
+            method: Name of the method the entries are stored for.
+
+        Returns:
+            Function taking a request and returning its response.
+        """
+
+        def cached(request):
+            key = request_key(method, request)
+            with self._lock:
+                pending = self._pending.get(key)
+                first = pending is None
+                if first:
+                    pending = concurrent.futures.Future()
+                    self._pending[key] = pending
+            if not first:
+                self._count(method, 'coalesced')
+                response = cloud_tts_pb2.SynthesizeSpeechResponse()
+                response.CopyFrom(pending.result())
+                return response
+
+            try:
+                responses = self.get(method, key)
+                if responses is not None:
+                    response = (cloud_tts_pb2.SynthesizeSpeechResponse.
+                                FromString(responses[0]))
+                else:
+                    response = synthesize(request)
+                    self.put(method, key, [response.SerializeToString()])
+            except BaseException as e:
+                pending.set_exception(e)
+                raise
+            finally:
+                with self._lock:
+                    del self._pending[key]
+            pending.set_result(response)
+            return response
+
+        return cached
+
+    def cached_streaming(
+        self,
+        synthesize: Callable[[cloud_tts_pb2.SynthesizeSpeechRequest],
+                             Iterator[cloud_tts_pb2.SynthesizeSpeechResponse]],
+        method: str = 'StreamingSynthesizeSpeech',
+    ) -> Callable[[cloud_tts_pb2.SynthesizeSpeechRequest],
+                  Iterator[cloud_tts_pb2.SynthesizeSpeechResponse]]:
+        """Wrap a function making StreamingSynthesizeSpeech calls.
+
+        Cached streams are replayed with the chunks of the original call. A
+        stream is cached once it has been read to its end.
+
+        Args:
+            synthesize: Function making the call, e.g.
+                `stub.StreamingSynthesizeSpeech`.
+            method: Name of the method the entries are stored for.
+
+        Returns:
+            Function taking a request and returning its responses.
+        """
+
+        def cached(request):
+            key = request_key(method, request)
+            responses = self.get(method, key)
+            if responses is not None:
+                return (cloud_tts_pb2.SynthesizeSpeechResponse.FromString(
+                    response) for response in responses)
+            return self._record(method, key, synthesize(request))
+
+        return cached
+
+    def _record(self, method, key, responses):
+        serialized = []
+        for response in responses:
+            serialized.append(response.SerializeToString())
+            yield response
+        self.put(method, key, serialized)
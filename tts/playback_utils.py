@@ -0,0 +1,450 @@
+"""Low latency playback and relay of streamed AIQ.TTS audio.
+
+`relay` receives the chunks of a StreamingSynthesizeSpeech call on a thread
+of its own and forwards them, through a `JitterBuffer`, to sinks such as an
+audio player, a socket or stdout as soon as they arrive. PCM audio is framed
+with a WAV header which is kept up to date while the audio is written, so that
+partial outputs are playable.
+"""
+
+import collections
+import shlex
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from typing import BinaryIO, Dict, Iterable, Optional, Sequence
+
+from google.cloud.texttospeech.v1 import cloud_tts_pb2
+
+# Format tag, bits per sample and sample rate of an audio stream.
+WavFormat = collections.namedtuple('WavFormat',
+                                   ('format_tag', 'bits_per_sample',
+                                    'sample_rate'))
+
+WAV_PCM = 1
+WAV_ALAW = 6
+WAV_MULAW = 7
+
+# Format of the encodings streamed without a WAV header.
+_HEADERLESS_FORMATS = {
+    cloud_tts_pb2.AudioEncoding.LINEAR16_PCM: (WAV_PCM, 16),
+    cloud_tts_pb2.AudioEncoding.MULAW_PCM: (WAV_MULAW, 8),
+    cloud_tts_pb2.AudioEncoding.ALAW_PCM: (WAV_ALAW, 8),
+}
+
+# Sample rate of headerless audio when the request does not set it.
+DEFAULT_SAMPLE_RATE = 16000
+
+# Data size of a WAV header whose length is unknown, e.g. on a pipe.
+_UNKNOWN_DATA_SIZE = 0xFFFFFFFF - 36
+
+
+def wav_header(wav_format: WavFormat, data_size: int) -> bytes:
+    """Return the 44 bytes header of mono WAV audio."""
+    block_align = wav_format.bits_per_sample // 8
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_size, b'WAVE',
+                       b'fmt ', 16, wav_format.format_tag, 1,
+                       wav_format.sample_rate,
+                       wav_format.sample_rate * block_align, block_align,
+                       wav_format.bits_per_sample, b'data', data_size)
+
+
+def parse_wav_header(data: bytes):
+    """Parse the WAV header at the start of `data`.
+
+    Args:
+        data: Audio starting with a WAV header.
+
+    Returns:
+        Tuple of the WavFormat and the size of the header, or None if `data`
+        does not hold the whole header yet.
+    """
+    offset = 12
+    wav_format = None
+    while offset + 8 <= len(data):
+        chunk_id, chunk_size = struct.unpack_from('<4sI', data, offset)
+        if chunk_id == b'data':
+            return wav_format, offset + 8
+        if chunk_id == b'fmt ':
+            if offset + 24 > len(data):
+                return None
+            format_tag, _, sample_rate, _, _, bits_per_sample = (
+                struct.unpack_from('<HHIIHH', data, offset + 8))
+            wav_format = WavFormat(format_tag, bits_per_sample, sample_rate)
+        offset += 8 + chunk_size + chunk_size % 2
+    return None
+
+
+class WavWriter:
+    """Write audio to `output` with a WAV header counting the audio so far.
+
+    The header of a seekable output is rewritten after every chunk. Outputs
+    such as pipes and sockets get a header with an unknown length instead,
+    which players read until the end of the stream.
+    """
+
+    def __init__(self, output: BinaryIO, wav_format: WavFormat):
+        self._output = output
+        self._seekable = _seekable(output)
+        self._data_size = 0
+        output.write(
+            wav_header(wav_format,
+                       0 if self._seekable else _UNKNOWN_DATA_SIZE))
+
+    def write(self, data: bytes):
+        self._output.write(data)
+        self._data_size += len(data)
+        if self._seekable:
+            self._output.seek(4)
+            self._output.write(struct.pack('<I', 36 + self._data_size))
+            self._output.seek(40)
+            self._output.write(struct.pack('<I', self._data_size))
+            self._output.seek(0, 2)
+
+    def flush(self):
+        self._output.flush()
+
+    def close(self):
+        self._output.close()
+
+
+def _seekable(output):
+    try:
+        return output.seekable()
+    except (AttributeError, ValueError):
+        return False
+
+
+class _StdoutSink:
+    """Binary stdout, left open when the sink is closed."""
+
+    def __init__(self):
+        self._output = sys.stdout.buffer
+
+    def write(self, data):
+        self._output.write(data)
+
+    def flush(self):
+        self._output.flush()
+
+    @staticmethod
+    def seekable():
+        return False
+
+    def close(self):
+        self._output.flush()
+
+
+class _SocketSink:
+    """TCP connection to which every chunk is sent in full."""
+
+    def __init__(self, host, port):
+        self._socket = socket.create_connection((host, port))
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def write(self, data):
+        self._socket.sendall(data)
+
+    def flush(self):
+        pass
+
+    @staticmethod
+    def seekable():
+        return False
+
+    def close(self):
+        self._socket.close()
+
+
+class _PlayerSink:
+    """Audio player process reading the audio from its stdin."""
+
+    def __init__(self, command):
+        self._process = subprocess.Popen(shlex.split(command),
+                                         stdin=subprocess.PIPE)
+
+    def write(self, data):
+        self._process.stdin.write(data)
+
+    def flush(self):
+        self._process.stdin.flush()
+
+    @staticmethod
+    def seekable():
+        return False
+
+    def close(self):
+        # Wait until the player has played the audio out.
+        self._process.stdin.close()
+        self._process.wait()
+
+
+def open_sink(target: str) -> BinaryIO:
+    """Open a sink to which the audio is written as it arrives.
+
+    Args:
+        target: '-' for stdout, 'tcp://<host>:<port>' to send the audio on a
+            TCP connection, or the path of a file.
+
+    Returns:
+        File-like object with `write`, `flush` and `close`.
+    """
+    if target == '-':
+        return _StdoutSink()
+    if target.startswith('tcp://'):
+        host, _, port = target[len('tcp://'):].rpartition(':')
+        return _SocketSink(host.strip('[]'), int(port))
+    return open(target, mode='wb')
+
+
+def open_player(command: str) -> BinaryIO:
+    """Start an audio player reading from stdin, e.g. 'aplay -q'.
+
+    Args:
+        command: Command line of the player.
+
+    Returns:
+        File-like object writing to the player. Closing it waits for the
+        player to finish.
+    """
+    return _PlayerSink(command)
+
+
+class JitterBuffer:
+    """Chunks received from the server, waiting to be written to the sinks.
+
+    Writing starts once `prebuffer_bytes` are buffered or the stream ended, so
+    that a listener is not starved by the gaps between the first chunks. The
+    receiving thread is never blocked by a slow sink, and the sinks never wait
+    for more than the next chunk.
+    """
+
+    def __init__(self, prebuffer_bytes: int = 0):
+        self.prebuffer_bytes = prebuffer_bytes
+        self._chunks = collections.deque()
+        self._size = 0
+        self._started = False
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def put(self, chunk: bytes):
+        with self._condition:
+            self._chunks.append(chunk)
+            self._size += len(chunk)
+            self._condition.notify()
+
+    def close(self):
+        """Mark the end of the stream."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def _ready(self):
+        if self._closed:
+            return True
+        if not self._started:
+            self._started = (bool(self._chunks) and
+                             self._size >= self.prebuffer_bytes)
+        return self._started and bool(self._chunks)
+
+    def get(self) -> Optional[bytes]:
+        """Return the next chunk, or None at the end of the stream."""
+        with self._condition:
+            self._condition.wait_for(self._ready)
+            if not self._chunks:
+                return None
+            chunk = self._chunks.popleft()
+            self._size -= len(chunk)
+            return chunk
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class StreamStats:
+    """Arrival and playout timings of a synthesized audio stream.
+
+    A listener is assumed to play the written audio in real time from the
+    first write. Whenever the audio written so far ran out before the next
+    chunk was written, the listener heard a gap, which is counted as an
+    underrun.
+    """
+
+    def __init__(self, start_time: Optional[float] = None):
+        self.start_time = (time.perf_counter()
+                           if start_time is None else start_time)
+        self.arrival_times = []
+        self.received_bytes = 0
+        self.first_write_time = None
+        self.written_seconds = 0.0
+        self.underruns = 0
+        self.stall_seconds = 0.0
+        self._playout_start = None
+
+    def received(self, size: int):
+        self.arrival_times.append(time.perf_counter())
+        self.received_bytes += size
+
+    def wrote(self, seconds: float):
+        now = time.perf_counter()
+        if self._playout_start is None:
+            self.first_write_time = self._playout_start = now
+        else:
+            stall = now - self._playout_start - self.written_seconds
+            if stall > 0:
+                self.underruns += 1
+                self.stall_seconds += stall
+                # Playout resumes with this chunk.
+                self._playout_start += stall
+        self.written_seconds += seconds
+
+    def to_dict(self) -> Dict:
+        """Return the timings in seconds."""
+        gaps = [
+            later - earlier for earlier, later in zip(self.arrival_times,
+                                                      self.arrival_times[1:])
+        ]
+        first_chunk = (self.arrival_times[0] -
+                       self.start_time if self.arrival_times else None)
+        first_write = (self.first_write_time - self.start_time
+                       if self.first_write_time is not None else None)
+        return {
+            'time_to_first_chunk': first_chunk,
+            'time_to_first_write': first_write,
+            'chunks': len(self.arrival_times),
+            'received_bytes': self.received_bytes,
+            'audio_seconds': self.written_seconds,
+            'gap_p50': _percentile(gaps, 0.5),
+            'gap_p95': _percentile(gaps, 0.95),
+            'gap_max': max(gaps, default=0.0),
+            'underruns': self.underruns,
+            'stall_seconds': self.stall_seconds,
+        }
+
+
+def _bytes_per_second(wav_format):
+    return wav_format.sample_rate * wav_format.bits_per_sample // 8
+
+
+class _Deframer:
+    """Strip the WAV header from the start of a stream and find its format."""
+
+    def __init__(self, audio_encoding, sample_rate_hertz):
+        self.wav_format = None
+        self._pending = b''
+        headerless = _HEADERLESS_FORMATS.get(audio_encoding)
+        if headerless is not None:
+            self.wav_format = WavFormat(*headerless, sample_rate_hertz or
+                                        DEFAULT_SAMPLE_RATE)
+        self._done = headerless is not None
+
+    def feed(self, chunk):
+        if self._done:
+            return chunk
+        self._pending += chunk
+        if not self._pending.startswith(b'RIFF'[:len(self._pending)]):
+            # Compressed audio is relayed as it is.
+            self._done = True
+            return self._pending
+        parsed = parse_wav_header(self._pending)
+        if parsed is None:
+            return b''
+        self.wav_format, header_size = parsed
+        self._done = True
+        return self._pending[header_size:]
+
+    def flush(self):
+        return b'' if self._done else self._pending
+
+
+def relay(responses: Iterable[cloud_tts_pb2.SynthesizeSpeechResponse],
+          sinks: Sequence[BinaryIO],
+          audio_encoding: int,
+          sample_rate_hertz: Optional[int] = None,
+          prebuffer_ms: int = 100,
+          wav: bool = True,
+          stats: Optional[StreamStats] = None) -> StreamStats:
+    """Forward streamed audio to `sinks` as it arrives.
+
+    The responses are received on another thread, so that a sink played in
+    real time never throttles the call. PCM audio is written with a WAV header
+    if `wav` is True, or as headerless samples otherwise. Other encodings are
+    written as they are. The sinks are closed at the end.
+
+    Args:
+        responses: Responses of a StreamingSynthesizeSpeech call.
+        sinks: Outputs from `open_sink` or `open_player`.
+        audio_encoding: AudioEncoding of the request.
+        sample_rate_hertz: Sample rate of the request, if it sets one.
+        prebuffer_ms: Duration of PCM audio buffered before the first write.
+        wav: A flag indicating if PCM audio is written as WAV.
+        stats: StreamStats to record to, started before the call.
+
+    Returns:
+        StreamStats of the stream.
+
+    Raises:
+        grpc.RpcError: The call failed. The audio received until then has
+            been written.
+    """
+    stats = stats or StreamStats()
+    deframer = _Deframer(audio_encoding, sample_rate_hertz)
+    buffer = JitterBuffer()
+    errors = []
+
+    def put(chunk):
+        if chunk:
+            if deframer.wav_format is not None and not buffer.prebuffer_bytes:
+                buffer.prebuffer_bytes = (_bytes_per_second(
+                    deframer.wav_format) * prebuffer_ms // 1000)
+            buffer.put(chunk)
+
+    def receive():
+        try:
+            for response in responses:
+                stats.received(len(response.audio_content))
+                put(deframer.feed(response.audio_content))
+            put(deframer.flush())
+        except Exception as e:  # pylint: disable=broad-except
+            errors.append(e)
+        finally:
+            buffer.close()
+
+    receiver = threading.Thread(target=receive, daemon=True)
+    receiver.start()
+    outputs = None
+    bytes_per_second = 0
+    try:
+        while True:
+            chunk = buffer.get()
+            if chunk is None:
+                break
+            if outputs is None:
+                # The format is known once the first chunk arrived.
+                outputs = sinks
+                if deframer.wav_format is not None:
+                    bytes_per_second = _bytes_per_second(deframer.wav_format)
+                    if wav:
+                        outputs = [
+                            WavWriter(sink, deframer.wav_format)
+                            for sink in sinks
+                        ]
+            for output in outputs:
+                output.write(chunk)
+                output.flush()
+            stats.wrote(len(chunk) /
+                        bytes_per_second if bytes_per_second else 0.0)
+    finally:
+        for output in outputs or sinks:
+            output.close()
+    receiver.join()
+    if errors:
+        raise errors[0]
+    return stats
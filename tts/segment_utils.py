@@ -0,0 +1,206 @@
+"""Concurrent synthesis of long texts split into segments.
+
+A long text or SSML document is split at sentence ends and SSML `<break>`
+tags, the segments are synthesized concurrently, and their audio is written in
+order as one stream as soon as each segment is ready.
+"""
+
+import concurrent.futures
+import re
+from typing import BinaryIO, Callable, Iterable, Iterator, List
+
+from google.cloud.texttospeech.v1 import cloud_tts_pb2
+import playback_utils
+
+# Boundaries after sentence ending punctuation, and line breaks.
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.?!…。？！])\s+|\s*\n\s*')
+
+_SPEAK = re.compile(r'\s*(<\?xml[^>]*\?>\s*)?(<speak\b[^>]*>)(.*)</speak>\s*$',
+                    re.DOTALL)
+_SSML_TOKEN = re.compile(r'<!--.*?-->|<[^>]*>|[^<]+', re.DOTALL)
+_TAG_NAME = re.compile(r'</?\s*([\w:-]+)')
+
+
+def _pack(units, max_chars, length=len):
+    """Merge consecutive units into segments of up to `max_chars`."""
+    segments = []
+    current = []
+    current_length = 0
+    for unit in units:
+        unit_length = length(unit)
+        if current and current_length + unit_length > max_chars:
+            segments.append(current)
+            current = []
+            current_length = 0
+        current.append(unit)
+        current_length += unit_length
+    if current:
+        segments.append(current)
+    return segments
+
+
+def split_text(text: str, max_chars: int = 100) -> List[str]:
+    """Split `text` at sentence ends into segments of up to `max_chars`.
+
+    Consecutive sentences are packed into one segment while it fits. A
+    sentence longer than `max_chars` is a segment of its own.
+
+    Args:
+        text: Plain text to synthesize.
+        max_chars: Maximum number of characters of a segment.
+
+    Returns:
+        List of segments.
+    """
+    sentences = [
+        sentence for sentence in _SENTENCE_BOUNDARY.split(text.strip())
+        if sentence
+    ]
+    return [' '.join(segment) for segment in _pack(sentences, max_chars)]
+
+
+def _ssml_units(body):
+    """Split the body of <speak> into fragments ending at boundaries.
+
+    Each fragment closes the elements open at its end, and the next one opens
+    them again, so that every fragment is well-formed by itself.
+    """
+    units = []
+    current = []
+    text_length = 0
+    # Name and start tag of the open elements.
+    open_elements = []
+
+    def cut():
+        nonlocal current, text_length
+        # Tags without text stay with the next fragment.
+        if text_length:
+            closing = ''.join(
+                f'</{name}>' for name, _ in reversed(open_elements))
+            units.append((''.join(current) + closing, text_length))
+            current = [tag for _, tag in open_elements]
+            text_length = 0
+
+    for token in _SSML_TOKEN.findall(body):
+        if token.startswith('<!--'):
+            current.append(token)
+        elif token.startswith('</'):
+            if open_elements:
+                open_elements.pop()
+            current.append(token)
+        elif token.startswith('<'):
+            current.append(token)
+            name = _TAG_NAME.match(token)
+            if token.endswith('/>'):
+                if name and name.group(1) == 'break':
+                    # The pause ends the fragment before it.
+                    cut()
+            elif name:
+                open_elements.append((name.group(1), token))
+        else:
+            for i, sentence in enumerate(_SENTENCE_BOUNDARY.split(token)):
+                if i:
+                    current.append(' ')
+                    cut()
+                current.append(sentence)
+                text_length += len(sentence.strip())
+    cut()
+    return units
+
+
+def split_ssml(ssml: str, max_chars: int = 100) -> List[str]:
+    """Split an SSML document at sentence ends and `<break>` tags.
+
+    Every segment is a <speak> document of its own, in which the elements
+    open at the boundary are closed and opened again, e.g. `<prosody>`. A
+    `<break>` stays at the end of the segment before it.
+
+    Args:
+        ssml: SSML document with a <speak> root.
+        max_chars: Maximum number of text characters of a segment.
+
+    Returns:
+        List of SSML documents. A document which can not be split is returned
+        as it is.
+    """
+    match = _SPEAK.match(ssml)
+    if match is None:
+        return [ssml]
+    prolog, speak, body = match.groups()
+    units = _ssml_units(body)
+    if not units:
+        return [ssml]
+    return [(prolog or '') + speak +
+            ''.join(fragment for fragment, _ in segment) + '</speak>'
+            for segment in _pack(units, max_chars, length=lambda u: u[1])]
+
+
+def synthesize_segments(
+    synthesize: Callable[[cloud_tts_pb2.SynthesizeSpeechRequest],
+                         cloud_tts_pb2.SynthesizeSpeechResponse],
+    requests: Iterable[cloud_tts_pb2.SynthesizeSpeechRequest],
+    max_concurrency: int = 8,
+) -> Iterator[bytes]:
+    """Synthesize `requests` concurrently and yield their audio in order.
+
+    The audio of a segment is yielded as soon as it and all the segments
+    before it are ready.
+
+    Args:
+        synthesize: Function making a SynthesizeSpeech call, e.g.
+            `stub.SynthesizeSpeech`.
+        requests: SynthesizeSpeechRequest of each segment.
+        max_concurrency: Maximum number of calls at once.
+
+    Yields:
+        Audio content of each segment.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_concurrency) as executor:
+        futures = [executor.submit(synthesize, request) for request in requests]
+        try:
+            for future in futures:
+                yield future.result().audio_content
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def _strip_id3(audio):
+    # ID3v2 tag: 'ID3', version, flags and a 28 bits syncsafe size.
+    if len(audio) < 10 or not audio.startswith(b'ID3'):
+        return audio
+    size = 0
+    for byte in audio[6:10]:
+        size = size << 7 | byte & 0x7F
+    return audio[10 + size:]
+
+
+def write_segments(output_file: BinaryIO, audios: Iterable[bytes],
+                   audio_encoding: int):
+    """Write the audio of consecutive segments as one audio stream.
+
+    WAV segments are written under a single header counting all of the
+    samples. Segments of headerless encodings are concatenated, as are MP3
+    segments after their ID3 tags are stripped. OGG_OPUS segments are written
+    as a chained Ogg stream.
+
+    Args:
+        output_file: Binary output.
+        audios: Audio content of each segment.
+        audio_encoding: AudioEncoding of the requests.
+    """
+    writer = None
+    for index, audio in enumerate(audios):
+        parsed = (playback_utils.parse_wav_header(audio)
+                  if audio.startswith(b'RIFF') else None)
+        if parsed is not None and parsed[0] is not None:
+            wav_format, header_size = parsed
+            if writer is None:
+                writer = playback_utils.WavWriter(output_file, wav_format)
+            writer.write(audio[header_size:])
+        elif index and audio_encoding == cloud_tts_pb2.AudioEncoding.MP3:
+            output_file.write(_strip_id3(audio))
+        else:
+            output_file.write(audio)
+        # The segments written so far are playable.
+        output_file.flush()
@@ -16,10 +16,13 @@ Usage:
 
 from absl import app
 from absl import flags
+from absl import logging
 
 from google.cloud.texttospeech.v1 import cloud_tts_pb2
 from google.cloud.texttospeech.v1 import cloud_tts_pb2_grpc
+import cache_utils
 import grpc_utils
+import segment_utils
 
 # List of supported audio encodings.
 # For more detail, see `AudioEncoding` in the following file:
@@ -35,6 +38,19 @@ flags.DEFINE_enum(
     'audio_encoding', 'LINEAR16', AUDIO_ENCODINGS,
     'Output audio format encoding. Defaults to LINEAR16 (wav file).')
 flags.DEFINE_string('output_path', None, 'Output audio path.')
+flags.DEFINE_boolean(
+    'split_sentences', False, 'Split the SSML at sentences and <break> tags, '
+    'and synthesize the segments concurrently.')
+flags.DEFINE_integer(
+    'max_segment_chars', 100, 'Consecutive sentences are synthesized in one '
+    'segment of up to this many characters.')
+flags.DEFINE_integer('max_concurrency', 8,
+                     'Maximum number of segments synthesized at once.')
+flags.DEFINE_string(
+    'cache_dir', None, 'Cache the synthesized speech in this directory, and '
+    'in memory, keyed by the request.')
+flags.DEFINE_integer('cache_disk_mb', 1024,
+                     'Maximum size of the cache directory in MiB.')
 FLAGS = flags.FLAGS
 
 
@@ -48,16 +64,42 @@ def main(args):
     with open(FLAGS.input_path, 'r', encoding='utf-8') as input_file:
         input_content = input_file.read()
 
-    synthesis_input = cloud_tts_pb2.SynthesisInput(ssml=input_content)
     voice = cloud_tts_pb2.VoiceSelectionParams(
         language_code='ko-KR', name='KO_KR_WOMAN_2')
     audio_config = cloud_tts_pb2.AudioConfig(
         audio_encoding=FLAGS.audio_encoding)
-    request = cloud_tts_pb2.SynthesizeSpeechRequest(
-        input=synthesis_input, voice=voice, audio_config=audio_config)
-    response = stub.SynthesizeSpeech(request)
+    synthesize = stub.SynthesizeSpeech
+    cache = None
+    if FLAGS.cache_dir:
+        cache = cache_utils.TtsCache(directory=FLAGS.cache_dir,
+                                     disk_bytes=FLAGS.cache_disk_mb * 2**20)
+        synthesize = cache.cached_unary(synthesize)
+
+    if not FLAGS.split_sentences:
+        synthesis_input = cloud_tts_pb2.SynthesisInput(ssml=input_content)
+        request = cloud_tts_pb2.SynthesizeSpeechRequest(
+            input=synthesis_input, voice=voice, audio_config=audio_config)
+        response = synthesize(request)
+        with open(FLAGS.output_path, mode='wb') as output_file:
+            output_file.write(response.audio_content)
+        if cache is not None:
+            logging.info('Cache: %s', cache.stats())
+        return
+
+    segments = segment_utils.split_ssml(input_content, FLAGS.max_segment_chars)
+    requests = [
+        cloud_tts_pb2.SynthesizeSpeechRequest(
+            input=cloud_tts_pb2.SynthesisInput(ssml=segment),
+            voice=voice,
+            audio_config=audio_config) for segment in segments
+    ]
+    audios = segment_utils.synthesize_segments(synthesize, requests,
+                                               FLAGS.max_concurrency)
     with open(FLAGS.output_path, mode='wb') as output_file:
-        output_file.write(response.audio_content)
+        segment_utils.write_segments(output_file, audios,
+                                     audio_config.audio_encoding)
+    if cache is not None:
+        logging.info('Cache: %s', cache.stats())
 
 
 if __name__ == '__main__':
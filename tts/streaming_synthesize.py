@@ -14,14 +14,37 @@ Usage:
         --api_key <your API key> \
         --text '안녕하세요?' \
         --output_path <test.wav>
+
+    The audio is written as it arrives, so that it can be played before the
+    stream ends. Play it, relay it to a TCP socket or pipe it to stdout:
+
+    $ python streaming_synthesize.py \
+        --api_key <your API key> \
+        --text '안녕하세요?' \
+        --play_command 'aplay -q'
+
+    $ python streaming_synthesize.py \
+        --api_key <your API key> \
+        --text '안녕하세요?' \
+        --output_path tcp://localhost:9000
+
+    $ python streaming_synthesize.py \
+        --api_key <your API key> \
+        --text '안녕하세요?' \
+        --output_path - | ffplay -nodisp -autoexit -
 """
 
+import time
+
 from absl import app
 from absl import flags
+from absl import logging
 
 from google.cloud.texttospeech.v1 import cloud_tts_pb2
 from google.cloud.texttospeech.v1 import cloud_tts_pb2_grpc
+import cache_utils
 import grpc_utils
+import playback_utils
 
 # List of supported audio encodings.
 # For more detail, see `AudioEncoding` in the following file:
@@ -36,7 +59,26 @@ flags.DEFINE_string('text', '안녕하세요. 스켈터랩스입니다.', 'Input
 flags.DEFINE_enum(
     'audio_encoding', 'LINEAR16', AUDIO_ENCODINGS,
     'Output audio format encoding. Defaults to LINEAR16 (wav file).')
-flags.DEFINE_string('output_path', None, 'Output audio path.')
+flags.DEFINE_string(
+    'output_path', None, 'Output audio path, `-` for stdout, or '
+    'tcp://<host>:<port> to relay the audio to a TCP socket.')
+flags.DEFINE_string(
+    'play_command', None, 'Command of an audio player reading the audio from '
+    "stdin, e.g. 'aplay -q' or 'ffplay -nodisp -autoexit -'.")
+flags.DEFINE_integer(
+    'sample_rate_hertz', None, 'Sample rate of the synthesized audio. '
+    'Defaults to the natural sample rate of the voice.')
+flags.DEFINE_integer(
+    'prebuffer_ms', 100, 'Duration of audio buffered before it is played, '
+    'absorbing the jitter of the first chunks.')
+flags.DEFINE_boolean(
+    'wav_header', True, 'Write PCM audio with a WAV header. Otherwise the raw '
+    'samples are written.')
+flags.DEFINE_string(
+    'cache_dir', None, 'Cache the synthesized speech in this directory, and '
+    'in memory, keyed by the request.')
+flags.DEFINE_integer('cache_disk_mb', 1024,
+                     'Maximum size of the cache directory in MiB.')
 FLAGS = flags.FLAGS
 
 
@@ -51,15 +93,49 @@ def main(args):
     voice = cloud_tts_pb2.VoiceSelectionParams(
         language_code='ko-KR', name='KO_KR_WOMAN_2')
     audio_config = cloud_tts_pb2.AudioConfig(
-        audio_encoding=FLAGS.audio_encoding)
+        audio_encoding=FLAGS.audio_encoding,
+        sample_rate_hertz=FLAGS.sample_rate_hertz)
     request = cloud_tts_pb2.SynthesizeSpeechRequest(
         input=synthesis_input, voice=voice, audio_config=audio_config)
-    responses = stub.StreamingSynthesizeSpeech(request)
-    with open(FLAGS.output_path, mode='wb') as output_file:
-        for response in responses:
-            output_file.write(response.audio_content)
+
+    sinks = []
+    if FLAGS.output_path:
+        sinks.append(playback_utils.open_sink(FLAGS.output_path))
+    if FLAGS.play_command:
+        sinks.append(playback_utils.open_player(FLAGS.play_command))
+    synthesize = stub.StreamingSynthesizeSpeech
+    cache = None
+    if FLAGS.cache_dir:
+        cache = cache_utils.TtsCache(directory=FLAGS.cache_dir,
+                                     disk_bytes=FLAGS.cache_disk_mb * 2**20)
+        synthesize = cache.cached_streaming(synthesize)
+
+    stats = playback_utils.StreamStats(time.perf_counter())
+    responses = synthesize(request)
+    playback_utils.relay(responses,
+                         sinks,
+                         audio_config.audio_encoding,
+                         sample_rate_hertz=FLAGS.sample_rate_hertz,
+                         prebuffer_ms=FLAGS.prebuffer_ms,
+                         wav=FLAGS.wav_header,
+                         stats=stats)
+
+    report = stats.to_dict()
+    logging.info(
+        'First chunk after %.0fms, first write after %.0fms, %d chunks, '
+        'gaps p50 %.0fms p95 %.0fms max %.0fms, %d underruns (%.0fms)',
+        1000 * (report['time_to_first_chunk'] or 0),
+        1000 * (report['time_to_first_write'] or 0), report['chunks'],
+        1000 * report['gap_p50'], 1000 * report['gap_p95'],
+        1000 * report['gap_max'], report['underruns'],
+        1000 * report['stall_seconds'])
+    if cache is not None:
+        logging.info('Cache: %s', cache.stats())
 
 
 if __name__ == '__main__':
-    flags.mark_flags_as_required(['output_path'])
+    flags.register_multi_flags_validator(
+        ['output_path', 'play_command'],
+        lambda flags_dict: any(flags_dict.values()),
+        message='--output_path or --play_command must be specified.')
     app.run(main)
@@ -21,14 +21,27 @@ Usage:
         --text '안녕하세요?' \
         --audio_encoding ADPCM \
         --output_path <test.vox>
+
+    Long texts render faster split at sentences into segments synthesized
+    concurrently. `--text` may also be an SSML document, which is split at
+    sentences and `<break>` tags as well.
+
+    $ python synthesize.py \
+        --api_key <your API key> \
+        --text "$(cat announcement.txt)" \
+        --split_sentences \
+        --output_path <test.wav>
 """
 
 from absl import app
 from absl import flags
+from absl import logging
 
 from google.cloud.texttospeech.v1 import cloud_tts_pb2
 from google.cloud.texttospeech.v1 import cloud_tts_pb2_grpc
+import cache_utils
 import grpc_utils
+import segment_utils
 
 # List of supported audio encodings.
 # For more detail, see `AudioEncoding` in the following file:
@@ -39,14 +52,37 @@ AUDIO_ENCODINGS = list(
 flags.DEFINE_string('api_url', 'aiq.skelterlabs.com:443', 'AIQ portal address.')
 flags.DEFINE_string('api_key', None, 'AIQ project api key.')
 flags.DEFINE_boolean('insecure', None, 'Use plaintext and insecure connection.')
-flags.DEFINE_string('text', '안녕하세요. 스켈터랩스입니다.', 'Input text to synthesize.')
+flags.DEFINE_string('text', '안녕하세요. 스켈터랩스입니다.',
+                    'Input text, or SSML starting with <speak>, to synthesize.')
 flags.DEFINE_enum(
     'audio_encoding', 'LINEAR16', AUDIO_ENCODINGS,
     'Output audio format encoding. Defaults to LINEAR16 (wav file).')
 flags.DEFINE_string('output_path', None, 'Output audio path.')
+flags.DEFINE_integer(
+    'hedging_delay_ms', 0, 'Send another request if no response arrived '
+    'within this delay. Zero disables hedging.')
+flags.DEFINE_boolean(
+    'split_sentences', False, 'Split the text at sentences, and SSML also at '
+    '<break> tags, and synthesize the segments concurrently.')
+flags.DEFINE_integer(
+    'max_segment_chars', 100, 'Consecutive sentences are synthesized in one '
+    'segment of up to this many characters.')
+flags.DEFINE_integer('max_concurrency', 8,
+                     'Maximum number of segments synthesized at once.')
+flags.DEFINE_string(
+    'cache_dir', None, 'Cache the synthesized speech in this directory, and '
+    'in memory, keyed by the request.')
+flags.DEFINE_integer('cache_disk_mb', 1024,
+                     'Maximum size of the cache directory in MiB.')
 FLAGS = flags.FLAGS
 
 
+def make_synthesis_input(text: str) -> cloud_tts_pb2.SynthesisInput:
+    if text.lstrip().startswith('<speak'):
+        return cloud_tts_pb2.SynthesisInput(ssml=text)
+    return cloud_tts_pb2.SynthesisInput(text=text)
+
+
 def main(args):
     del args  # Unused
 
@@ -54,16 +90,53 @@ def main(args):
         FLAGS.api_url, api_key=FLAGS.api_key, insecure=FLAGS.insecure)
     stub = cloud_tts_pb2_grpc.TextToSpeechStub(channel)
 
-    synthesis_input = cloud_tts_pb2.SynthesisInput(text=FLAGS.text)
     voice = cloud_tts_pb2.VoiceSelectionParams(
         language_code='ko-KR', name='KO_KR_WOMAN_2')
     audio_config = cloud_tts_pb2.AudioConfig(
         audio_encoding=FLAGS.audio_encoding)
-    request = cloud_tts_pb2.SynthesizeSpeechRequest(
-        input=synthesis_input, voice=voice, audio_config=audio_config)
-    response = stub.SynthesizeSpeech(request)
+
+    def synthesize(request):
+        if FLAGS.hedging_delay_ms > 0:
+            return grpc_utils.hedged_call(stub.SynthesizeSpeech, request,
+                                          FLAGS.hedging_delay_ms / 1000)
+        return stub.SynthesizeSpeech(request)
+
+    cache = None
+    if FLAGS.cache_dir:
+        cache = cache_utils.TtsCache(directory=FLAGS.cache_dir,
+                                     disk_bytes=FLAGS.cache_disk_mb * 2**20)
+        synthesize = cache.cached_unary(synthesize)
+
+    synthesis_input = make_synthesis_input(FLAGS.text)
+    if not FLAGS.split_sentences:
+        request = cloud_tts_pb2.SynthesizeSpeechRequest(
+            input=synthesis_input, voice=voice, audio_config=audio_config)
+        response = synthesize(request)
+        with open(FLAGS.output_path, mode='wb') as output_file:
+            output_file.write(response.audio_content)
+        if cache is not None:
+            logging.info('Cache: %s', cache.stats())
+        return
+
+    if synthesis_input.ssml:
+        segments = segment_utils.split_ssml(FLAGS.text,
+                                            FLAGS.max_segment_chars)
+    else:
+        segments = segment_utils.split_text(FLAGS.text,
+                                            FLAGS.max_segment_chars)
+    requests = [
+        cloud_tts_pb2.SynthesizeSpeechRequest(
+            input=make_synthesis_input(segment),
+            voice=voice,
+            audio_config=audio_config) for segment in segments
+    ]
+    audios = segment_utils.synthesize_segments(synthesize, requests,
+                                               FLAGS.max_concurrency)
     with open(FLAGS.output_path, mode='wb') as output_file:
-        output_file.write(response.audio_content)
+        segment_utils.write_segments(output_file, audios,
+                                     audio_config.audio_encoding)
+    if cache is not None:
+        logging.info('Cache: %s', cache.stats())
 
 
 if __name__ == '__main__':
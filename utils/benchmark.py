@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+r"""
+Benchmark the AIQ client calls against a fake or real server.
+
+Each scenario makes `--requests` calls from `--concurrency` concurrent
+workers, threads for sync channels and tasks for aio channels, and reports
+the latency percentiles of the calls and of their first streamed response,
+the calls per second, and the CPU time and resident memory of the client.
+Without `--api_url`, `fake_server.py` is started in a subprocess, so that its
+CPU time is not counted. Protobuf files of both `stt` and `tts` should be
+compiled first.
+
+Usage:
+    $ cd utils
+    $ python benchmark.py --concurrency 32 --requests 1000
+
+    $ python benchmark.py --scenarios streaming_recognize \
+        --server_flags=--latency_ms=100,--jitter_ms=30,--error_rate=0.01
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from absl import app
+from absl import flags
+import grpc
+
+import grpc_utils
+
+# The generated protos live next to the examples.
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.extend([os.path.join(_ROOT, 'stt'), os.path.join(_ROOT, 'tts')])
+
+# pylint: disable=wrong-import-position
+from google.cloud.texttospeech.v1 import cloud_tts_pb2
+from google.cloud.texttospeech.v1 import cloud_tts_pb2_grpc
+from google.speech.v1 import cloud_speech_pb2
+from google.speech.v1 import cloud_speech_pb2_grpc
+# pylint: enable=wrong-import-position
+
+SCENARIOS = ('recognize', 'streaming_recognize', 'async_streaming_recognize',
+             'synthesize', 'streaming_synthesize')
+
+flags.DEFINE_string(
+    'api_url', None, 'AIQ portal address. If unset, a fake server is started '
+    'on a free local port.')
+flags.DEFINE_string('api_key', None, 'AIQ project api key.')
+flags.DEFINE_boolean('insecure', None, 'Use plaintext and insecure connection.')
+flags.DEFINE_list('server_flags', [], 'Flags of the started fake server.')
+flags.DEFINE_list('scenarios', list(SCENARIOS), 'Scenarios to run.')
+flags.DEFINE_integer('concurrency', 8, 'Number of concurrent calls.')
+flags.DEFINE_integer('requests', 200, 'Number of calls per scenario.')
+flags.DEFINE_integer('num_channels', 1,
+                     'Number of channels the calls are spread over.')
+flags.DEFINE_float('audio_seconds', 5.0,
+                   'Duration of the recognized silent audio.')
+flags.DEFINE_integer('chunk_ms', 100,
+                     'Duration of each streamed audio chunk in ms.')
+flags.DEFINE_string('text', '안녕하세요. 음성 합성 벤치마크입니다.',
+                    'Synthesized text.')
+flags.DEFINE_string('output_path', None,
+                    'Append the reports to this file as JSON lines.')
+flags.register_validator('chunk_ms',
+                         lambda value: value > 0,
+                         message='--chunk_ms must be positive.')
+FLAGS = flags.FLAGS
+
+SR = 16000
+BYTES_PER_SECOND = SR * 2
+
+
+class Result:
+    """Latencies and errors of the calls of a scenario."""
+
+    def __init__(self):
+        self.latencies = []
+        self.first_response_latencies = []
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, start_time, first_response_time=None):
+        end_time = time.perf_counter()
+        self.latencies.append(end_time - start_time)
+        if first_response_time is not None:
+            self.first_response_latencies.append(first_response_time -
+                                                 start_time)
+
+    def fail(self, error):
+        code = error.code().name
+        with self._lock:
+            self.errors[code] = self.errors.get(code, 0) + 1
+
+
+def percentile(values, q):
+    """Return the `q` quantile of `values` by the nearest rank."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def rss_bytes():
+    """Return the current resident memory of the process."""
+    try:
+        with open('/proc/self/statm', encoding='ascii') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Peak resident memory, in bytes on macOS.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def recognition_config():
+    return cloud_speech_pb2.RecognitionConfig(
+        # pylint: disable=no-member
+        encoding=cloud_speech_pb2.RecognitionConfig.AudioEncoding.LINEAR16,
+        sample_rate_hertz=SR,
+        language_code='ko-KR',
+        enable_word_time_offsets=True,
+    )
+
+
+def streaming_requests(audio, chunk_size):
+    yield cloud_speech_pb2.StreamingRecognizeRequest(
+        streaming_config=cloud_speech_pb2.StreamingRecognitionConfig(
+            config=recognition_config(), interim_results=True))
+    for offset in range(0, len(audio), chunk_size):
+        yield cloud_speech_pb2.StreamingRecognizeRequest(
+            audio_content=audio[offset:offset + chunk_size])
+
+
+async def streaming_requests_async(audio, chunk_size):
+    for request in streaming_requests(audio, chunk_size):
+        yield request
+
+
+def synthesis_request():
+    return cloud_tts_pb2.SynthesizeSpeechRequest(
+        input=cloud_tts_pb2.SynthesisInput(text=FLAGS.text),
+        voice=cloud_tts_pb2.VoiceSelectionParams(language_code='ko-KR',
+                                                 name='KO_KR_WOMAN_2'),
+        audio_config=cloud_tts_pb2.AudioConfig(
+            audio_encoding=cloud_tts_pb2.AudioEncoding.LINEAR16))
+
+
+def make_call(scenario, channel):
+    """Return a function making one call of a sync `scenario` on `channel`."""
+    audio = bytes(int(FLAGS.audio_seconds * BYTES_PER_SECOND))
+    chunk_size = BYTES_PER_SECOND * FLAGS.chunk_ms // 1000
+    if scenario == 'recognize':
+        stub = cloud_speech_pb2_grpc.SpeechStub(channel)
+        request = cloud_speech_pb2.RecognizeRequest(
+            config=recognition_config(),
+            audio=cloud_speech_pb2.RecognitionAudio(content=audio))
+        return lambda: stub.Recognize(request)
+    if scenario == 'synthesize':
+        stub = cloud_tts_pb2_grpc.TextToSpeechStub(channel)
+        request = synthesis_request()
+        return lambda: stub.SynthesizeSpeech(request)
+    if scenario == 'streaming_recognize':
+        stub = cloud_speech_pb2_grpc.SpeechStub(channel)
+        return lambda: stub.StreamingRecognize(
+            streaming_requests(audio, chunk_size))
+    stub = cloud_tts_pb2_grpc.TextToSpeechStub(channel)
+    request = synthesis_request()
+    return lambda: stub.StreamingSynthesizeSpeech(request)
+
+
+def run_sync(scenario, channels):
+    """Make the calls of a sync scenario from a pool of threads."""
+    result = Result()
+    calls = [make_call(scenario, channel) for channel in channels]
+    streaming = scenario.startswith('streaming')
+
+    def worker(index):
+        call = calls[index % len(calls)]
+        start_time = time.perf_counter()
+        first_response_time = None
+        try:
+            if streaming:
+                for _ in call():
+                    if first_response_time is None:
+                        first_response_time = time.perf_counter()
+            else:
+                call()
+        except grpc.RpcError as e:
+            result.fail(e)
+            return
+        result.record(start_time, first_response_time)
+
+    with concurrent.futures.ThreadPoolExecutor(FLAGS.concurrency) as executor:
+        list(executor.map(worker, range(FLAGS.requests)))
+    return result
+
+
+async def run_async(channels):
+    """Make the calls of the aio StreamingRecognize scenario from tasks."""
+    result = Result()
+    audio = bytes(int(FLAGS.audio_seconds * BYTES_PER_SECOND))
+    chunk_size = BYTES_PER_SECOND * FLAGS.chunk_ms // 1000
+    stubs = [cloud_speech_pb2_grpc.SpeechStub(channel) for channel in channels]
+    indexes = iter(range(FLAGS.requests))
+
+    async def worker():
+        for index in indexes:
+            stub = stubs[index % len(stubs)]
+            start_time = time.perf_counter()
+            first_response_time = None
+            try:
+                async for _ in stub.StreamingRecognize(
+                        streaming_requests_async(audio, chunk_size)):
+                    if first_response_time is None:
+                        first_response_time = time.perf_counter()
+            except grpc.RpcError as e:
+                result.fail(e)
+                continue
+            result.record(start_time, first_response_time)
+
+    await asyncio.gather(*(worker() for _ in range(FLAGS.concurrency)))
+    return result
+
+
+def run(scenario, api_url):
+    """Run `scenario` and return its report."""
+    is_aio = scenario.startswith('async')
+    create = (grpc_utils.create_aio_channel
+              if is_aio else grpc_utils.create_channel)
+
+    async def run_aio():
+        channels = [
+            create(api_url, api_key=FLAGS.api_key, insecure=FLAGS.insecure)
+            for _ in range(FLAGS.num_channels)
+        ]
+        try:
+            return await run_async(channels)
+        finally:
+            for channel in channels:
+                await channel.close()
+
+    start_rss = rss_bytes()
+    start_cpu = time.process_time()
+    start_time = time.perf_counter()
+    if is_aio:
+        result = asyncio.run(run_aio())
+    else:
+        channels = [
+            create(api_url, api_key=FLAGS.api_key, insecure=FLAGS.insecure)
+            for _ in range(FLAGS.num_channels)
+        ]
+        try:
+            result = run_sync(scenario, channels)
+        finally:
+            for channel in channels:
+                channel.close()
+    elapsed = time.perf_counter() - start_time
+    cpu = time.process_time() - start_cpu
+
+    report = {
+        'scenario': scenario,
+        'concurrency': FLAGS.concurrency,
+        'calls': len(result.latencies),
+        'errors': result.errors,
+        'rps': len(result.latencies) / elapsed,
+        'cpu_percent': 100 * cpu / elapsed,
+        'cpu_ms_per_call': 1000 * cpu / max(FLAGS.requests, 1),
+        'rss_mb': rss_bytes() / 2**20,
+        'rss_growth_mb': (rss_bytes() - start_rss) / 2**20,
+    }
+    for name, latencies in (('latency', result.latencies),
+                            ('first_response',
+                             result.first_response_latencies)):
+        for q in (50, 95, 99) if latencies else ():
+            report[f'{name}_p{q}_ms'] = 1000 * percentile(latencies, q / 100)
+    return report
+
+
+def print_report(report):
+    print(f"{report['scenario']}: {report['calls']} calls, "
+          f"{report['rps']:.1f} calls/s, errors: {report['errors'] or 0}")
+    for name in ('latency', 'first_response'):
+        if f'{name}_p50_ms' in report:
+            print(f"  {name:15s} p50 {report[f'{name}_p50_ms']:8.1f}ms  "
+                  f"p95 {report[f'{name}_p95_ms']:8.1f}ms  "
+                  f"p99 {report[f'{name}_p99_ms']:8.1f}ms")
+    print(f"  cpu {report['cpu_percent']:.1f}% "
+          f"({report['cpu_ms_per_call']:.2f}ms/call), "
+          f"rss {report['rss_mb']:.1f}MB "
+          f"(+{report['rss_growth_mb']:.1f}MB)")
+
+
+def start_fake_server():
+    """Start fake_server.py on a free port and return it with its address."""
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        port = sock.getsockname()[1]
+    server = subprocess.Popen([
+        sys.executable,
+        os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                     'fake_server.py'), f'--port={port}'
+    ] + FLAGS.server_flags)
+    api_url = f'localhost:{port}'
+    with grpc.insecure_channel(api_url) as channel:
+        grpc.channel_ready_future(channel).result(timeout=30)
+    return server, api_url
+
+
+def main(args):
+    del args  # Unused
+
+    for scenario in FLAGS.scenarios:
+        if scenario not in SCENARIOS:
+            raise app.UsageError(f'Unknown scenario: {scenario}')
+
+    server = None
+    api_url = FLAGS.api_url
+    if api_url is None:
+        server, api_url = start_fake_server()
+    try:
+        for scenario in FLAGS.scenarios:
+            report = run(scenario, api_url)
+            print_report(report)
+            if FLAGS.output_path:
+                with open(FLAGS.output_path, 'a',
+                          encoding='utf-8') as output_file:
+                    output_file.write(json.dumps(report) + '\n')
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -0,0 +1,232 @@
+"""Size bounded key-value stores for caching AIQ API responses.
+
+Every backend maps string keys to bytes, evicts the least recently used
+entries once their total size exceeds `max_bytes`, and is thread-safe.
+`MemoryBackend` lives in the process, `DiskBackend` keeps a file per entry in
+a directory and `SqliteBackend` a row per entry in a database file. The last
+two can be shared by processes.
+"""
+
+import collections
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Optional
+
+
+class MemoryBackend:
+    """LRU of entries up to a total size in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: bytes):
+        if len(entry) > self._max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = entry
+            self._size += len(entry)
+            while self._size > self._max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= len(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+
+class DiskBackend:
+    """Entries stored as files in `directory` up to a total size in bytes.
+
+    The modification time of a file is its last use. The files are written
+    atomically, so that processes can share the directory. Files added by
+    other processes are only counted against the size once they are read.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, suffix: str = '.cache'):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._suffix = suffix
+        self._lock = threading.Lock()
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        # Size of each file, from the least to the most recently used.
+        self._sizes = collections.OrderedDict()
+        files = []
+        for name in os.listdir(directory):
+            if name.endswith(suffix):
+                stat = os.stat(os.path.join(directory, name))
+                files.append(
+                    (stat.st_mtime, name[:-len(suffix)], stat.st_size))
+        for _, key, size in sorted(files):
+            self._sizes[key] = size
+        self._size = sum(self._sizes.values())
+        with self._lock:
+            self._evict()
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + self._suffix)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as entry_file:
+                entry = entry_file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._size -= self._sizes.pop(key, 0)
+            return None
+        with self._lock:
+            if key not in self._sizes:
+                self._size += len(entry)
+            self._sizes[key] = len(entry)
+            self._sizes.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: bytes):
+        if len(entry) > self._max_bytes:
+            return
+        fd, temp_path = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as entry_file:
+            entry_file.write(entry)
+        os.replace(temp_path, self._path(key))
+        with self._lock:
+            self._size += len(entry) - self._sizes.pop(key, 0)
+            self._sizes[key] = len(entry)
+            self._evict()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._size -= self._sizes.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self._size > self._max_bytes and self._sizes:
+            key, size = self._sizes.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return len(self._sizes)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+
+class SqliteBackend:
+    """Entries stored in a SQLite database up to a total size in bytes.
+
+    The database is opened in WAL mode, so that processes can share it while
+    one of them writes.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self._connection = sqlite3.connect(path,
+                                           check_same_thread=False,
+                                           isolation_level=None)
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, '
+                'value BLOB NOT NULL, size INTEGER NOT NULL, '
+                'used REAL NOT NULL)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS entries_used ON entries (used)')
+            self._evict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                'UPDATE entries SET used = ? WHERE key = ?', (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, entry: bytes):
+        if len(entry) > self._max_bytes:
+            return
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                (key, entry, len(entry), time.time()))
+            self._evict()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._connection.execute('DELETE FROM entries WHERE key = ?',
+                                     (key,))
+
+    def _total_size(self):
+        return self._connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def _evict(self):
+        excess = self._total_size() - self._max_bytes
+        if excess <= 0:
+            return
+        # Delete the least recently used entries covering the excess.
+        rows = self._connection.execute(
+            'SELECT key, size FROM entries ORDER BY used')
+        keys = []
+        for key, size in rows:
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        rows.close()
+        self._connection.executemany('DELETE FROM entries WHERE key = ?', keys)
+        self.evictions += len(keys)
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            return self._total_size()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
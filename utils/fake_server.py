@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+r"""
+Local stand-in for the AIQ Speech and TextToSpeech APIs.
+
+The server answers with canned transcripts and audio after a configurable
+latency, so that clients can be load tested and benchmarked without reaching
+aiq.skelterlabs.com. Protobuf files of both `stt` and `tts` should be compiled
+first.
+
+Usage:
+    $ cd utils
+    $ python fake_server.py --port 50051 --latency_ms 50 --jitter_ms 20 \
+        --error_rate 0.01
+
+    $ cd ../stt
+    $ python recognize.py --api_url localhost:50051 --insecure
+"""
+
+import asyncio
+import math
+import os
+import random
+import struct
+import sys
+
+from absl import app
+from absl import flags
+from absl import logging
+import grpc
+from grpc import aio
+
+# The generated protos live next to the examples.
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.extend([os.path.join(_ROOT, 'stt'), os.path.join(_ROOT, 'tts')])
+
+# pylint: disable=wrong-import-position
+from google.cloud.texttospeech.v1 import cloud_tts_pb2
+from google.cloud.texttospeech.v1 import cloud_tts_pb2_grpc
+from google.speech.v1 import cloud_speech_pb2
+from google.speech.v1 import cloud_speech_pb2_grpc
+# pylint: enable=wrong-import-position
+
+flags.DEFINE_string('host', 'localhost', 'Host address to listen on.')
+flags.DEFINE_integer('port', 50051, 'Port to listen on.')
+flags.DEFINE_float('latency_ms', 20.0,
+                   'Processing time before each response.')
+flags.DEFINE_float('jitter_ms', 0.0,
+                   'Standard deviation of the processing time.')
+flags.DEFINE_float('error_rate', 0.0,
+                   'Fraction of calls failing with --error_code.')
+flags.DEFINE_enum('error_code', 'UNAVAILABLE',
+                  [code.name for code in grpc.StatusCode],
+                  'Status code of injected errors.')
+flags.DEFINE_string('transcript', '안녕하세요 스켈터랩스입니다',
+                    'Transcript of every recognized utterance.')
+flags.DEFINE_integer('utterance_ms', 2000,
+                     'Duration of audio recognized as one utterance.')
+flags.DEFINE_integer('interim_ms', 500,
+                     'Duration of audio between interim results.')
+flags.DEFINE_float('seconds_per_char', 0.1,
+                   'Duration of synthesized audio per input character.')
+flags.DEFINE_integer('tts_chunk_ms', 200,
+                     'Duration of audio in each streamed synthesis response.')
+flags.DEFINE_float(
+    'tts_realtime_factor', 0.0, 'Stream synthesized audio at this multiple '
+    'of real time. Zero streams it after the processing time only.')
+FLAGS = flags.FLAGS
+
+SR = 16000
+SAMPLE_WIDTH = 2
+BYTES_PER_SECOND = SR * SAMPLE_WIDTH
+
+
+def wav_header(data_size: int, sample_rate: int = SR) -> bytes:
+    """Return the 44 bytes WAV header of 16-bit mono PCM audio."""
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_size, b'WAVE',
+                       b'fmt ', 16, 1, 1, sample_rate,
+                       sample_rate * SAMPLE_WIDTH, SAMPLE_WIDTH, 16, b'data',
+                       data_size)
+
+
+def tone(seconds: float, sample_rate: int = SR) -> bytes:
+    """Return 16-bit mono PCM of a quiet 440Hz tone."""
+    num_samples = int(seconds * sample_rate)
+    period = [
+        int(3000 * math.sin(2 * math.pi * 440 * i / sample_rate))
+        for i in range(sample_rate // 40)
+    ]
+    samples = (period * (num_samples // len(period) + 1))[:num_samples]
+    return struct.pack(f'<{num_samples}h', *samples)
+
+
+def _duration(seconds):
+    duration = cloud_speech_pb2.WordInfo().start_time
+    duration.FromNanoseconds(int(seconds * 1e9))
+    return duration
+
+
+class Faults:
+    """Latency and errors injected into every call."""
+
+    def __init__(self, latency_ms, jitter_ms, error_rate, error_code):
+        self._latency = latency_ms / 1000
+        self._jitter = jitter_ms / 1000
+        self._error_rate = error_rate
+        self._error_code = grpc.StatusCode[error_code]
+
+    async def delay(self):
+        await asyncio.sleep(
+            max(0.0, random.gauss(self._latency, self._jitter)))
+
+    async def maybe_fail(self, context):
+        if random.random() < self._error_rate:
+            await context.abort(self._error_code, 'Injected error')
+
+
+def make_alternative(transcript, start, end):
+    """Return an alternative spreading the words of `transcript` evenly."""
+    words = transcript.split()
+    alternative = cloud_speech_pb2.SpeechRecognitionAlternative(
+        transcript=transcript, confidence=0.9)
+    step = (end - start) / max(len(words), 1)
+    for i, word in enumerate(words):
+        alternative.words.add(word=word,
+                              start_time=_duration(start + i * step),
+                              end_time=_duration(start + (i + 1) * step))
+    return alternative
+
+
+class FakeSpeech(cloud_speech_pb2_grpc.SpeechServicer):
+    """Speech service answering every utterance with the same transcript."""
+
+    def __init__(self, faults, transcript, utterance_ms, interim_ms):
+        self._faults = faults
+        self._transcript = transcript
+        self._utterance = utterance_ms / 1000
+        self._interim = interim_ms / 1000
+
+    def _results(self, start, end):
+        # One final result per utterance of the audio.
+        results = []
+        while start < end:
+            utterance_end = min(start + self._utterance, end)
+            results.append(
+                cloud_speech_pb2.SpeechRecognitionResult(alternatives=[
+                    make_alternative(self._transcript, start, utterance_end)
+                ]))
+            start = utterance_end
+        return results
+
+    async def Recognize(self, request, context):
+        await self._faults.maybe_fail(context)
+        await self._faults.delay()
+        seconds = len(request.audio.content) / BYTES_PER_SECOND
+        return cloud_speech_pb2.RecognizeResponse(
+            results=self._results(0.0, seconds))
+
+    async def StreamingRecognize(self, request_iterator, context):
+        await self._faults.maybe_fail(context)
+        config = None
+        received = 0
+        settled = 0.0
+        interim_at = self._interim
+        async for request in request_iterator:
+            if request.HasField('streaming_config'):
+                config = request.streaming_config
+                continue
+            received += len(request.audio_content)
+            seconds = received / BYTES_PER_SECOND
+            if seconds - settled >= self._utterance:
+                await self._faults.delay()
+                end = settled + self._utterance
+                yield self._streaming_response(settled, end, True)
+                settled = end
+                interim_at = settled + self._interim
+            elif (config is not None and config.interim_results and
+                  seconds >= interim_at):
+                await self._faults.delay()
+                yield self._streaming_response(settled, seconds, False)
+                interim_at += self._interim
+
+        seconds = received / BYTES_PER_SECOND
+        if seconds > settled:
+            await self._faults.delay()
+            yield self._streaming_response(settled, seconds, True)
+
+    def _streaming_response(self, start, end, is_final):
+        words = self._transcript.split()
+        if not is_final:
+            # Interim results hold the words heard so far.
+            words = words[:max(1, len(words) // 2)]
+        transcript = ' '.join(words)
+        return cloud_speech_pb2.StreamingRecognizeResponse(results=[
+            cloud_speech_pb2.StreamingRecognitionResult(
+                alternatives=[make_alternative(transcript, start, end)],
+                is_final=is_final,
+                stability=1.0 if is_final else 0.5)
+        ])
+
+
+class FakeTextToSpeech(cloud_tts_pb2_grpc.TextToSpeechServicer):
+    """TextToSpeech service answering with a tone as long as the text."""
+
+    def __init__(self, faults, seconds_per_char, chunk_ms, realtime_factor):
+        self._faults = faults
+        self._seconds_per_char = seconds_per_char
+        self._chunk_size = SR * chunk_ms // 1000 * SAMPLE_WIDTH
+        self._realtime_factor = realtime_factor
+
+    def _pcm(self, request):
+        text = request.input.text or request.input.ssml
+        return tone(len(text) * self._seconds_per_char)
+
+    @staticmethod
+    def _has_header(request):
+        return (request.audio_config.audio_encoding ==
+                cloud_tts_pb2.AudioEncoding.LINEAR16)
+
+    async def ListVoices(self, request, context):
+        return cloud_tts_pb2.ListVoicesResponse(voices=[
+            cloud_tts_pb2.Voice(language_codes=['ko-KR'],
+                                name='KO_KR_WOMAN_2',
+                                natural_sample_rate_hertz=SR)
+        ])
+
+    async def SynthesizeSpeech(self, request, context):
+        await self._faults.maybe_fail(context)
+        await self._faults.delay()
+        pcm = self._pcm(request)
+        if self._has_header(request):
+            pcm = wav_header(len(pcm)) + pcm
+        return cloud_tts_pb2.SynthesizeSpeechResponse(audio_content=pcm)
+
+    async def StreamingSynthesizeSpeech(self, request, context):
+        await self._faults.maybe_fail(context)
+        await self._faults.delay()
+        pcm = self._pcm(request)
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        for offset in range(0, len(pcm), self._chunk_size):
+            chunk = pcm[offset:offset + self._chunk_size]
+            if offset == 0 and self._has_header(request):
+                chunk = wav_header(len(pcm)) + chunk
+            if self._realtime_factor > 0:
+                due = start_time + offset / BYTES_PER_SECOND / (
+                    self._realtime_factor)
+                await asyncio.sleep(max(0.0, due - loop.time()))
+            yield cloud_tts_pb2.SynthesizeSpeechResponse(audio_content=chunk)
+
+
+async def serve(address: str) -> aio.Server:
+    """Start the fake Speech and TextToSpeech services on `address`.
+
+    Args:
+        address: Address to listen on, e.g. 'localhost:0'.
+
+    Returns:
+        The started server.
+    """
+    faults = Faults(FLAGS.latency_ms, FLAGS.jitter_ms, FLAGS.error_rate,
+                    FLAGS.error_code)
+    server = aio.server(options=[
+        ('grpc.max_receive_message_length', 64 * 1024 * 1024),
+        ('grpc.max_send_message_length', 64 * 1024 * 1024),
+    ])
+    cloud_speech_pb2_grpc.add_SpeechServicer_to_server(
+        FakeSpeech(faults, FLAGS.transcript, FLAGS.utterance_ms,
+                   FLAGS.interim_ms), server)
+    cloud_tts_pb2_grpc.add_TextToSpeechServicer_to_server(
+        FakeTextToSpeech(faults, FLAGS.seconds_per_char, FLAGS.tts_chunk_ms,
+                         FLAGS.tts_realtime_factor), server)
+    port = server.add_insecure_port(address)
+    await server.start()
+    logging.info('Fake AIQ server listening on port %d', port)
+    return server
+
+
+async def _main():
+    server = await serve(f'{FLAGS.host}:{FLAGS.port}')
+    await server.wait_for_termination()
+
+
+def main(args):
+    del args  # Unused
+    asyncio.run(_main())
+
+
+if __name__ == '__main__':
+    app.run(main)
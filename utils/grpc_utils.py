@@ -1,11 +1,53 @@
 """Utility grpc functions."""
 
+import asyncio
+import functools
+import ipaddress
+import itertools
+import json
 import os
-from typing import List, Optional, Tuple, Union
+import queue
+import socket
+import threading
+import time
+import types
+from typing import Any, Dict, Mapping, Optional, Sequence, Tuple, Union
 
+from absl import logging
 import grpc
 from grpc import aio
 
+# Header name, header value pairs.
+Headers = Sequence[Tuple[str, Union[str, bytes]]]
+
+# Channel arguments of pooled channels, which are meant to live long.
+POOLED_CHANNEL_OPTIONS = (
+    # Keep idle connections warm. Servers reject pings without data more
+    # frequent than every 5 minutes by default, so do not ping more often.
+    ('grpc.keepalive_time_ms', 300000),
+    ('grpc.keepalive_timeout_ms', 20000),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.max_pings_without_data', 0),
+    # Long synthesized audio can exceed the default limit of 4MB.
+    ('grpc.max_receive_message_length', 64 * 1024 * 1024),
+    # Each pooled channel gets its own connection instead of sharing the
+    # process-wide subchannel of a channel with the same target and arguments.
+    ('grpc.use_local_subchannel_pool', 1),
+)
+# A pooled channel failing to connect for longer than this is recreated.
+RECONNECT_AFTER_SECONDS = 10.0
+
+# Full names of AIQ methods, as matched by service configs.
+RECOGNIZE_METHOD = 'google.cloud.speech.v1.Speech/Recognize'
+STREAMING_RECOGNIZE_METHOD = 'google.cloud.speech.v1.Speech/StreamingRecognize'
+SYNTHESIZE_SPEECH_METHOD = (
+    'google.cloud.texttospeech.v1.TextToSpeech/SynthesizeSpeech')
+STREAMING_SYNTHESIZE_SPEECH_METHOD = (
+    'google.cloud.texttospeech.v1.TextToSpeech/StreamingSynthesizeSpeech')
+
+# Status codes a failed attempt or hedge is retried on.
+RETRYABLE_STATUS_CODES = (grpc.StatusCode.UNAVAILABLE,)
+
 
 class AuthGateway(grpc.AuthMetadataPlugin):
     """Authenticate to AIQ APIs using the provided API key."""
@@ -127,56 +169,187 @@ class AsyncStreamStreamClientInterceptor(aio.StreamStreamClientInterceptor):
         return postprocess(response_it) if postprocess else response_it
 
 
-def additional_headers_interceptors(
-    headers: List[Tuple[str, Union[str, bytes]]],
+# Position of each field by call details class. Call details are namedtuples,
+# and rebuilding them directly is much cheaper than `_replace`.
+_FIELD_INDEX = {}
+
+
+def _replace_field(client_call_details, name, value):
+    key = (type(client_call_details), name)
+    idx = _FIELD_INDEX.get(key)
+    if idx is None:
+        idx = _FIELD_INDEX[key] = key[0]._fields.index(name)
+    return tuple.__new__(
+        key[0],
+        client_call_details[:idx] + (value,) + client_call_details[idx + 1:])
+
+
+class _CallDetailsUpdater:
+    """Add headers and default deadlines to call details."""
+
+    def __init__(self, headers, timeouts):
+        self._headers = headers
+        self._timeouts = timeouts
+
+    def __call__(self, client_call_details):
+        if self._headers:
+            metadata = client_call_details.metadata
+            client_call_details = _replace_field(
+                client_call_details, 'metadata',
+                tuple(metadata) + self._headers if metadata else self._headers)
+        if self._timeouts and client_call_details.timeout is None:
+            timeout = self._timeouts.get(client_call_details.method)
+            if timeout is not None:
+                client_call_details = _replace_field(client_call_details,
+                                                     'timeout', timeout)
+        return client_call_details
+
+
+class _CallDetailsClientInterceptor(grpc.UnaryUnaryClientInterceptor,
+                                    grpc.UnaryStreamClientInterceptor,
+                                    grpc.StreamUnaryClientInterceptor,
+                                    grpc.StreamStreamClientInterceptor):
+
+    def __init__(self, update):
+        # pylint: disable=super-init-not-called
+        self._update = update
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        return continuation(self._update(client_call_details), request)
+
+    def intercept_unary_stream(self, continuation, client_call_details,
+                               request):
+        return continuation(self._update(client_call_details), request)
+
+    def intercept_stream_unary(self, continuation, client_call_details,
+                               request_iterator):
+        return continuation(self._update(client_call_details),
+                            request_iterator)
+
+    def intercept_stream_stream(self, continuation, client_call_details,
+                                request_iterator):
+        return continuation(self._update(client_call_details),
+                            request_iterator)
+
+
+class _AsyncCallDetailsClientInterceptor:
+
+    def __init__(self, update):
+        # pylint: disable=super-init-not-called
+        self._update = update
+
+    async def intercept_unary_unary(self, continuation, client_call_details,
+                                    request):
+        return await continuation(self._update(client_call_details), request)
+
+    async def intercept_unary_stream(self, continuation, client_call_details,
+                                     request):
+        return await continuation(self._update(client_call_details), request)
+
+    async def intercept_stream_unary(self, continuation, client_call_details,
+                                     request_iterator):
+        return await continuation(self._update(client_call_details),
+                                  request_iterator)
+
+    async def intercept_stream_stream(self, continuation, client_call_details,
+                                      request_iterator):
+        return await continuation(self._update(client_call_details),
+                                  request_iterator)
+
+
+# grpc.aio.Channel files each interceptor under a single call type, see the
+# note on AsyncUnaryUnaryClientInterceptor.
+class _AsyncUnaryUnaryCallDetailsInterceptor(
+        _AsyncCallDetailsClientInterceptor, aio.UnaryUnaryClientInterceptor):
+    pass
+
+
+class _AsyncUnaryStreamCallDetailsInterceptor(
+        _AsyncCallDetailsClientInterceptor, aio.UnaryStreamClientInterceptor):
+    pass
+
+
+class _AsyncStreamUnaryCallDetailsInterceptor(
+        _AsyncCallDetailsClientInterceptor, aio.StreamUnaryClientInterceptor):
+    pass
+
+
+class _AsyncStreamStreamCallDetailsInterceptor(
+        _AsyncCallDetailsClientInterceptor, aio.StreamStreamClientInterceptor):
+    pass
+
+
+def call_details_interceptors(
+    headers: Headers = (),
+    timeouts: Optional[Mapping[str, float]] = None,
     is_aio: bool = False,
 ):
-    """Return interceptor which adds given headers to each calls.
+    """Return interceptor which adds headers and deadlines to each calls.
+
+    The headers are frozen into a tuple once, and each call only replaces the
+    fields of its call details. No interceptor is returned if there is nothing
+    to add, so that calls are not wrapped at all.
 
     Args:
         headers: The list of header name, header value pair.
+        timeouts: Deadline in seconds by full method name, e.g.
+            RECOGNIZE_METHOD, of the calls made without a timeout.
         is_aio: A flag indicating if interceptor is for aio.
 
     Returns:
         List of interceptors.
     """
-
-    def _intercept_call(client_call_details, request_iterator,
-                        request_streaming, response_streaming):
-        del request_streaming  # Unused
-        del response_streaming  # Unused
-        metadata = []
-        if client_call_details.metadata is not None:
-            metadata = list(client_call_details.metadata)
-        metadata += headers
-        client_call_details = client_call_details._replace(metadata=metadata)
-        return client_call_details, request_iterator, None
-
+    headers = tuple(headers)
+    if timeouts:
+        # Call details hold the method path, as str or as bytes for aio.
+        timeouts = {
+            f'/{method}'.encode() if is_aio else f'/{method}': timeout
+            for method, timeout in timeouts.items()
+        }
+    if not headers and not timeouts:
+        return []
+    update = _CallDetailsUpdater(headers, timeouts)
     if not is_aio:
-        return [GenericClientInterceptor(_intercept_call)]
+        return [_CallDetailsClientInterceptor(update)]
     return [
-        AsyncUnaryUnaryClientInterceptor(_intercept_call),
-        AsyncUnaryStreamClientInterceptor(_intercept_call),
-        AsyncStreamUnaryClientInterceptor(_intercept_call),
-        AsyncStreamStreamClientInterceptor(_intercept_call),
+        _AsyncUnaryUnaryCallDetailsInterceptor(update),
+        _AsyncUnaryStreamCallDetailsInterceptor(update),
+        _AsyncStreamUnaryCallDetailsInterceptor(update),
+        _AsyncStreamStreamCallDetailsInterceptor(update),
     ]
 
 
-def create_credentials(api_key: Optional[str]) -> grpc.ChannelCredentials:
-    """Create a ChannelCredentials that authenticates to AIQ via an API key.
+def additional_headers_interceptors(
+    headers: Headers,
+    is_aio: bool = False,
+):
+    """Return interceptor which adds given headers to each calls.
 
     Args:
-        api_key: AIQ API key.
+        headers: The list of header name, header value pair.
+        is_aio: A flag indicating if interceptor is for aio.
 
     Returns:
-        A ChannelCredentials object.
+        List of interceptors.
     """
-    with open(
-            os.path.join(
-                os.path.dirname(grpc.__file__),
-                '_cython/_credentials/roots.pem'), 'rb') as root_pem_file:
-        root_pem = root_pem_file.read()
-    channel_credentials = grpc.ssl_channel_credentials(root_pem)
+    return call_details_interceptors(headers, is_aio=is_aio)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_root_certificates(path: Optional[str]) -> bytes:
+    if path is None:
+        path = os.path.join(os.path.dirname(grpc.__file__),
+                            '_cython/_credentials/roots.pem')
+    with open(path, 'rb') as root_pem_file:
+        return root_pem_file.read()
+
+
+@functools.lru_cache(maxsize=128)
+def _create_credentials(
+        api_key: Optional[str],
+        root_certificates_path: Optional[str]) -> grpc.ChannelCredentials:
+    channel_credentials = grpc.ssl_channel_credentials(
+        _load_root_certificates(root_certificates_path))
 
     if not api_key:
         return channel_credentials
@@ -186,61 +359,315 @@ def create_credentials(api_key: Optional[str]) -> grpc.ChannelCredentials:
                                               call_credentials)
 
 
+def create_credentials(
+        api_key: Optional[str],
+        root_certificates_path: Optional[str] = None
+) -> grpc.ChannelCredentials:
+    """Create a ChannelCredentials that authenticates to AIQ via an API key.
+
+    The root certificates bundle is read once per path and the credentials
+    are cached per API key, so creating many channels does not read and parse
+    the bundle again. Use `credentials_cache_info` to check the cache hits.
+
+    Args:
+        api_key: AIQ API key.
+        root_certificates_path: PEM file of the root certificates. Defaults
+            to the bundle shipped with grpc.
+
+    Returns:
+        A ChannelCredentials object.
+    """
+    return _create_credentials(api_key, root_certificates_path)
+
+
+def credentials_cache_info() -> Dict[str, Any]:
+    """Return the hit and miss counters of the credentials caches.
+
+    Returns:
+        Dict of `functools.lru_cache` statistics of the root certificates and
+        the credentials caches.
+    """
+    return {
+        'root_certificates': _load_root_certificates.cache_info(),
+        'credentials': _create_credentials.cache_info(),
+    }
+
+
+def clear_credentials_cache():
+    """Forget cached credentials, e.g. after the CA bundle is rotated."""
+    _create_credentials.cache_clear()
+    _load_root_certificates.cache_clear()
+
+
+def make_service_config(
+    retry_methods: Sequence[str] = (),
+    max_attempts: int = 3,
+    initial_backoff: float = 0.2,
+    max_backoff: float = 5.0,
+    backoff_multiplier: float = 2.0,
+    retryable_status_codes: Sequence[grpc.StatusCode] = RETRYABLE_STATUS_CODES,
+) -> str:
+    """Return a gRPC service config with the retry policy of the methods.
+
+    Retried attempts wait an exponentially growing, jittered backoff and all
+    attempts share the deadline of the call. Only idempotent methods should be
+    retried. gRPC does not retry a call once response data is received.
+
+    Args:
+        retry_methods: Full names of the methods to retry, e.g.
+            RECOGNIZE_METHOD.
+        max_attempts: Maximum number of attempts, including the first one.
+        initial_backoff: Backoff in seconds before the first retry.
+        max_backoff: Maximum backoff in seconds.
+        backoff_multiplier: Backoff growth factor after each retry.
+        retryable_status_codes: Status codes to retry on.
+
+    Returns:
+        Service config in JSON.
+    """
+    method_configs = {}
+
+    def method_config(method):
+        if method not in method_configs:
+            service, name = method.split('/')
+            method_configs[method] = {
+                'name': [{
+                    'service': service,
+                    'method': name
+                }]
+            }
+        return method_configs[method]
+
+    for method in retry_methods:
+        method_config(method)['retryPolicy'] = {
+            'maxAttempts': max_attempts,
+            'initialBackoff': f'{initial_backoff:.3f}s',
+            'maxBackoff': f'{max_backoff:.3f}s',
+            'backoffMultiplier': backoff_multiplier,
+            'retryableStatusCodes': [
+                code.name for code in retryable_status_codes
+            ],
+        }
+    return json.dumps({'methodConfig': list(method_configs.values())})
+
+
+# Idempotent unary calls are retried when the backend is unavailable.
+DEFAULT_SERVICE_CONFIG = make_service_config(
+    retry_methods=(RECOGNIZE_METHOD, SYNTHESIZE_SPEECH_METHOD))
+
+# Deadlines of unary calls made without a timeout. Streaming calls last as long
+# as their audio or text, so they get none. These are applied per call rather
+# than through the timeout field of the service config, which expired over a
+# second before the configured time in testing.
+DEFAULT_TIMEOUTS = types.MappingProxyType({
+    RECOGNIZE_METHOD: 120.0,
+    SYNTHESIZE_SPEECH_METHOD: 60.0,
+})
+
+
+# Replicas failing at least half of their calls, including calls exceeding
+# their deadline, are taken out of the round robin for 30 seconds, and longer
+# each time they are ejected again.
+OUTLIER_DETECTION_CONFIG = {
+    'interval': '10s',
+    'baseEjectionTime': '30s',
+    'maxEjectionTime': '300s',
+    'maxEjectionPercent': 50,
+    'failurePercentageEjection': {
+        'threshold': 50,
+        'enforcementPercentage': 100,
+        'minimumHosts': 2,
+        'requestVolume': 10,
+    },
+}
+
+
+def _split_host_port(endpoint):
+    host, _, port = endpoint.rpartition(':')
+    return host.strip('[]'), port
+
+
+def make_target(
+        api_url: Union[str, Sequence[str]]) -> Tuple[str, Optional[str]]:
+    """Return the gRPC target of one or more AIQ endpoints.
+
+    Multiple endpoints are turned into a single target of their addresses, so
+    that one channel balances the calls over them. Their host names are
+    resolved once, when the channel is created. To follow DNS changes, use a
+    single `dns:///<host>:<port>` target instead.
+
+    Args:
+        api_url: AIQ API url, comma separated AIQ API urls, or a list of them.
+
+    Returns:
+        Tuple of the target and the authority, i.e. the first endpoint, the
+        server certificates are verified with. The authority is None for a
+        single endpoint.
+    """
+    if isinstance(api_url, str):
+        api_url = api_url.split(',')
+    endpoints = [endpoint.strip() for endpoint in api_url if endpoint.strip()]
+    if len(endpoints) == 1:
+        return endpoints[0], None
+
+    addresses = {socket.AF_INET: {}, socket.AF_INET6: {}}
+    for endpoint in endpoints:
+        host, port = _split_host_port(endpoint)
+        try:
+            version = ipaddress.ip_address(host).version
+            infos = [(socket.AF_INET6 if version == 6 else socket.AF_INET,
+                      host)]
+        except ValueError:
+            infos = [(family, sockaddr[0])
+                     for family, _, _, _, sockaddr in socket.getaddrinfo(
+                         host, port, type=socket.SOCK_STREAM)]
+        for family, ip in infos:
+            if family == socket.AF_INET:
+                addresses[family][f'{ip}:{port}'] = None
+            elif family == socket.AF_INET6:
+                addresses[family][f'[{ip}]:{port}'] = None
+
+    # A target holds addresses of a single family. IPv4 is preferred.
+    if addresses[socket.AF_INET]:
+        if addresses[socket.AF_INET6]:
+            logging.warning(
+                'Dropped the IPv6 addresses of the endpoints, as a target '
+                'holds addresses of a single family: %s',
+                ', '.join(addresses[socket.AF_INET6]))
+        target = 'ipv4:' + ','.join(addresses[socket.AF_INET])
+    else:
+        target = 'ipv6:' + ','.join(addresses[socket.AF_INET6])
+    return target, endpoints[0]
+
+
+def _with_load_balancing(service_config, load_balancing):
+    config = json.loads(service_config) if service_config else {}
+    policy = {load_balancing: {}}
+    policies = [policy]
+    if load_balancing == 'round_robin':
+        # gRPC picks the first policy it knows, so versions without outlier
+        # detection fall back to plain round robin.
+        policies.insert(
+            0, {
+                'outlier_detection_experimental':
+                    dict(OUTLIER_DETECTION_CONFIG, childPolicy=[policy])
+            })
+    config['loadBalancingConfig'] = policies
+    return json.dumps(config)
+
+
+def _channel_target_and_options(api_url, options, service_config,
+                                load_balancing):
+    target, authority = make_target(api_url)
+    if load_balancing is None and (authority is not None or
+                                   target.startswith('dns:')):
+        load_balancing = 'round_robin'
+    if load_balancing:
+        service_config = _with_load_balancing(service_config, load_balancing)
+
+    options = list(options or ())
+    if service_config:
+        options += [('grpc.service_config', service_config),
+                    ('grpc.enable_retries', 1)]
+    if authority is not None:
+        options.append(('grpc.default_authority', authority))
+    return target, options
+
+
 def create_channel(
-    api_url: str,
+    api_url: Union[str, Sequence[str]],
     api_key: Optional[str] = None,
     insecure: Optional[bool] = None,
-    additional_headers: Optional[List[Tuple[str, Union[str, bytes]]]] = None,
+    additional_headers: Optional[Headers] = None,
+    options: Optional[Sequence[Tuple[str, Any]]] = None,
+    root_certificates_path: Optional[str] = None,
+    service_config: Optional[str] = DEFAULT_SERVICE_CONFIG,
+    timeouts: Optional[Mapping[str, float]] = DEFAULT_TIMEOUTS,
+    load_balancing: Optional[str] = None,
+    interceptors: Sequence[Any] = (),
 ) -> grpc.Channel:
     """Create gRPC channel.
 
     Args:
-        api_url: AIQ API url.
+        api_url: AIQ API url, or multiple of them, see `make_target`.
         api_key: AIQ API key.
         insecure: Skip server certificate and domain verification.
             If it is None and api_key is specified, insecure is False.
             If it is None and api_key is unspecified, insecure is True.
         additional_headers: custom headers
+        options: gRPC channel arguments.
+        root_certificates_path: PEM file of the root certificates to verify
+            the server with. Defaults to the bundle shipped with grpc.
+        service_config: Service config in JSON with the retry policies of the
+            methods, see `make_service_config`. None disables it.
+        timeouts: Deadline in seconds by full method name of the calls made
+            without a timeout.
+        load_balancing: Load balancing policy, `round_robin` or `pick_first`.
+            Defaults to `round_robin`, with outlier ejection, for multiple
+            endpoints and `dns:` targets, and to `pick_first` otherwise.
+        interceptors: Other interceptors of the channel, e.g. from
+            `metrics_utils.metrics_interceptors`.
 
     Returns:
         grpc.Channel
     """
-    if additional_headers is None:
-        additional_headers = []
+    # Copy the headers so that the list of the caller is never modified.
+    headers = tuple(additional_headers or ())
+    target, options = _channel_target_and_options(api_url, options,
+                                                  service_config,
+                                                  load_balancing)
 
     if insecure is None:
         insecure = not bool(api_key)
 
     if insecure:
-        channel = grpc.insecure_channel(api_url)
+        channel = grpc.insecure_channel(target, options=options)
         if api_key:
-            additional_headers.append(('x-api-key', api_key))
+            headers += (('x-api-key', api_key),)
     else:
-        credentials = create_credentials(api_key)
-        channel = grpc.secure_channel(api_url, credentials)
+        credentials = create_credentials(api_key, root_certificates_path)
+        channel = grpc.secure_channel(target, credentials, options=options)
 
-    if not additional_headers:
+    interceptors = call_details_interceptors(headers,
+                                             timeouts) + list(interceptors)
+    if not interceptors:
         return channel
-
-    interceptors = additional_headers_interceptors(additional_headers)
     return grpc.intercept_channel(channel, *interceptors)
 
 
 def create_aio_channel(
-    api_url: str,
+    api_url: Union[str, Sequence[str]],
     api_key: Optional[str] = None,
     insecure: Optional[bool] = None,
-    additional_headers: Optional[List[Tuple[str, Union[str, bytes]]]] = None,
+    additional_headers: Optional[Headers] = None,
+    options: Optional[Sequence[Tuple[str, Any]]] = None,
+    root_certificates_path: Optional[str] = None,
+    service_config: Optional[str] = DEFAULT_SERVICE_CONFIG,
+    timeouts: Optional[Mapping[str, float]] = DEFAULT_TIMEOUTS,
+    load_balancing: Optional[str] = None,
+    interceptors: Sequence[Any] = (),
 ) -> aio.Channel:
     """Create aio gRPC channel.
 
     Args:
-        api_url: AIQ API url.
+        api_url: AIQ API url, or multiple of them, see `make_target`.
         api_key: AIQ API key.
         insecure: Skip server certificate and domain verification.
             If it is None and api_key is specified, insecure is False.
             If it is None and api_key is unspecified, insecure is True.
         additional_headers: custom headers
+        options: gRPC channel arguments.
+        root_certificates_path: PEM file of the root certificates to verify
+            the server with. Defaults to the bundle shipped with grpc.
+        service_config: Service config in JSON with the retry policies of the
+            methods, see `make_service_config`. None disables it.
+        timeouts: Deadline in seconds by full method name of the calls made
+            without a timeout.
+        load_balancing: Load balancing policy, `round_robin` or `pick_first`.
+            Defaults to `round_robin`, with outlier ejection, for multiple
+            endpoints and `dns:` targets, and to `pick_first` otherwise.
+        interceptors: Other interceptors of the channel, e.g. from
+            `metrics_utils.metrics_interceptors`.
 
     Returns:
         grpc.aio.Channel
@@ -248,19 +675,368 @@ def create_aio_channel(
     if insecure is None:
         insecure = not bool(api_key)
 
-    if additional_headers is None:
-        additional_headers = []
-
+    # Copy the headers so that the list of the caller is never modified.
+    headers = tuple(additional_headers or ())
     if insecure and api_key:
-        additional_headers.append(('x-api-key', api_key))
+        headers += (('x-api-key', api_key),)
 
-    interceptors = []
-    if additional_headers:
-        interceptors.extend(
-            additional_headers_interceptors(additional_headers, is_aio=True))
+    interceptors = call_details_interceptors(
+        headers, timeouts, is_aio=True) + list(interceptors)
+    target, options = _channel_target_and_options(api_url, options,
+                                                  service_config,
+                                                  load_balancing)
 
     if insecure:
-        return aio.insecure_channel(api_url, interceptors=interceptors)
+        return aio.insecure_channel(target,
+                                    options=options,
+                                    interceptors=interceptors)
+
+    credentials = create_credentials(api_key, root_certificates_path)
+    return aio.secure_channel(target,
+                              credentials,
+                              options=options,
+                              interceptors=interceptors)
+
+
+def hedged_call(
+    method: grpc.UnaryUnaryMultiCallable,
+    request: Any,
+    hedging_delay: float,
+    max_attempts: int = 2,
+    timeout: Optional[float] = None,
+    non_fatal_status_codes: Sequence[grpc.StatusCode] = RETRYABLE_STATUS_CODES,
+    **kwargs,
+) -> Any:
+    """Call an idempotent unary method, hedging it when it is slow.
+
+    Another attempt is started whenever no response arrived `hedging_delay`
+    seconds after the previous one, or right away when an attempt fails with
+    a non-fatal status. The first response wins and the other attempts are
+    cancelled, so a single slow replica does not set the tail latency. gRPC
+    parses but does not implement the hedging policy of service configs,
+    hence this client-side version.
+
+    Args:
+        method: Unary-unary method of a stub, e.g. `stub.Recognize`.
+        request: Request message.
+        hedging_delay: Seconds to wait for a response before hedging.
+        max_attempts: Maximum number of attempts, including the first one.
+        timeout: Deadline in seconds of the whole call.
+        non_fatal_status_codes: Status codes after which another attempt is
+            made instead of failing the call.
+        **kwargs: Other arguments of the method, e.g. metadata.
+
+    Returns:
+        Response message.
+
+    Raises:
+        grpc.RpcError: The error of the last attempt if no attempt succeeded.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    done = queue.Queue()
+    attempts = []
+
+    def start():
+        remaining = None if deadline is None else deadline - time.monotonic()
+        future = method.future(request, timeout=remaining, **kwargs)
+        future.add_done_callback(done.put)
+        attempts.append(future)
+
+    try:
+        start()
+        pending = 1
+        while pending:
+            can_hedge = len(attempts) < max_attempts
+            try:
+                future = done.get(timeout=hedging_delay if can_hedge else None)
+                pending -= 1
+                error = future.exception()
+                if error is None:
+                    return future.result()
+                if error.code() not in non_fatal_status_codes:
+                    raise error
+            except queue.Empty:
+                pass
+            # Either no response arrived in time or an attempt failed.
+            if can_hedge:
+                start()
+                pending += 1
+        raise error
+    finally:
+        for future in attempts:
+            future.cancel()
+
+
+async def hedged_call_async(
+    method: aio.UnaryUnaryMultiCallable,
+    request: Any,
+    hedging_delay: float,
+    max_attempts: int = 2,
+    timeout: Optional[float] = None,
+    non_fatal_status_codes: Sequence[grpc.StatusCode] = RETRYABLE_STATUS_CODES,
+    **kwargs,
+) -> Any:
+    """Call an idempotent unary aio method, hedging it when it is slow.
+
+    Takes the same arguments as `hedged_call`.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    attempts = {}
+
+    def start():
+        remaining = None if deadline is None else deadline - time.monotonic()
+        call = method(request, timeout=remaining, **kwargs)
+        task = asyncio.ensure_future(call)
+        attempts[task] = call
+        return task
+
+    try:
+        pending = {start()}
+        while pending:
+            can_hedge = len(attempts) < max_attempts
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=hedging_delay if can_hedge else None,
+                return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error is None:
+                    return task.result()
+                if (not isinstance(error, grpc.RpcError) or
+                        error.code() not in non_fatal_status_codes):
+                    raise error
+            # Either no response arrived in time or an attempt failed.
+            if can_hedge:
+                pending.add(start())
+        raise error
+    finally:
+        for call in attempts.values():
+            call.cancel()
+
+
+class _PooledChannels:
+    """Channels of the same target spread over separate connections."""
+
+    def __init__(self, factory, num_channels: int, is_aio: bool):
+        self._factory = factory
+        self._is_aio = is_aio
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self.channels = [None] * num_channels
+        # Connectivity state of each channel and since when it is in it.
+        self.states = [None] * num_channels
+        self._since = [0.0] * num_channels
+        # When recreating each channel may be tried again after it failed.
+        self._retry_at = [0.0] * num_channels
+        for idx in range(num_channels):
+            self._connect(idx)
+
+    def _connect(self, idx: int, channel=None):
+        if channel is None:
+            channel = self._factory()
+        self.channels[idx] = channel
+        self._set_state(idx, grpc.ChannelConnectivity.IDLE)
+        if self._is_aio:
+            channel.get_state(try_to_connect=True)
+        else:
+            channel.subscribe(
+                lambda state: self._set_state(idx, state, channel),
+                try_to_connect=True)
+
+    def _set_state(self, idx: int, state, channel=None):
+        if channel is not None and channel is not self.channels[idx]:
+            return  # A callback of a replaced channel.
+        if state != self.states[idx]:
+            self.states[idx] = state
+            self._since[idx] = time.monotonic()
+
+    def _check(self, idx: int) -> bool:
+        """Return whether the channel is healthy, recreating it if needed."""
+        if self._is_aio:
+            self._set_state(idx, self.channels[idx].get_state())
+        state = self.states[idx]
+        failing_for = time.monotonic() - self._since[idx]
+        if ((state == grpc.ChannelConnectivity.SHUTDOWN or
+             (state == grpc.ChannelConnectivity.TRANSIENT_FAILURE and
+              failing_for > RECONNECT_AFTER_SECONDS)) and
+                time.monotonic() >= self._retry_at[idx]):
+            try:
+                channel = self._factory()
+            except socket.gaierror as e:
+                # The endpoints of multiple AIQ urls are resolved when the
+                # channel is created. Keep the old channel, and try again
+                # after a while.
+                logging.warning('Failed to recreate channel %d: %s', idx, e)
+                self._retry_at[idx] = (time.monotonic() +
+                                       RECONNECT_AFTER_SECONDS)
+            else:
+                self._close(self.channels[idx])
+                self._connect(idx, channel)
+        return self.states[idx] not in (
+            grpc.ChannelConnectivity.TRANSIENT_FAILURE,
+            grpc.ChannelConnectivity.SHUTDOWN)
+
+    def _close(self, channel):
+        if self._is_aio:
+            asyncio.ensure_future(channel.close())
+        else:
+            channel.close()
+
+    def pick(self):
+        """Return the next healthy channel in round robin order.
+
+        If no channel is healthy, the next channel is returned anyway and gRPC
+        reports the connection failure on the call.
+        """
+        with self._lock:
+            start = next(self._counter)
+            num_channels = len(self.channels)
+            for offset in range(num_channels):
+                idx = (start + offset) % num_channels
+                if self._check(idx):
+                    return self.channels[idx]
+            return self.channels[start % num_channels]
+
+    def close(self):
+        """Close all channels."""
+        for channel in self.channels:
+            channel.close()
+
+    async def aclose(self):
+        """Close all aio channels."""
+        for channel in self.channels:
+            await channel.close()
+
+
+class ChannelPool:
+    """Process-wide pool of warm channels.
+
+    Channels are keyed by everything that affects how they are created, so
+    repeated requests for the same endpoint reuse established TLS connections
+    instead of performing a handshake each time.
+    """
+
+    def __init__(self, is_aio: bool = False):
+        self._is_aio = is_aio
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(
+        self,
+        api_url: Union[str, Sequence[str]],
+        api_key: Optional[str] = None,
+        insecure: Optional[bool] = None,
+        additional_headers: Optional[Headers] = None,
+        options: Optional[Sequence[Tuple[str, Any]]] = None,
+        root_certificates_path: Optional[str] = None,
+        service_config: Optional[str] = DEFAULT_SERVICE_CONFIG,
+        timeouts: Optional[Mapping[str, float]] = DEFAULT_TIMEOUTS,
+        load_balancing: Optional[str] = None,
+        interceptors: Sequence[Any] = (),
+        num_channels: int = 1,
+    ):
+        """Return a pooled channel, creating the pool entry if needed.
+
+        Args:
+            api_url: AIQ API url, or multiple of them.
+            api_key: AIQ API key.
+            insecure: Skip server certificate and domain verification.
+            additional_headers: custom headers
+            options: gRPC channel arguments on top of POOLED_CHANNEL_OPTIONS.
+            root_certificates_path: PEM file of the root certificates.
+            service_config: Service config in JSON.
+            timeouts: Deadline in seconds by full method name.
+            load_balancing: Load balancing policy.
+            interceptors: Other interceptors of the channels.
+            num_channels: Number of channels, each on its own connection, to
+                spread the calls over.
+
+        Returns:
+            grpc.Channel, or grpc.aio.Channel for an aio pool.
+        """
+        headers = tuple(additional_headers or ())
+        options = tuple(options or ())
+        if not isinstance(api_url, str):
+            api_url = tuple(api_url)
+        key = (api_url, api_key, insecure, headers, options,
+               root_certificates_path, service_config,
+               tuple(sorted((timeouts or {}).items())), load_balancing,
+               tuple(interceptors), num_channels)
+        if self._is_aio:
+            # aio channels are bound to the event loop they are created in.
+            key += (asyncio.get_running_loop(),)
+
+        def factory():
+            create = create_aio_channel if self._is_aio else create_channel
+            return create(api_url,
+                          api_key=api_key,
+                          insecure=insecure,
+                          additional_headers=headers,
+                          options=POOLED_CHANNEL_OPTIONS + options,
+                          root_certificates_path=root_certificates_path,
+                          service_config=service_config,
+                          timeouts=timeouts,
+                          load_balancing=load_balancing,
+                          interceptors=interceptors)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _PooledChannels(factory, num_channels, self._is_aio)
+                self._entries[key] = entry
+        return entry.pick()
+
+    def states(self):
+        """Return the connectivity state of every pooled channel by target."""
+        with self._lock:
+            return {
+                key[0]: [state.name if state else None for state in entry.states
+                        ] for key, entry in self._entries.items()
+            }
+
+    def _pop_entries(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        return entries
+
+    def close(self):
+        """Close and forget all pooled channels."""
+        for entry in self._pop_entries():
+            entry.close()
+
+    async def aclose(self):
+        """Close and forget all pooled aio channels."""
+        for entry in self._pop_entries():
+            await entry.aclose()
+
+
+_CHANNEL_POOL = ChannelPool()
+_AIO_CHANNEL_POOL = ChannelPool(is_aio=True)
+
+
+def get_channel(api_url: Union[str, Sequence[str]], **kwargs) -> grpc.Channel:
+    """Return a channel from the process-wide pool.
+
+    Takes the same arguments as `ChannelPool.get`.
+    """
+    return _CHANNEL_POOL.get(api_url, **kwargs)
+
+
+def get_aio_channel(api_url: Union[str, Sequence[str]],
+                    **kwargs) -> aio.Channel:
+    """Return an aio channel from the process-wide pool of the running loop.
+
+    Takes the same arguments as `ChannelPool.get`.
+    """
+    return _AIO_CHANNEL_POOL.get(api_url, **kwargs)
+
+
+def close_channels():
+    """Close all pooled channels."""
+    _CHANNEL_POOL.close()
+
 
-    credentials = create_credentials(api_key)
-    return aio.secure_channel(api_url, credentials, interceptors=interceptors)
+async def close_aio_channels():
+    """Close all pooled aio channels."""
+    await _AIO_CHANNEL_POOL.aclose()
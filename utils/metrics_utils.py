@@ -0,0 +1,380 @@
+"""Client-side metrics of AIQ API calls.
+
+`metrics_interceptors` records, for each method, the latency of calls, the
+time to the first streamed response and to the first final recognition
+result, the bytes sent and received, and the status codes. The metrics can be
+scraped by Prometheus from `serve_prometheus`, or appended as JSON lines by
+`JsonLinesExporter`, standing in for an OTLP collector.
+"""
+
+import asyncio
+import bisect
+import http.server
+import json
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+import grpc
+
+import grpc_utils
+
+# Upper bounds in seconds of the latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0, 120.0)
+
+
+class Histogram:
+    """Cumulative histogram in the Prometheus model."""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by linear interpolation within its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Metrics:
+    """Thread-safe registry of the metrics of AIQ API calls by method."""
+
+    # Name, type and help of each metric family.
+    FAMILIES = (
+        ('aiq_client_call_duration_seconds', 'histogram',
+         'Duration of calls until their status is received.'),
+        ('aiq_client_first_response_seconds', 'histogram',
+         'Time from the start of streaming calls to their first response.'),
+        ('aiq_client_first_final_result_seconds', 'histogram',
+         'Time from the start of streaming calls to their first final '
+         'recognition result.'),
+        ('aiq_client_sent_bytes_total', 'counter',
+         'Serialized size of the request messages.'),
+        ('aiq_client_received_bytes_total', 'counter',
+         'Serialized size of the response messages.'),
+        ('aiq_client_calls_total', 'counter',
+         'Finished calls by status code.'),
+        ('aiq_client_cache_requests_total', 'counter',
+         'Cache lookups by result: memory_hit, disk_hit, coalesced or miss.'),
+        ('aiq_client_cache_bytes_total', 'counter',
+         'Bytes served from and stored to the cache.'),
+    )
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, name: str, method: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.get((name, method))
+            if histogram is None:
+                histogram = Histogram(self._buckets)
+                self._histograms[(name, method)] = histogram
+            histogram.observe(seconds)
+
+    def add(self, name: str, labels: Tuple[Tuple[str, str], ...],
+            value: float):
+        with self._lock:
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def histogram(self, name: str, method: str) -> Optional[Histogram]:
+        return self._histograms.get((name, method))
+
+    def to_prometheus(self) -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, kind, help_text in self.FAMILIES:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                if kind == 'histogram':
+                    for (family, method), histogram in sorted(
+                            self._histograms.items()):
+                        if family == name:
+                            lines.extend(
+                                _histogram_lines(name, method, histogram))
+                else:
+                    for (family, labels), value in sorted(
+                            self._counters.items()):
+                        if family == name:
+                            lines.append(f'{name}{_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self) -> Dict:
+        """Return a JSON serializable snapshot of the metrics."""
+        with self._lock:
+            histograms = [{
+                'name': name,
+                'method': method,
+                'count': histogram.count,
+                'sum': histogram.sum,
+                'p50': histogram.quantile(0.5),
+                'p95': histogram.quantile(0.95),
+                'p99': histogram.quantile(0.99),
+                'buckets': dict(
+                    zip(map(str, histogram.buckets + (float('inf'),)),
+                        histogram.counts)),
+            } for (name, method), histogram in sorted(self._histograms.items())]
+            counters = [
+                dict(labels, name=name, value=value)
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+        return {
+            'time': time.time(),
+            'histograms': histograms,
+            'counters': counters
+        }
+
+
+def _labels(labels):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+def _histogram_lines(name, method, histogram):
+    cumulative = 0
+    for bound, count in zip(histogram.buckets + (float('inf'),),
+                            histogram.counts):
+        cumulative += count
+        le = '+Inf' if bound == float('inf') else repr(bound)
+        yield f'{name}_bucket{{method="{method}",le="{le}"}} {cumulative}'
+    yield f'{name}_sum{{method="{method}"}} {histogram.sum}'
+    yield f'{name}_count{{method="{method}"}} {histogram.count}'
+
+
+class _CallObserver:
+    """Record the metrics of a single call."""
+
+    def __init__(self, metrics, method):
+        self._metrics = metrics
+        self._method = method.decode() if isinstance(method, bytes) else method
+        self._start_time = time.perf_counter()
+        self._sent_bytes = 0
+        self._received_bytes = 0
+        self._first_response = True
+        self._first_final = True
+
+    def sent(self, request):
+        self._sent_bytes += request.ByteSize()
+
+    def received(self, response):
+        self._received_bytes += response.ByteSize()
+
+    def streamed(self, response):
+        self.received(response)
+        elapsed = time.perf_counter() - self._start_time
+        if self._first_response:
+            self._first_response = False
+            self._metrics.observe('aiq_client_first_response_seconds',
+                                  self._method, elapsed)
+        if self._first_final and any(
+                result.is_final for result in getattr(response, 'results', ())
+                if hasattr(result, 'is_final')):
+            self._first_final = False
+            self._metrics.observe('aiq_client_first_final_result_seconds',
+                                  self._method, elapsed)
+
+    def finished(self, code):
+        elapsed = time.perf_counter() - self._start_time
+        method = (('method', self._method),)
+        self._metrics.observe('aiq_client_call_duration_seconds',
+                              self._method, elapsed)
+        self._metrics.add('aiq_client_sent_bytes_total', method,
+                          self._sent_bytes)
+        self._metrics.add('aiq_client_received_bytes_total', method,
+                          self._received_bytes)
+        self._metrics.add('aiq_client_calls_total',
+                          method + (('code', code.name),), 1)
+
+    def requests(self, request_iterator):
+        for request in request_iterator:
+            self.sent(request)
+            yield request
+
+    async def requests_async(self, request_iterator):
+        async for request in request_iterator:
+            self.sent(request)
+            yield request
+
+    def responses(self, call):
+        try:
+            for response in call:
+                self.streamed(response)
+                yield response
+        except grpc.RpcError as e:
+            self.finished(e.code())
+            raise
+        self.finished(call.code())
+
+    async def responses_async(self, call):
+        try:
+            async for response in call:
+                self.streamed(response)
+                yield response
+        except grpc.RpcError as e:
+            self.finished(e.code())
+            raise
+        self.finished(await call.code())
+
+    def unary_done(self, call):
+        code = call.code()
+        if code == grpc.StatusCode.OK:
+            self.received(call.result())
+        self.finished(code)
+
+    async def unary_done_async(self, call):
+        try:
+            self.received(await call)
+        except (grpc.RpcError, asyncio.CancelledError):
+            pass
+        self.finished(await call.code())
+
+
+class _ObservedResponses:
+    """Response iterator of a sync streaming call, keeping its Call methods."""
+
+    def __init__(self, call, responses):
+        self._call = call
+        self._responses = responses
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._responses)
+
+    def __getattr__(self, name):
+        return getattr(self._call, name)
+
+
+def metrics_interceptors(metrics: Metrics, is_aio: bool = False):
+    """Return interceptors which record the metrics of each call.
+
+    Args:
+        metrics: Metrics to record to.
+        is_aio: A flag indicating if interceptor is for aio.
+
+    Returns:
+        List of interceptors.
+    """
+    # aio tasks observing unary calls, referenced until they finish.
+    tasks = set()
+
+    def _intercept_call(client_call_details, request_iterator,
+                        request_streaming, response_streaming):
+        observer = _CallObserver(metrics, client_call_details.method)
+        if not request_streaming:
+            request = next(request_iterator)
+            observer.sent(request)
+            request_iterator = iter((request,))
+        elif hasattr(request_iterator, '__aiter__'):
+            request_iterator = observer.requests_async(request_iterator)
+        elif request_iterator is not None:
+            request_iterator = observer.requests(request_iterator)
+
+        def postprocess(call):
+            if response_streaming:
+                if is_aio:
+                    return observer.responses_async(call)
+                return _ObservedResponses(call, observer.responses(call))
+            if is_aio:
+                task = asyncio.ensure_future(observer.unary_done_async(call))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            else:
+                call.add_done_callback(observer.unary_done)
+            return call
+
+        return client_call_details, request_iterator, postprocess
+
+    if not is_aio:
+        return [grpc_utils.GenericClientInterceptor(_intercept_call)]
+    return [
+        grpc_utils.AsyncUnaryUnaryClientInterceptor(_intercept_call),
+        grpc_utils.AsyncUnaryStreamClientInterceptor(_intercept_call),
+        grpc_utils.AsyncStreamUnaryClientInterceptor(_intercept_call),
+        grpc_utils.AsyncStreamStreamClientInterceptor(_intercept_call),
+    ]
+
+
+def serve_prometheus(metrics: Metrics,
+                     port: int,
+                     host: str = 'localhost') -> http.server.HTTPServer:
+    """Serve the metrics at `http://<host>:<port>/metrics` in a thread.
+
+    Args:
+        metrics: Metrics to serve.
+        port: Port to listen on.
+        host: Host address to listen on.
+
+    Returns:
+        The HTTP server. Call `shutdown()` to stop it.
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type',
+                             'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            del args  # Unused
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class JsonLinesExporter:
+    """Append a snapshot of the metrics to a JSON lines file periodically.
+
+    A final snapshot is written when the exporter is closed.
+    """
+
+    def __init__(self, metrics: Metrics, path: str, interval: float = 10.0):
+        self._metrics = metrics
+        self._path = path
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def export(self):
+        with open(self._path, 'a', encoding='utf-8') as output_file:
+            output_file.write(json.dumps(self._metrics.to_dict()) + '\n')
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self.export()
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join()
+        self.export()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+r"""
+Measure the import and startup time of the example entry points.
+
+Each script is imported (without running its main) in fresh interpreters with
+`-X importtime`, and the wall time of the whole process and the heaviest
+imports are reported. The time of an empty interpreter is reported as the
+baseline.
+
+Usage:
+    $ cd stt
+    $ python ../utils/startup_profile.py \
+        --scripts recognize.py,streaming_recognize.py --runs 5
+"""
+
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from absl import app
+from absl import flags
+
+flags.DEFINE_list('scripts', None, 'Scripts to profile.')
+flags.DEFINE_integer('runs', 5, 'Number of runs per script.')
+flags.DEFINE_integer('top', 10, 'Number of heaviest imports to report.')
+FLAGS = flags.FLAGS
+
+_IMPORT_TIME_PATTERN = re.compile(
+    r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def profile(module):
+    """Import `module` in a fresh interpreter with import timing enabled.
+
+    Args:
+        module: Module name to import, or None for an empty interpreter.
+
+    Returns:
+        Tuple of the wall time in seconds and a dict of the cumulative import
+        time in seconds of each module imported directly by `module`.
+    """
+    code = f'import {module}' if module else 'pass'
+    start_time = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                             stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE,
+                             check=True,
+                             text=True)
+    wall_time = time.perf_counter() - start_time
+
+    # Lines are printed once a module is imported, i.e. children first. Direct
+    # imports are indented by one level more than the top level module.
+    imports = {}
+    children = {}
+    for line in process.stderr.splitlines():
+        match = _IMPORT_TIME_PATTERN.match(line)
+        if not match:
+            continue
+        seconds = int(match.group(2)) / 1e6
+        depth = len(match.group(3)) // 2
+        if depth == 1:
+            children[match.group(4)] = seconds
+        elif depth == 0:
+            if match.group(4) == module:
+                imports = children
+            children = {}
+    return wall_time, imports
+
+
+def main(args):
+    del args  # Unused
+
+    baseline = statistics.median(
+        profile(None)[0] for _ in range(FLAGS.runs))
+    print(f'python: {baseline * 1000:.1f}ms')
+
+    for script in FLAGS.scripts:
+        module = os.path.splitext(os.path.basename(script))[0]
+        wall_times = []
+        imports = {}
+        for _ in range(FLAGS.runs):
+            wall_time, run_imports = profile(module)
+            wall_times.append(wall_time)
+            for name, seconds in run_imports.items():
+                imports.setdefault(name, []).append(seconds)
+
+        wall_time = statistics.median(wall_times)
+        print(f'\n{script}: {wall_time * 1000:.1f}ms '
+              f'(+{(wall_time - baseline) * 1000:.1f}ms over python)')
+        heaviest = sorted(((statistics.median(seconds), name)
+                           for name, seconds in imports.items()),
+                          reverse=True)[:FLAGS.top]
+        for seconds, name in heaviest:
+            print(f'  {seconds * 1000:8.1f}ms  {name}')
+
+
+if __name__ == '__main__':
+    flags.mark_flags_as_required(['scripts'])
+    app.run(main)